@@ -0,0 +1,21 @@
+"""
+benchmarks
+----------
+
+Micro-benchmarks for the hot paths in pircel. Each module is runnable on its own, e.g.:
+
+    python -m benchmarks.bench_parser --lines 200000
+
+Where a benchmark takes a `--corpus` it should be a file of raw lines as received from the server (one per line); if
+none is given a synthetic corpus from `benchmarks.corpus` is used instead.
+
+`benchmarks.suite` runs the whole set of traffic scenarios (JOIN floods, NAMES bursts, PRIVMSG storms, mixed encodings)
+through `benchmarks.harness` and can write the results as JSON, which `benchmarks.compare` diffs between releases:
+
+    python -m benchmarks.suite --json before.json
+    (upgrade)
+    python -m benchmarks.suite --json after.json
+    python -m benchmarks.compare before.json after.json
+
+Recorded traffic can be anonymized for sharing with `python -m benchmarks.corpus recorded.log anonymized.log`.
+"""
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_analysis
+-------------------------
+
+Writes a corpus out as a log file, reads it into `pircel.analysis.Columns` (with `--processes` worker processes) and
+reports the throughput in MB/s and GB/min, then times each of the numpy aggregations over the result.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from pircel import analysis
+
+from benchmarks import corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    corpus.add_arguments(parser, default_lines=1000000)
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Worker processes (1 for none)')
+    parser.add_argument('--chunk-size', type=int, default=16, help='MiB of the log per chunk')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'irc.log')
+        with open(path, 'wb') as log_file:
+            log_file.writelines(corpus.from_arguments(args))
+        size = os.path.getsize(path)
+
+        for processes in sorted({1, args.processes}):
+            start = time.perf_counter()
+            columns = analysis.read_file(path, processes=processes, chunk_size=args.chunk_size * 2 ** 20)
+            elapsed = time.perf_counter() - start
+            print('{} processes: {} lines ({:.0f} MB) in {:.2f}s, {:.1f} MB/s, {:.2f} GB/min'.format(
+                processes, len(columns), size / 1e6, elapsed, size / elapsed / 1e6, size / elapsed * 60 / 1e9))
+
+    for name, aggregate in (('channel_activity', analysis.channel_activity),
+                            ('top_talkers', analysis.top_talkers),
+                            ('activity_over_time', analysis.activity_over_time),
+                            ('nick_churn', analysis.nick_churn)):
+        start = time.perf_counter()
+        aggregate(columns)
+        print('{}: {:.1f}ms'.format(name, (time.perf_counter() - start) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_history
+------------------------
+
+Feeds a corpus spread over lots of channels through a server handler with a `pircel.history.HistoryCache` attached,
+then reports how fast lines went in, how long fetching the last `--limit` lines of a channel takes, and how much memory
+the cache really uses (measured with tracemalloc) against its own estimate and the budget.
+"""
+import argparse
+import logging
+import random
+import time
+import tracemalloc
+import types
+
+from pircel import history, protocol
+
+from benchmarks import corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    corpus.add_arguments(parser, default_lines=500000)
+    parser.add_argument('--channels', type=int, default=10000, help='Channels in the synthetic corpus')
+    parser.add_argument('--capacity', type=int, default=200, help='Lines kept per channel')
+    parser.add_argument('--budget', type=int, default=128, help='Memory budget in MiB')
+    parser.add_argument('--limit', type=int, default=200, help='Lines to fetch per query')
+    parser.add_argument('--queries', type=int, default=10000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    if args.corpus:
+        lines = corpus.load(args.corpus, args.lines)
+    else:
+        lines = corpus.synthetic(args.lines, n_channels=args.channels)
+
+    def fill(cache):
+        identity = types.SimpleNamespace(nick='pircel', username='pircel', realname='Percy Wendel')
+        server_handler = protocol.IRCServerHandler(identity)
+        server_handler.write_function = lambda line: None
+        server_handler.log_unhandled = lambda line: None
+        cache.attach(server_handler)
+        start = time.perf_counter()
+        server_handler.handle_lines(lines)
+        return time.perf_counter() - start
+
+    budget = args.budget * 2 ** 20
+    elapsed = fill(history.HistoryCache(capacity=args.capacity, max_bytes=budget))
+    print('{} lines in {:.2f}s, {:.0f} lines/s (including parsing)'.format(len(lines), elapsed, len(lines) / elapsed))
+
+    # Again with tracemalloc watching, which slows everything down too much to time it
+    tracemalloc.start()
+    cache = history.HistoryCache(capacity=args.capacity, max_bytes=budget)
+    fill(cache)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print('{} channels kept, {} evicted, estimated {:.1f} MiB, measured {:.1f} MiB, budget {} MiB'.format(
+        len(cache), cache.evicted, cache.size / 2 ** 20, used / 2 ** 20, args.budget))
+
+    channels = cache.channels()
+    timings = []
+    for channel in random.Random(0).choices(channels, k=args.queries):
+        start = time.perf_counter()
+        for line in cache.recent(channel, args.limit):
+            pass
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print('last {} lines: p50 {:.1f}us  p99 {:.1f}us'.format(
+        args.limit, timings[len(timings) // 2] * 1e6, timings[int(len(timings) * 0.99)] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
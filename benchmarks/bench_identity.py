@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_identity
+-------------------------
+
+Compares splitting every message prefix into nick, username and host afresh with the cached `parse_identity`.
+
+Reports the time per prefix and how much memory the results take if they're all kept (as a log or state tracker
+would), along with the cache's hit rate.
+"""
+import argparse
+import timeit
+import tracemalloc
+
+from pircel import protocol
+
+from benchmarks import corpus
+
+
+def split_identity(who):
+    """ What `parse_identity` used to do (minus the crash on server prefixes). """
+    nick, _, rest = who.partition('!')
+    username, _, host = rest.partition('@')
+    if username.startswith('~'):
+        username = username[1:]
+    return nick, username, host
+
+
+def retained(function, prefixes):
+    tracemalloc.start()
+    results = [function(prefix) for prefix in prefixes]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    corpus.add_arguments(parser, default_lines=500000)
+    parser.add_argument('--users', type=int, default=50000, help='Users in the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    lines = corpus.load(args.corpus, args.lines) if args.corpus else corpus.synthetic(args.lines, n_users=args.users)
+    # Each line gets its own prefix string, like they do coming off the wire
+    prefixes = [protocol.parse_message(line.decode('utf8')).prefix for line in lines]
+    prefixes = [prefix for prefix in prefixes if prefix]
+
+    for name, function in (('split', split_identity), ('parse_identity', protocol.parse_identity)):
+        protocol.parse_identity.cache_clear()
+        best = min(timeit.repeat(lambda: [function(prefix) for prefix in prefixes], number=1, repeat=args.repeat))
+        protocol.parse_identity.cache_clear()
+        size, peak = retained(function, prefixes)
+        print('{:>15}: {:.3f} us/prefix, {:>6.1f} MiB kept, {:>6.1f} MiB peak'.format(
+            name, best / len(prefixes) * 1e6, size / 2 ** 20, peak / 2 ** 20))
+
+    stats = protocol.identity_cache_stats()
+    print('cache: {:.1%} hit rate, {} entries'.format(stats['hit_rate'], stats['size']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_import
+-----------------------
+
+Times how long a fresh interpreter takes to import `pircel.protocol`, against a bare interpreter and against importing
+chardet alongside it (what importing `pircel.protocol` used to cost, before chardet was only imported when needed).
+
+Bytecode is written to a temporary directory (and the first run of each thrown away) so the times are for a cold start
+with the `.pyc` files in place, like an installed package, rather than compiling everything every time.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+runs = (
+    ('interpreter', 'pass'),
+    ('pircel.protocol', 'import pircel.protocol'),
+    ('pircel.protocol + chardet', 'import chardet, pircel.protocol'),
+)
+
+
+def start(code, pycache_prefix):
+    """ Returns the time taken to start an interpreter, run `code` and exit. """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    begin = time.perf_counter()
+    subprocess.check_call([sys.executable, '-X', 'pycache_prefix={}'.format(pycache_prefix), '-c', code], env=env)
+    return time.perf_counter() - begin
+
+
+def import_times(module, pycache_prefix):
+    """ Returns the `-X importtime` report for `module` as `(cumulative_us, name)` pairs, slowest first. """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-X', 'pycache_prefix={}'.format(pycache_prefix),
+                             '-c', 'import {}'.format(module)], env=env, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True).stderr
+    times = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split('|')
+        times.append((int(cumulative), name.strip()))
+    return sorted(times, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--detail', action='store_true', help='Also show the slowest imports under pircel.protocol')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pycache_prefix:
+        for name, code in runs:
+            start(code, pycache_prefix)
+            times = [start(code, pycache_prefix) for _ in range(args.repeat)]
+            print('{:>26}: median {:>6.1f}ms  best {:>6.1f}ms'.format(
+                name, statistics.median(times) * 1e3, min(times) * 1e3))
+
+        if args.detail:
+            for cumulative, name in import_times('pircel.protocol', pycache_prefix)[:10]:
+                print('{:>26}: {:>6.1f}ms'.format(name, cumulative / 1e3))
+
+
+if __name__ == '__main__':
+    main()
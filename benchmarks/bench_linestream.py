@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_linestream
+---------------------------
+
+Replays a burst of lines through `pircel.tornado_adapter.LineStream` over a local socket pair, once reading line by line
+and once reading in batches.
+"""
+import argparse
+import asyncio
+import logging
+import socket
+import threading
+import time
+from unittest import mock
+
+from tornado import iostream
+
+from pircel import protocol, tornado_adapter
+
+from benchmarks import corpus
+
+
+def replay(lines, batched, handler=False):
+    """ Returns how long it took the stream to deliver all of `lines` to its callback(s). """
+    return asyncio.run(_replay(lines, batched, handler))
+
+
+async def _replay(lines, batched, handler):
+    done = asyncio.get_running_loop().create_future()
+    ours, theirs = socket.socketpair()
+
+    line_stream = tornado_adapter.LineStream(batched=batched)
+    line_stream.connection = iostream.IOStream(ours)
+
+    expected = len(lines)
+    received = [0]
+    server_handler = protocol.IRCServerHandler(mock.MagicMock())
+    server_handler.write_function = lambda line: None
+
+    def line_callback(line):
+        if handler:
+            server_handler.handle_line(line)
+        received[0] += 1
+        if received[0] == expected:
+            done.set_result(None)
+    line_stream.line_callback = line_callback
+
+    writer = threading.Thread(target=theirs.sendall, args=(b''.join(lines),))
+
+    start = time.perf_counter()
+    writer.start()
+    line_stream.start_reading()
+    await done
+    elapsed = time.perf_counter() - start
+
+    writer.join()
+    line_stream.connection.close()
+    theirs.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    corpus.add_arguments(parser)
+    parser.add_argument('--handler', action='store_true', help='Also run every line through an IRCServerHandler')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    lines = corpus.from_arguments(args)
+    for name, batched in (('read_until', False), ('batched', True)):
+        elapsed = replay(lines, batched, args.handler)
+        print('{:>10}: {:>10.0f} lines/s  {:.3f}s total'.format(name, len(lines) / elapsed, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_manager
+------------------------
+
+Connects lots of clients through one `pircel.manager.ConnectionManager` to a local fake server and reports how long it
+took for them all to register and join a channel, how many timers were on the loop and how much memory was used.
+"""
+import argparse
+import asyncio
+import logging
+import resource
+import time
+from unittest import mock
+
+from pircel import manager, protocol
+
+from tests import fake_server
+
+
+def make_server_handler(nick):
+    identity = mock.MagicMock()
+    identity.nick = nick
+    identity.username = 'pircel'
+    identity.realname = 'Percy Wendel'
+    return protocol.IRCServerHandler(identity)
+
+
+async def run(n_connections, stagger):
+    loop = asyncio.get_running_loop()
+    server = await fake_server.FakeIRCServer().start()
+    connection_manager = manager.ConnectionManager(connect_stagger=stagger, ping_interval=1, tick=0.1)
+    for i in range(n_connections):
+        connection_manager.add(make_server_handler('bot{}'.format(i)), '127.0.0.1', server.port, secure=False,
+                               channels=['#bench'])
+
+    start = time.perf_counter()
+    connection_manager.start()
+    await server.wait_for(lambda lines: lines.count('JOIN #bench') == n_connections, timeout=600)
+    elapsed = time.perf_counter() - start
+
+    # Let a round of pings happen so every connection has a ping timer in the wheel
+    await asyncio.sleep(1.5)
+    stats = connection_manager.stats()
+    loop_timers = len(loop._scheduled)  # no public API for this
+
+    connection_manager.close()
+    await server.stop()
+    return elapsed, stats, loop_timers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--stagger', type=float, default=0.001, help='Seconds between connection attempts')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    elapsed, stats, loop_timers = asyncio.run(run(args.connections, args.stagger))
+    print('{} connections registered and joined in {:.2f}s'.format(args.connections, elapsed))
+    print('timers on the loop: {}, timers in the wheel: {}'.format(loop_timers, stats['timers']))
+    print('lines in: {lines_in}, lines out: {lines_out}, reconnects: {reconnects}'.format(**stats))
+    print('peak RSS (including the fake server): {:.1f} MiB'.format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_parser
+-----------------------
+
+Compares `pircel.protocol.parse_message` with the old `split_irc_line` based parsing, and decoding every line up front
+with the bytes pipeline (`parse_message_bytes`, decoding only the messages something wants) through a server handler
+with a PRIVMSG callback.
+"""
+import argparse
+import timeit
+from unittest import mock
+
+from pircel import protocol
+
+from benchmarks import corpus
+
+
+def old_parse(line):
+    return protocol.split_irc_line(protocol.decode(line).strip())
+
+
+def new_parse(line):
+    return protocol.parse_message(protocol.decode(line))
+
+
+def make_server_handler():
+    server_handler = protocol.IRCServerHandler(mock.MagicMock())
+    server_handler.write_function = lambda line: None
+    server_handler.log_unhandled = lambda line: None
+    server_handler.add_callback('privmsg', lambda sender, prefix, args: None, weak=False)
+    return server_handler
+
+
+def decode_first(server_handler):
+    """ What `handle_line` used to do, decode the whole line then parse it. """
+    decode = server_handler.decoder.decode
+    handle_line = server_handler.handle_line
+    return lambda line: handle_line(decode(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    corpus.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    lines = corpus.from_arguments(args)
+    # split_irc_line can't deal with tags so give it the same lines with them removed
+    untagged = [line.split(b' ', 1)[1] if line.startswith(b'@') else line for line in lines]
+
+    runs = (
+        ('split_irc_line', old_parse, untagged),
+        ('parse_message', new_parse, untagged),
+        ('parse_message (with tags)', new_parse, lines),
+        ('parse_message_bytes', protocol.parse_message_bytes, lines),
+        ('dispatch, decode first', decode_first(make_server_handler()), lines),
+        ('dispatch, bytes', make_server_handler().handle_line, lines),
+    )
+    for name, function, data in runs:
+        best = min(timeit.repeat(lambda: [function(line) for line in data], number=1, repeat=args.repeat))
+        print('{:>26}: {:>10.0f} lines/s  {:.3f} us/line'.format(name, len(data) / best, best / len(data) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_router
+-----------------------
+
+Dispatches PRIVMSGs to a bot with `--commands` commands (half `!command` prefixes, half patterns), once with a
+`pircel.router.Router` and once the old way, a `privmsg` receiver per command that checks the text itself, and reports
+lines/s for each as the number of commands grows.
+"""
+import argparse
+import logging
+import random
+import re
+import time
+import types
+
+from pircel import protocol, router
+
+from benchmarks import corpus
+
+
+def _server_handler():
+    identity = types.SimpleNamespace(nick='pircel', username='pircel', realname='Percy Wendel')
+    server_handler = protocol.IRCServerHandler(identity)
+    server_handler.write_function = lambda line: None
+    server_handler.log_unhandled = lambda line: None
+    return server_handler
+
+
+def _lines(n_lines, n_commands, seed=0):
+    """ PRIVMSGs, one in ten of which is a bot command. """
+    rng = random.Random(seed)
+    lines = []
+    for line in corpus.synthetic(n_lines * 2):
+        if b' PRIVMSG ' not in line or line.startswith(b'@'):
+            continue
+        if rng.random() < 0.1:
+            prefix, _, _ = line.rpartition(b' :')
+            line = prefix + ' :!command{} args\r\n'.format(rng.randrange(n_commands)).encode()
+        lines.append(line)
+        if len(lines) == n_lines:
+            break
+    return lines
+
+
+def _routes(n_commands):
+    for i in range(n_commands):
+        if i % 2:
+            yield None, r'^!command{}\b'.format(i)
+        else:
+            yield '!command{} '.format(i), None
+
+
+def time_router(lines, n_commands):
+    server_handler = _server_handler()
+    message_router = router.Router(server_handler)
+    for prefix, pattern in _routes(n_commands):
+        message_router.add_route(lambda sender, prefix, args, match: None, prefix=prefix, pattern=pattern)
+    start = time.perf_counter()
+    server_handler.handle_lines(lines)
+    elapsed = time.perf_counter() - start
+    message_router.clear()
+    return elapsed
+
+
+def time_receivers(lines, n_commands):
+    server_handler = _server_handler()
+    receivers = []
+    for prefix, pattern in _routes(n_commands):
+        if pattern is not None:
+            def receiver(sender, prefix, args, search=re.compile(pattern).search):
+                if search(args[-1]):
+                    pass
+        else:
+            def receiver(sender, prefix, args, command=prefix):
+                if args[-1].startswith(command):
+                    pass
+        receivers.append(receiver)
+        server_handler.add_callback('privmsg', receiver, weak=False)
+    start = time.perf_counter()
+    server_handler.handle_lines(lines)
+    elapsed = time.perf_counter() - start
+    for receiver in receivers:
+        server_handler.remove_callback('privmsg', receiver)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=50000)
+    parser.add_argument('--commands', type=int, nargs='+', default=[1, 10, 100, 300])
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    for n_commands in args.commands:
+        lines = _lines(args.lines, n_commands)
+        routed = time_router(lines, n_commands)
+        received = time_receivers(lines, n_commands)
+        print('{:4} commands: router {:8.0f} lines/s   receiver per command {:8.0f} lines/s'.format(
+            n_commands, len(lines) / routed, len(lines) / received))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_scrollback
+---------------------------
+
+Appends `--lines` lines spread over `--channels` channels to a `pircel.scrollback.ScrollbackStore` and reports the
+append rate, then the latency of "last N lines of a channel before T" queries at random times, with a cold page cache
+for the first query of each run after reopening the store.
+
+The target is 100M lines (`--lines 100000000`, about 12GB of disk and a while to write), the default is smaller.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from pircel import scrollback
+
+from benchmarks import corpus
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=2000000)
+    parser.add_argument('--channels', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=100, help='How many lines each query asks for')
+    parser.add_argument('--directory', help='Where to put the files (default a temporary directory)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    texts = [corpus._text(rng) for _ in range(1000)]
+    prefixes = [corpus._mask('user{}'.format(i)) for i in range(1000)]
+    channels = ['#chan{}'.format(i) for i in range(args.channels)]
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        store = scrollback.ScrollbackStore(directory, 'bench')
+        append = store.append
+        start = time.perf_counter()
+        for i in range(args.lines):
+            append('privmsg', channels[i % args.channels], prefixes[i % 997], texts[i % 1000], timestamp=i)
+        store.flush()
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print('append: {:>10.0f} lines/s, {:.1f} bytes/line on disk'.format(args.lines / elapsed, size / args.lines))
+        store.close()
+
+        start = time.perf_counter()
+        store = scrollback.ScrollbackStore(directory, 'bench')
+        print('reopen: {:>10.1f}ms'.format((time.perf_counter() - start) * 1000))
+
+        latencies = []
+        for _ in range(args.queries):
+            channel = rng.choice(channels)
+            until = rng.randrange(args.lines)
+            start = time.perf_counter()
+            lines = store.before(channel, args.limit, until=until)
+            latencies.append(time.perf_counter() - start)
+            assert all(line.timestamp < until for line in lines)
+        latencies.sort()
+        print('before({}): p50 {:.3f}ms, p99 {:.3f}ms, max {:.3f}ms'.format(
+            args.limit, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, latencies[-1] * 1000))
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
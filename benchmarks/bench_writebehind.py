@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.bench_writebehind
+----------------------------
+
+Compares logging lines to SQLite one `save()` at a time with going through `pircel.writebehind.WriteBehind`.
+
+Reports the throughput of each and, for write-behind, how long the "event loop" spent queueing lines and the worst
+single stall at a steady `--rate` of lines per second.
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import peewee
+
+from pircel import protocol, writebehind
+
+from benchmarks import corpus
+
+database = peewee.SqliteDatabase(None)
+
+
+class Line(peewee.Model):
+    timestamp = peewee.DateTimeField()
+    prefix = peewee.CharField()
+    command = peewee.CharField()
+    target = peewee.CharField()
+    text = peewee.TextField()
+
+    class Meta:
+        database = database
+
+
+def rows(lines):
+    now = datetime.datetime.utcnow()
+    for line in lines:
+        message = protocol.parse_message(line.decode('utf8'))
+        params = message.params or ['']
+        yield dict(timestamp=now, prefix=message.prefix, command=message.command, target=params[0], text=params[-1])
+
+
+def direct(data):
+    start = time.perf_counter()
+    for row in data:
+        Line.create(**row)
+    return time.perf_counter() - start
+
+
+def write_behind(data, rate):
+    queue = writebehind.WriteBehind(database)
+    interval = 1 / rate if rate else 0
+    worst = 0
+    queueing = 0
+    start = time.perf_counter()
+    for i, row in enumerate(data):
+        if interval:
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        before = time.perf_counter()
+        queue.insert(Line, **row)
+        spent = time.perf_counter() - before
+        queueing += spent
+        worst = max(worst, spent)
+    queue.close()
+    return time.perf_counter() - start, queueing, worst, queue.batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    corpus.add_arguments(parser, default_lines=20000)
+    parser.add_argument('--rate', type=float, default=10000,
+                        help='Lines per second to feed write-behind at (0 to skip)')
+    parser.add_argument('--direct-lines', type=int, default=2000, help='How many lines to save() one at a time')
+    args = parser.parse_args()
+
+    data = list(rows(corpus.from_arguments(args)))
+    with tempfile.TemporaryDirectory() as directory:
+        database.init(os.path.join(directory, 'bench.db'))
+        database.create_tables([Line])
+
+        elapsed = direct(data[:args.direct_lines])
+        print('save() per line: {:>8.0f} lines/s'.format(args.direct_lines / elapsed))
+
+        elapsed, queueing, worst, batches = write_behind(data, 0)
+        print('write-behind:    {:>8.0f} lines/s ({} batches)'.format(len(data) / elapsed, batches))
+
+        if args.rate:
+            elapsed, queueing, worst, batches = write_behind(data, args.rate)
+            print('write-behind at {:.0f} lines/s: {:.1f}% of the time spent queueing, worst stall {:.2f}ms, '
+                  '{} batches'.format(args.rate, queueing / elapsed * 100, worst * 1000, batches))
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.compare
+------------------
+
+Compares two sets of results written by `benchmarks.suite --json` and reports anything that got worse by more than
+`--threshold` percent, exiting non-zero if anything did (so it can fail a CI job).
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+import sys
+
+# metric -> True if bigger is better
+metrics = {
+    'lines_per_s': True,
+    'p50_us': False,
+    'p99_us': False,
+    'alloc_bytes_per_line': False,
+    'retained_bytes_per_line': False,
+}
+
+
+def compare(before, after, threshold):
+    """ Returns `(rows, regressions)`, a row per benchmark and metric in both and the rows that regressed. """
+    rows = []
+    regressions = []
+    for name in sorted(set(before) & set(after)):
+        for metric, bigger_is_better in metrics.items():
+            old, new = before[name].get(metric), after[name].get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            worse = -change if bigger_is_better else change
+            row = (name, metric, old, new, change)
+            rows.append(row)
+            if worse > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10, help='Percentage change that counts as a regression')
+    args = parser.parse_args()
+
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    rows, regressions = compare(before['results'], after['results'], args.threshold)
+    for name, metric, old, new, change in rows:
+        flag = ' <-- regression' if (name, metric, old, new, change) in regressions else ''
+        print('{:>26} {:>24}: {:>12.2f} -> {:>12.2f} ({:+6.1f}%){}'.format(name, metric, old, new, change, flag))
+
+    for name in sorted(set(before['results']) ^ set(after['results'])):
+        print('{:>26} only in {}'.format(name, 'before' if name in before['results'] else 'after'))
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.corpus
+-----------------
+
+Generates synthetic IRC server traffic, either the rough mix seen on a busy network or one of the nastier bursts (see
+`scenarios`), or loads a recorded one.
+
+Recorded traffic can be anonymized before it's shared with `python -m benchmarks.corpus recorded.log anonymized.log`,
+which replaces nicks, usernames, hosts, channels and words with hashes of the same length (so the same nick is still the
+same nick everywhere) while keeping commands, numerics, mode strings and any non-ASCII bytes as they were.
+"""
+import argparse
+import hashlib
+import random
+import re
+
+from pircel import protocol
+
+_words = ('the', 'irc', 'bot', 'is', 'lagging', 'again', 'did', 'anyone', 'see', 'netsplit', 'lol', 'ok', 'thanks',
+          'python', 'tornado', 'server', 'channel', 'why', 'does', 'this', 'keep', 'happening', ':)', 'brb')
+
+
+def _nick(rng, n_users):
+    return 'user{}'.format(rng.randrange(n_users))
+
+
+def _mask(nick):
+    return '{0}!~{0}@host-{1}.example.net'.format(nick, sum(map(ord, nick)) % 997)
+
+
+def _text(rng):
+    return ' '.join(rng.choice(_words) for _ in range(rng.randint(1, 18)))
+
+
+def _privmsg(rng, n_users, n_channels):
+    nick = _nick(rng, n_users)
+    return ':{} PRIVMSG #chan{} :{}'.format(_mask(nick), rng.randrange(n_channels), _text(rng))
+
+
+def _tagged_privmsg(rng, n_users, n_channels):
+    tags = '@time=2016-02-0{}T12:34:56.789Z;account={}'.format(rng.randint(1, 9), _nick(rng, n_users))
+    return '{} {}'.format(tags, _privmsg(rng, n_users, n_channels))
+
+
+def _join(rng, n_users, n_channels):
+    return ':{} JOIN #chan{}'.format(_mask(_nick(rng, n_users)), rng.randrange(n_channels))
+
+
+def _part(rng, n_users, n_channels):
+    return ':{} PART #chan{} :{}'.format(_mask(_nick(rng, n_users)), rng.randrange(n_channels), _text(rng))
+
+
+def _quit(rng, n_users, n_channels):
+    return ':{} QUIT :Quit: {}'.format(_mask(_nick(rng, n_users)), _text(rng))
+
+
+def _nick_change(rng, n_users, n_channels):
+    return ':{} NICK {}'.format(_mask(_nick(rng, n_users)), _nick(rng, n_users))
+
+
+def _mode(rng, n_users, n_channels):
+    return ':ChanServ!ChanServ@services. MODE #chan{} +o {}'.format(rng.randrange(n_channels), _nick(rng, n_users))
+
+
+def _names(rng, n_users, n_channels):
+    names = ' '.join(rng.choice(('', '@', '+')) + _nick(rng, n_users) for _ in range(40))
+    return ':irc.example.net 353 pircel = #chan{} :{}'.format(rng.randrange(n_channels), names)
+
+
+def _who(rng, n_users, n_channels):
+    nick = _nick(rng, n_users)
+    return ':irc.example.net 352 pircel #chan{0} ~{1} host.example.net irc.example.net {1} H :0 {1}'.format(
+        rng.randrange(n_channels), nick)
+
+
+def _ping(rng, n_users, n_channels):
+    return 'PING :irc.example.net'
+
+
+def _userhost_names(rng, n_users, n_channels):
+    """ RPL_NAMREPLY with multi-prefix and userhost-in-names. """
+    names = ' '.join(rng.choice(('', '', '@', '+', '@+')) + _mask(_nick(rng, n_users)) for _ in range(12))
+    return ':irc.example.net 353 pircel = #chan{} :{}'.format(rng.randrange(n_channels), names)
+
+
+def _end_of_names(rng, n_users, n_channels):
+    return ':irc.example.net 366 pircel #chan{} :End of /NAMES list.'.format(rng.randrange(n_channels))
+
+
+_encoded_texts = ('caf\xe9 cr\xe8me br\xfbl\xe9e', 'na\xefve r\xe9sum\xe9', '\u2018smart quotes\u2019 \u2013 dash',
+                  'gr\xfc\xdfe aus k\xf6ln', '\u2603 snow \U0001F600')
+
+
+def _encoded_privmsg(rng, n_users, n_channels):
+    """ PRIVMSG from clients using assorted encodings, only about half of them utf8. """
+    nick = _nick(rng, n_users)
+    encoding = ('utf8', 'utf8', 'latin-1', 'cp1252')[sum(map(ord, nick)) % 4]
+    text = rng.choice(_encoded_texts)
+    line = ':{} PRIVMSG #chan{} :{} {}'.format(_mask(nick), rng.randrange(n_channels), _text(rng), text)
+    return line.encode(encoding, errors='replace')
+
+
+# (generator, relative weight)
+_mix = (
+    (_privmsg, 60),
+    (_tagged_privmsg, 5),
+    (_join, 8),
+    (_part, 5),
+    (_quit, 5),
+    (_nick_change, 2),
+    (_mode, 3),
+    (_names, 5),
+    (_who, 5),
+    (_ping, 2),
+)
+
+
+def _generate(mix, n_lines, n_users, n_channels, seed):
+    rng = random.Random(seed)
+    generators = [generator for generator, _ in mix]
+    weights = [weight for _, weight in mix]
+    lines = []
+    for generator in rng.choices(generators, weights, k=n_lines):
+        line = generator(rng, n_users, n_channels)
+        lines.append((line if isinstance(line, bytes) else line.encode('utf8')) + b'\r\n')
+    return lines
+
+
+def synthetic(n_lines, n_users=5000, n_channels=500, seed=0):
+    """ Returns a list of `n_lines` raw (bytes, CRLF terminated) lines of plausible server traffic. """
+    return _generate(_mix, n_lines, n_users, n_channels, seed)
+
+
+def join_flood(n_lines, n_users=50000, n_channels=3, seed=0):
+    """ Lots of users joining a few channels, e.g. after a netsplit heals. """
+    return _generate(((_join, 1),), n_lines, n_users, n_channels, seed)
+
+
+def names_burst(n_lines, n_users=50000, n_channels=50, seed=0):
+    """ The NAMES replies for joining lots of big channels, with multi-prefix and userhost-in-names. """
+    return _generate(((_userhost_names, 20), (_end_of_names, 1)), n_lines, n_users, n_channels, seed)
+
+
+def privmsg_storm(n_lines, n_users=2000, n_channels=20, seed=0):
+    """ Nothing but (some tagged) messages. """
+    return _generate(((_privmsg, 9), (_tagged_privmsg, 1)), n_lines, n_users, n_channels, seed)
+
+
+def mixed_encoding(n_lines, n_users=2000, n_channels=20, seed=0):
+    """ Messages with non-ASCII text in utf8, latin-1 and cp1252. """
+    return _generate(((_encoded_privmsg, 1),), n_lines, n_users, n_channels, seed)
+
+
+scenarios = {
+    'mixed': synthetic,
+    'join_flood': join_flood,
+    'names_burst': names_burst,
+    'privmsg_storm': privmsg_storm,
+    'mixed_encoding': mixed_encoding,
+}
+
+
+def load(path, n_lines=None):
+    """ Loads a recorded corpus, one raw line per line of the file. """
+    lines = []
+    with open(path, 'rb') as corpus_file:
+        for line in corpus_file:
+            if not line.strip():
+                continue
+            lines.append(line if line.endswith(b'\r\n') else line.rstrip(b'\n') + b'\r\n')
+            if n_lines is not None and len(lines) >= n_lines:
+                break
+    return lines
+
+
+_symbols = re.compile(rb'^[^A-Za-z0-9]*')
+_keep = re.compile(rb'^([0-9]+|[+-][A-Za-z]+|[*=@:]|)$')
+
+
+class Anonymizer:
+    """ Consistently replaces identifying words in raw lines with salted hashes of the same length. """
+    def __init__(self, salt=b''):
+        self.salt = salt
+        self._words = {}
+
+    def word(self, word):
+        """ Hashes the ASCII part of a word, keeping any leading symbols (e.g. '#' or '@+') and non-ASCII bytes. """
+        anonymized = self._words.get(word)
+        if anonymized is None:
+            symbols = _symbols.match(word).group()
+            rest = word[len(symbols):]
+            digest = hashlib.sha256(self.salt + rest).hexdigest().encode('ascii')
+            digest = (digest * (len(rest) // len(digest) + 1))[:len(rest)]
+            anonymized = symbols + bytes(hashed if byte < 0x80 else byte for byte, hashed in zip(rest, digest))
+            self._words[word] = anonymized
+        return anonymized
+
+    def mask(self, mask):
+        return re.sub(rb'[^!@]+', lambda match: self.word(match.group()), mask)
+
+    def tag_value(self, key, value):
+        if key == 'time':
+            return value
+        digest = hashlib.sha256(self.salt + value.encode('utf8')).hexdigest()
+        return (digest * (len(value) // len(digest) + 1))[:len(value)]
+
+    def param(self, param):
+        """ Like `mask` but keeps numbers, mode changes and the like (for the params before the trailing one). """
+        return param if _keep.match(param) else self.mask(param)
+
+    def line(self, line):
+        try:
+            tags, prefix, command, params = protocol.parse_message_bytes(line)
+        except protocol.MalformedLineError:
+            return line
+        parts = []
+        if tags:
+            tags = ';'.join('{}={}'.format(key, self.tag_value(key, value)) if value else key
+                            for key, value in tags.items())
+            parts.append(b'@' + tags.encode('utf8'))
+        if prefix:
+            parts.append(b':' + self.mask(prefix))
+        parts.append(command)
+        if params:
+            parts.extend(self.param(param) for param in params[:-1])
+            last = params[-1]
+            if b' ' in last:
+                last = b' '.join(self.mask(word) for word in last.split(b' '))
+            else:
+                last = self.param(last)
+            parts.append(b':' + last)
+        return b' '.join(parts) + b'\r\n'
+
+
+def anonymize(lines, salt=b''):
+    """ Returns anonymized copies of raw `lines`, see `Anonymizer`. """
+    anonymizer = Anonymizer(salt)
+    return [anonymizer.line(line) for line in lines]
+
+
+def add_arguments(parser, default_lines=100000):
+    """ Adds the common corpus selection arguments to an `argparse.ArgumentParser`. """
+    parser.add_argument('--corpus', help='File of recorded raw server lines (default: synthetic traffic)')
+    parser.add_argument('--lines', type=int, default=default_lines, help='Number of lines to use')
+
+
+def from_arguments(args):
+    if args.corpus:
+        return load(args.corpus, args.lines)
+    return synthetic(args.lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Anonymizes a recorded corpus')
+    parser.add_argument('source', help='File of recorded raw server lines')
+    parser.add_argument('destination')
+    parser.add_argument('--salt', default='', help='Mixed into the hashes so they can\'t be matched up with a list of '
+                                                   'likely nicks')
+    args = parser.parse_args()
+
+    with open(args.destination, 'wb') as destination:
+        destination.writelines(anonymize(load(args.source), args.salt.encode('utf8')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.harness
+------------------
+
+Replays a corpus of raw lines through pircel and measures how it copes.
+
+Two ways in are measured:
+    * `replay_handler` calls `IRCServerHandler.handle_line` directly
+    * `replay_linestream` writes the lines into one end of a local socket pair and lets a tornado `LineStream` read
+      them off the other end and hand them to the handler, so buffering and line splitting are included
+
+Both time every line individually (for the latency percentiles) as well as the run as a whole (for lines/s).
+`measure_allocations` uses tracemalloc to see how much memory each line needs while it's being handled and how much of
+that is still around afterwards.
+
+The handler has a `pircel.state.StateTracker` attached and has "joined" the corpus's channels first so that JOINs,
+NAMES and so on do the work they would on a real connection.
+"""
+import asyncio
+import gc
+import socket
+import threading
+import time
+import tracemalloc
+import types
+
+from tornado import iostream
+
+from pircel import protocol, state, tornado_adapter
+
+# Channels the synthetic corpora use, joined before replaying anything
+_channels = ['#chan{}'.format(i) for i in range(500)]
+
+
+def make_server_handler():
+    """ Returns a server handler with state tracking attached, already in the corpus's channels. """
+    identity = types.SimpleNamespace(nick='pircel', username='pircel', realname='Percy Wendel')
+    server_handler = protocol.IRCServerHandler(identity)
+    server_handler.write_function = lambda line: None
+    server_handler.log_unhandled = lambda line: None
+    # Keep the tracker alive for as long as the handler, it's only weakly connected
+    server_handler.tracker = state.StateTracker(server_handler)
+    server_handler.handle_lines([':pircel!~pircel@localhost JOIN {}'.format(channel) for channel in _channels])
+    return server_handler
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(n_lines, elapsed, latencies):
+    """ Turns a run's total time and per-line latencies (in ns) into the numbers we report. """
+    latencies = sorted(latencies)
+    return {
+        'lines': n_lines,
+        'lines_per_s': n_lines / elapsed,
+        'p50_us': percentile(latencies, 0.5) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'max_us': latencies[-1] / 1000,
+    }
+
+
+def _timed(handle, latencies):
+    clock = time.perf_counter_ns
+    append = latencies.append
+
+    def timed_handle(line):
+        start = clock()
+        handle(line)
+        append(clock() - start)
+    return timed_handle
+
+
+def replay_handler(lines, repeat=3):
+    """ Replays `lines` through `IRCServerHandler.handle_line`, best of `repeat` runs (each with a fresh handler). """
+    best = float('inf')
+    for _ in range(repeat):
+        handle_line = make_server_handler().handle_line
+        gc.collect()
+        start = time.perf_counter()
+        for line in lines:
+            handle_line(line)
+        best = min(best, time.perf_counter() - start)
+
+    latencies = []
+    timed_handle = _timed(make_server_handler().handle_line, latencies)
+    for line in lines:
+        timed_handle(line)
+    return summarize(len(lines), best, latencies)
+
+
+def replay_linestream(lines, repeat=3):
+    """ Replays `lines` through a tornado `LineStream` over a socket pair, best of `repeat` runs. """
+    best = float('inf')
+    latencies = []
+    for _ in range(repeat):
+        latencies = []
+        best = min(best, asyncio.run(_replay_linestream(lines, latencies)))
+    return summarize(len(lines), best, latencies)
+
+
+async def _replay_linestream(lines, latencies):
+    done = asyncio.get_running_loop().create_future()
+    ours, theirs = socket.socketpair()
+
+    line_stream = tornado_adapter.LineStream(batched=True)
+    line_stream.connection = iostream.IOStream(ours)
+
+    timed_handle = _timed(make_server_handler().handle_line, latencies)
+    expected = len(lines)
+
+    def lines_callback(batch):
+        for line in batch:
+            timed_handle(line)
+        if len(latencies) >= expected and not done.done():
+            done.set_result(None)
+    line_stream.lines_callback = lines_callback
+
+    writer = threading.Thread(target=theirs.sendall, args=(b''.join(lines),))
+    gc.collect()
+    start = time.perf_counter()
+    writer.start()
+    line_stream.start_reading()
+    await done
+    elapsed = time.perf_counter() - start
+
+    writer.join()
+    line_stream.connection.close()
+    theirs.close()
+    return elapsed
+
+
+def measure_allocations(lines):
+    """ Returns the mean bytes allocated while handling a line and the mean bytes per line still allocated after. """
+    handle_line = make_server_handler().handle_line
+    get_traced_memory = tracemalloc.get_traced_memory
+    reset_peak = tracemalloc.reset_peak
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = get_traced_memory()[0]
+    allocated = 0
+    for line in lines:
+        before = get_traced_memory()[0]
+        reset_peak()
+        handle_line(line)
+        allocated += get_traced_memory()[1] - before
+    retained = get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return {
+        'alloc_bytes_per_line': allocated / len(lines),
+        'retained_bytes_per_line': retained / len(lines),
+    }
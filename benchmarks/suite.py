@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.suite
+----------------
+
+Runs every corpus scenario (or the ones picked with `--scenario`) through `benchmarks.harness` and prints lines/s,
+p50/p99 per-line latency and allocations per line for each. With `--json` the results are also written out along with
+details of the run, compare two of those with `benchmarks.compare` to spot regressions between releases.
+
+    python -m benchmarks.suite --json before.json
+    python -m benchmarks.suite --corpus recorded.log --json recorded.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import sys
+
+import pircel
+
+from benchmarks import corpus, harness
+
+targets = {
+    'handler': harness.replay_handler,
+    'linestream': harness.replay_linestream,
+}
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scenarios, repeat, allocation_lines):
+    """ Returns `{'scenario/target': {metric: value}}` for each of `scenarios` (name: lines) through each target. """
+    results = {}
+    for scenario, lines in scenarios.items():
+        allocations = harness.measure_allocations(lines[:allocation_lines])
+        for target, replay in targets.items():
+            result = replay(lines, repeat)
+            result.update(allocations)
+            results['{}/{}'.format(scenario, target)] = result
+            print('{:>26}: {:>9.0f} lines/s  p50 {:>6.2f}us  p99 {:>7.2f}us  {:>7.0f} B/line allocated  '
+                  '{:>6.0f} B/line kept'.format('{}/{}'.format(scenario, target), result['lines_per_s'],
+                                                result['p50_us'], result['p99_us'], result['alloc_bytes_per_line'],
+                                                result['retained_bytes_per_line']))
+            sys.stdout.flush()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    corpus.add_arguments(parser, default_lines=50000)
+    parser.add_argument('--scenario', action='append', choices=sorted(corpus.scenarios),
+                        help='Synthetic scenario to run, can be given more than once (default: all of them)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each, the fastest is reported')
+    parser.add_argument('--allocation-lines', type=int, default=10000,
+                        help='How many lines to trace allocations for (it\'s slow)')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    if args.corpus:
+        scenarios = {'recorded': corpus.load(args.corpus, args.lines)}
+    else:
+        scenarios = {name: corpus.scenarios[name](args.lines) for name in args.scenario or sorted(corpus.scenarios)}
+
+    results = run(scenarios, args.repeat, args.allocation_lines)
+
+    if args.json:
+        output = {
+            'meta': {
+                'pircel': pircel.__version__,
+                'revision': _git_revision(),
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'date': datetime.datetime.utcnow().isoformat(),
+                'corpus': args.corpus,
+                'lines': args.lines,
+                'repeat': args.repeat,
+            },
+            'results': results,
+        }
+        with open(args.json, 'w') as json_file:
+            json.dump(output, json_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.analysis
+---------------
+
+Bulk analysis of raw IRC logs: per-channel activity, top talkers, nick churn and the like over millions of lines.
+
+`Columns` turns lines (parsed with `pircel.protocol.parse_message_bytes`, nothing is decoded) into one typed `array`
+per field rather than an object per line:
+
+    timestamps      double  from the line's `time` tag or leading unix timestamp, NaN if it had neither
+    commands        uint16  index into `Columns.command_names`
+    nicks           int32   index into `Columns.nick_names` (case folded), the sender, -1 if the line had no prefix
+    channels        int32   index into `Columns.channel_names` (case folded), -1 if the target isn't a channel
+    text_offsets    int64   line `i`'s text (its last argument, if it has more than one) is
+                            `text[text_offsets[i]:text_offsets[i + 1]]`
+
+`read_file` builds them from a log file, optionally split into chunks parsed by a pool of processes. The columns can be
+had as numpy arrays without copying (`Columns.as_numpy`) and the aggregations below are numpy operations over them, so
+apart from parsing there are no loops over lines in python. numpy is only needed for those, it's imported when they're
+first used (`pip install pircel[analysis]` to get it).
+"""
+import array
+import concurrent.futures
+import datetime
+import os
+
+from pircel import protocol, state
+
+_channel_prefixes = frozenset((b'#', b'&', b'!', b'+'))
+_leaving = ('PART', 'QUIT', 'KICK')
+_nan = float('nan')
+
+
+def _numpy():
+    import numpy
+    return numpy
+
+
+def _fold_table(casemapping):
+    """ `pircel.state.casemapping_tables` entries are for `str.translate`, this makes one for `bytes.translate`. """
+    table = state.casemapping_tables[casemapping]
+    return bytes(table.get(byte, byte) for byte in range(256))
+
+
+def parse_time_tag(value):
+    """ Converts an IRCv3 `time` tag (ISO 8601 in UTC) to a unix timestamp, NaN if it isn't one. """
+    # The tag always ends in 'Z', which `fromisoformat` only understands from python 3.11
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return _nan
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+class Columns:
+    def __init__(self, casemapping='rfc1459', timestamped=False):
+        """ Lines from a log stored a column per field.
+
+        Args:
+            casemapping (str): How the network compares nicks and channel names, one of
+                `pircel.state.casemapping_tables`.
+            timestamped (bool): Lines start with a unix timestamp and a space, as opposed to a server-time tag (or no
+                time at all).
+        """
+        self.casemapping = casemapping
+        self.timestamped = timestamped
+        self._fold_table = _fold_table(casemapping)
+
+        self.timestamps = array.array('d')
+        self.commands = array.array('H')
+        self.nicks = array.array('i')
+        self.channels = array.array('i')
+        self.text_offsets = array.array('q', [0])
+        self.text = bytearray()
+        self.malformed = 0
+
+        self.command_names = []
+        self.nick_names = []
+        self.channel_names = []
+        self._command_ids = {}
+        self._nick_ids = {}
+        self._channel_ids = {}
+
+    def __len__(self):
+        return len(self.commands)
+
+    def _intern(self, value, ids, names):
+        number = ids[value] = len(names)
+        names.append(value)
+        return number
+
+    def add_lines(self, lines):
+        """ Parses and adds raw lines (bytes, with or without their line endings). """
+        parse = protocol.parse_message_bytes
+        malformed_error = protocol.MalformedLineError
+        fold_table = self._fold_table
+        timestamped = self.timestamped
+        command_ids, nick_ids, channel_ids = self._command_ids, self._nick_ids, self._channel_ids
+        add_timestamp = self.timestamps.append
+        add_command = self.commands.append
+        add_nick = self.nicks.append
+        add_channel = self.channels.append
+        add_offset = self.text_offsets.append
+        text = self.text
+        add_text = text.extend
+
+        for line in lines:
+            timestamp = _nan
+            if timestamped:
+                stamp, _, line = line.partition(b' ')
+                try:
+                    timestamp = float(stamp)
+                except ValueError:
+                    pass
+            try:
+                tags, prefix, command, params = parse(line)
+            except malformed_error:
+                self.malformed += 1
+                continue
+
+            if tags is not None and 'time' in tags:
+                timestamp = parse_time_tag(tags['time'])
+            add_timestamp(timestamp)
+
+            command_id = command_ids.get(command)
+            if command_id is None:
+                command_id = self._intern(command, command_ids, self.command_names)
+            add_command(command_id)
+
+            if prefix:
+                nick = prefix.partition(b'!')[0].translate(fold_table)
+                nick_id = nick_ids.get(nick)
+                if nick_id is None:
+                    nick_id = self._intern(nick, nick_ids, self.nick_names)
+                add_nick(nick_id)
+            else:
+                add_nick(-1)
+
+            if params and params[0][:1] in _channel_prefixes:
+                channel = params[0].translate(fold_table)
+                channel_id = channel_ids.get(channel)
+                if channel_id is None:
+                    channel_id = self._intern(channel, channel_ids, self.channel_names)
+                add_channel(channel_id)
+            else:
+                add_channel(-1)
+
+            if len(params) > 1:
+                add_text(params[-1])
+            add_offset(len(text))
+
+    def line_text(self, index):
+        """ Returns the text of line `index` (bytes, it's not decoded). """
+        return bytes(self.text[self.text_offsets[index]:self.text_offsets[index + 1]])
+
+    def command_id(self, command):
+        """ Returns the id of `command` (e.g. 'PRIVMSG' or '001') in `commands`, -1 if there weren't any. """
+        return self._command_ids.get(command.encode('ascii'), -1)
+
+    def nick_id(self, nick):
+        return self._nick_ids.get(nick.encode('utf8').translate(self._fold_table), -1)
+
+    def channel_id(self, channel):
+        return self._channel_ids.get(channel.encode('utf8').translate(self._fold_table), -1)
+
+    def extend(self, other):
+        """ Appends the lines from another `Columns` (e.g. another chunk of the same log) to these. """
+        def remap(column, ids, names, other_names):
+            mapping = [ids[name] if name in ids else self._intern(name, ids, names) for name in other_names]
+            mapping.append(-1)  # So -1 (no nick or channel) maps to itself
+            return array.array(column.typecode, map(mapping.__getitem__, column))
+
+        self.timestamps.extend(other.timestamps)
+        self.commands.extend(remap(other.commands, self._command_ids, self.command_names, other.command_names))
+        self.nicks.extend(remap(other.nicks, self._nick_ids, self.nick_names, other.nick_names))
+        self.channels.extend(remap(other.channels, self._channel_ids, self.channel_names, other.channel_names))
+        base = len(self.text)
+        self.text_offsets.extend(array.array('q', [offset + base for offset in other.text_offsets[1:]]))
+        self.text += other.text
+        self.malformed += other.malformed
+
+    def as_numpy(self):
+        """ Returns a dict of numpy arrays sharing memory with the columns (so don't add lines while using them). """
+        numpy = _numpy()
+        return {
+            name: numpy.frombuffer(column, dtype=column.typecode)
+            for name, column in (('timestamps', self.timestamps), ('commands', self.commands), ('nicks', self.nicks),
+                                 ('channels', self.channels), ('text_offsets', self.text_offsets))
+        }
+
+
+# =============================================================================
+# Reading logs
+# =============================================================================
+def from_lines(lines, casemapping='rfc1459', timestamped=False):
+    columns = Columns(casemapping, timestamped)
+    columns.add_lines(lines)
+    return columns
+
+
+def _chunks(path, chunk_size):
+    """ Splits a file into (start, stop) byte ranges of about `chunk_size` that start and end at line boundaries. """
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as log_file:
+        while start < size:
+            log_file.seek(min(start + chunk_size, size))
+            log_file.readline()
+            stop = min(log_file.tell(), size)
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def _read_chunk(path, start, stop, casemapping, timestamped):
+    with open(path, 'rb') as log_file:
+        log_file.seek(start)
+        lines = log_file.read(stop - start).split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    return from_lines(lines, casemapping, timestamped)
+
+
+def read_file(path, processes=None, chunk_size=64 * 1024 * 1024, casemapping='rfc1459', timestamped=False):
+    """ Reads a log file of raw lines into `Columns`.
+
+    Args:
+        path (str): The log file, one raw line per line.
+        processes (int): Parse chunks on a pool of this many processes, None (or 1) to parse everything in this one.
+        chunk_size (int): Roughly how many bytes of the file each process parses at a time.
+        casemapping (str): See `Columns`.
+        timestamped (bool): See `Columns`.
+    """
+    if not processes or processes == 1:
+        return _read_chunk(path, 0, os.path.getsize(path), casemapping, timestamped)
+
+    columns = Columns(casemapping, timestamped)
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(_read_chunk, path, start, stop, casemapping, timestamped)
+                   for start, stop in _chunks(path, chunk_size)]
+        for future in futures:
+            columns.extend(future.result())
+    return columns
+
+
+# =============================================================================
+# Aggregations
+# =============================================================================
+def _mask(columns, arrays, commands=None, channel=None):
+    """ Returns a boolean array of the lines that are one of `commands` and in `channel` (None for any). """
+    numpy = _numpy()
+    mask = numpy.ones(len(columns), dtype=bool)
+    if commands is not None:
+        mask &= numpy.isin(arrays['commands'], [columns.command_id(command) for command in commands])
+    if channel is not None:
+        mask &= _in_channel(columns, arrays, channel)
+    return mask
+
+
+def _in_channel(columns, arrays, channel):
+    """ Returns a boolean array of the lines in `channel`, none of them if it never appeared. """
+    numpy = _numpy()
+    channel_id = columns.channel_id(channel)
+    if channel_id < 0:
+        # -1 is also what lines without a channel have
+        return numpy.zeros(len(columns), dtype=bool)
+    return arrays['channels'] == channel_id
+
+
+def _quits_seen_in(columns, arrays, in_channel):
+    """ Returns a boolean array of the QUITs by nicks that had a line in the channel (`in_channel`) before quitting. """
+    numpy = _numpy()
+    nicks = arrays['nicks']
+    # Index of each nick's first line in the channel, the extra last entry is for lines without a nick (-1)
+    first_seen = numpy.full(len(columns.nick_names) + 1, len(columns), dtype=numpy.int64)
+    numpy.minimum.at(first_seen, nicks[in_channel], numpy.flatnonzero(in_channel))
+    first_seen[-1] = len(columns)
+    return (arrays['commands'] == columns.command_id('QUIT')) & (first_seen[nicks] < numpy.arange(len(columns)))
+
+
+def _names(names, counts, limit):
+    numpy = _numpy()
+    # Ties in the order they were first seen
+    order = numpy.argsort(-counts, kind='stable')
+    if limit is not None:
+        order = order[:limit]
+    return [(names[i].decode('utf8', 'replace'), int(counts[i])) for i in order if counts[i]]
+
+
+def channel_activity(columns, commands=('PRIVMSG', 'NOTICE'), limit=None):
+    """ Returns `[(channel, lines), ...]` for the `limit` busiest channels (by lines that are one of `commands`). """
+    numpy = _numpy()
+    arrays = columns.as_numpy()
+    channels = arrays['channels'][_mask(columns, arrays, commands) & (arrays['channels'] >= 0)]
+    return _names(columns.channel_names, numpy.bincount(channels, minlength=len(columns.channel_names)), limit)
+
+
+def top_talkers(columns, limit=10, channel=None, commands=('PRIVMSG',)):
+    """ Returns `[(nick, lines), ...]` for the `limit` nicks that sent the most of `commands` (in `channel`). """
+    numpy = _numpy()
+    arrays = columns.as_numpy()
+    nicks = arrays['nicks'][_mask(columns, arrays, commands, channel) & (arrays['nicks'] >= 0)]
+    return _names(columns.nick_names, numpy.bincount(nicks, minlength=len(columns.nick_names)), limit)
+
+
+def activity_over_time(columns, interval=86400, channel=None, commands=('PRIVMSG', 'NOTICE')):
+    """ Counts lines per `interval` seconds.
+
+    Returns a `(starts, counts)` pair of numpy arrays, the start time of every interval from the first line to the last
+    and how many lines there were in it. Lines without a timestamp aren't counted.
+    """
+    numpy = _numpy()
+    arrays = columns.as_numpy()
+    timestamps = arrays['timestamps'][_mask(columns, arrays, commands, channel)]
+    timestamps = timestamps[~numpy.isnan(timestamps)]
+    if not len(timestamps):
+        return numpy.zeros(0), numpy.zeros(0, dtype=numpy.int64)
+    first = numpy.floor(timestamps.min() / interval) * interval
+    counts = numpy.bincount(((timestamps - first) // interval).astype(numpy.int64))
+    return first + numpy.arange(len(counts)) * interval, counts
+
+
+def nick_churn(columns, interval=86400, channel=None):
+    """ Counts arrivals (JOINs) and departures (PARTs, QUITs and KICKs) per `interval` seconds.
+
+    Returns `(starts, joins, leaves)` numpy arrays, like `activity_over_time`. QUITs aren't in a channel so with a
+    `channel` they're counted if the nick had a line in it (joined, spoke, ...) before quitting.
+    """
+    numpy = _numpy()
+    arrays = columns.as_numpy()
+    mask = _mask(columns, arrays, ('JOIN',) + _leaving) & ~numpy.isnan(arrays['timestamps'])
+    if channel is not None:
+        in_channel = _in_channel(columns, arrays, channel)
+        mask &= in_channel | _quits_seen_in(columns, arrays, in_channel)
+    timestamps = arrays['timestamps'][mask]
+    if not len(timestamps):
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return numpy.zeros(0), empty, empty
+    first = numpy.floor(timestamps.min() / interval) * interval
+    buckets = ((timestamps - first) // interval).astype(numpy.int64)
+    joins = arrays['commands'][mask] == columns.command_id('JOIN')
+    size = buckets.max() + 1
+    return (first + numpy.arange(size) * interval, numpy.bincount(buckets[joins], minlength=size),
+            numpy.bincount(buckets[~joins], minlength=size))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pircel.asyncio_adapter
+----------------------
+
+The asyncio equivalent of `pircel.tornado_adapter`, built directly on `asyncio.Protocol` so it'll run on any asyncio
+compatible loop (e.g. uvloop) without going through tornado's IOStream.
+"""
+import asyncio
+import datetime
+import logging
+import ssl
+
+from pircel import protocol
+
+
+logger = logging.getLogger(__name__)
+
+
+class LineStream(asyncio.Protocol):
+    def __init__(self, loop=None):
+        """ Reads lines from (and writes lines to) a TCP connection to an IRC server.
+
+        Everything received in one `data_received` call is split into lines and all of the complete ones are passed to
+        `lines_callback` at once (or to `line_callback` one by one if `lines_callback` isn't set). Lines are passed
+        without their trailing newline.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): The loop to run on, defaults to the current event loop.
+        """
+        self._loop = loop
+        self.line_callback = None
+        self.lines_callback = None
+        self.connect_callback = None
+        self.disconnect_callback = None
+        self.transport = None
+
+        # Holds any partial line left at the end of the last read, reused for the life of the stream
+        self._buffer = bytearray()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    async def connect(self, host, port, secure):
+        logger.debug('Connecting to server %s:%s', host, port)
+
+        if secure:
+            ssl_options = ssl.create_default_context()
+        else:
+            ssl_options = None
+
+        await self.loop.create_connection(lambda: self, host, port, ssl=ssl_options)
+
+    # =========================================================================
+    # asyncio.Protocol implementation
+    # =========================================================================
+    def connection_made(self, transport):
+        self.transport = transport
+        self._buffer.clear()
+        logger.debug('Connected.')
+        if self.connect_callback is not None:
+            self.connect_callback()
+            logger.debug('Called post-connection callback')
+
+    def data_received(self, data):
+        buffer = self._buffer
+        buffer += data
+
+        end = buffer.rfind(b'\n') + 1
+        if end:
+            with memoryview(buffer) as view:
+                lines = bytes(view[:end]).split(b'\n')
+            del buffer[:end]
+            lines.pop()  # Always empty, it's whatever came after the last newline
+            self.handle_lines(lines)
+
+    def connection_lost(self, exc):
+        logger.debug('Connection closed: %s', exc)
+        self.transport = None
+        if self.disconnect_callback is not None:
+            self.disconnect_callback(exc)
+    # =========================================================================
+
+    def handle_lines(self, lines):
+        if self.lines_callback is not None:
+            self.lines_callback(lines)
+        elif self.line_callback is not None:
+            for line in lines:
+                self.line_callback(line)
+
+    def write_function(self, line):
+        if line[-1] != '\n':
+            line += '\n'
+        self.transport.write(line.encode('utf8'))
+
+    def write_bytes(self, data):
+        """ Writes already encoded and terminated line(s). """
+        self.transport.write(data)
+
+    def start(self):
+        self.loop.run_forever()
+
+
+class IRCClient:
+    def __init__(self, line_stream, server_handler, interface=None, ping_interval=60, outbound=None):
+        """
+        Args:
+            ping_interval (float): Seconds between pings, None to not ping at all.
+            outbound (pircel.outbound.OutboundQueue): If given lines to the server go through this for flood control.
+        """
+        if interface is not None:
+            interface.server_handler = server_handler
+
+        # Attach instances
+        if outbound is not None:
+            outbound.write_bytes = line_stream.write_bytes
+            server_handler.write_function = outbound.write
+            server_handler.write_bytes = outbound.write
+        else:
+            server_handler.write_function = line_stream.write_function
+            server_handler.write_bytes = line_stream.write_bytes
+        line_stream.connect_callback = self.connect_callback
+        line_stream.line_callback = server_handler.handle_line
+        line_stream.lines_callback = server_handler.handle_lines
+
+        self.line_stream = line_stream
+        self.server_handler = server_handler
+        self.interface = interface
+        self.outbound = outbound
+        self.ping_interval = ping_interval
+        self._ping_handle = None
+
+    def connect_callback(self):
+        self.server_handler.connect()
+
+    def _ping(self):
+        if self.line_stream.transport is not None:
+            self.server_handler.send_ping(datetime.datetime.utcnow().timestamp())
+        self._ping_handle = self.line_stream.loop.call_later(self.ping_interval, self._ping)
+
+    def connect(self, server=None, port=None, insecure=None, channels=None):
+        """ Starts connecting to the server, returns the `asyncio.Task` doing so. """
+        # If we have a interface we ignore the above inputs
+        if self.interface is not None:
+            server, port, secure = self.interface.connection_details
+            insecure = not secure
+            channels = (channel.name for channel in self.interface.channels if channel.current)
+
+        if self.ping_interval is not None and self._ping_handle is None:
+            self._ping_handle = self.line_stream.loop.call_later(self.ping_interval, self._ping)
+
+        # Connect to server
+        task = self.line_stream.loop.create_task(self.line_stream.connect(server, port, not insecure))
+
+        # Join channels once we're registered, as few JOIN lines as it takes
+        channels = list(channels or ())
+        if channels:
+            def _join_channels(*args, **kwargs):
+                self.server_handler.join_channels(channels)
+                self.server_handler.remove_callback('rpl_welcome', _join_channels)
+            self.server_handler.add_callback('rpl_welcome', _join_channels, weak=False)
+
+        return task
+
+    def close(self):
+        if self._ping_handle is not None:
+            self._ping_handle.cancel()
+            self._ping_handle = None
+        if self.line_stream.transport is not None:
+            self.line_stream.transport.close()
+
+    @classmethod
+    def from_interface(cls, interface):
+        line_stream = LineStream()
+        server_handler = protocol.IRCServerHandler(interface.identity)
+        return cls(line_stream, server_handler, interface)
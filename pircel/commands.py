@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.commands
+---------------
+
+The two-way table between numeric replies (e.g. '001') and their symbolic names (e.g. 'RPL_WELCOME').
+
+`registry` holds the numerics from RFC 2812, the ones IRCv3 specs define and the common ircd extensions (WHOIS
+extras, SASL, MONITOR, KNOCK etc.). Where ircds disagree about what a numeric means the RFC's meaning wins. Plugins
+that need more call `register`, before connecting since server handlers remember unknown numerics as unknown:
+
+    from pircel import commands
+    commands.register('RPL_MYEXTENSION', 999)
+
+Both directions are plain dicts, `registry.RPL_WELCOME` also works.
+"""
+import pircel
+
+
+class DuplicateCommandError(pircel.Error):
+    """ Exception thrown when registering a name or numeric that's already registered as something else. """
+
+
+rfc2812 = (
+    ('RPL_WELCOME', '001'),
+    ('RPL_YOURHOST', '002'),
+    ('RPL_CREATED', '003'),
+    ('RPL_MYINFO', '004'),
+    ('RPL_ISUPPORT', '005'),
+    ('RPL_TRACELINK', '200'),
+    ('RPL_TRACECONNECTING', '201'),
+    ('RPL_TRACEHANDSHAKE', '202'),
+    ('RPL_TRACEUNKNOWN', '203'),
+    ('RPL_TRACEOPERATOR', '204'),
+    ('RPL_TRACEUSER', '205'),
+    ('RPL_TRACESERVER', '206'),
+    ('RPL_TRACESERVICE', '207'),
+    ('RPL_TRACENEWTYPE', '208'),
+    ('RPL_TRACECLASS', '209'),
+    ('RPL_TRACERECONNECT', '210'),
+    ('RPL_STATSLINKINFO', '211'),
+    ('RPL_STATSCOMMANDS', '212'),
+    ('RPL_ENDOFSTATS', '219'),
+    ('RPL_UMODEIS', '221'),
+    ('RPL_SERVLIST', '234'),
+    ('RPL_SERVLISTEND', '235'),
+    ('RPL_STATSUPTIME', '242'),
+    ('RPL_STATSOLINE', '243'),
+    ('RPL_LUSERCLIENT', '251'),
+    ('RPL_LUSEROP', '252'),
+    ('RPL_LUSERUNKNOWN', '253'),
+    ('RPL_LUSERCHANNELS', '254'),
+    ('RPL_LUSERME', '255'),
+    ('RPL_ADMINME', '256'),
+    ('RPL_ADMINLOC1', '257'),
+    ('RPL_ADMINLOC2', '258'),
+    ('RPL_ADMINEMAIL', '259'),
+    ('RPL_TRACELOG', '261'),
+    ('RPL_TRACEEND', '262'),
+    ('RPL_TRYAGAIN', '263'),
+    ('RPL_AWAY', '301'),
+    ('RPL_USERHOST', '302'),
+    ('RPL_ISON', '303'),
+    ('RPL_UNAWAY', '305'),
+    ('RPL_NOWAWAY', '306'),
+    ('RPL_WHOISUSER', '311'),
+    ('RPL_WHOISSERVER', '312'),
+    ('RPL_WHOISOPERATOR', '313'),
+    ('RPL_WHOWASUSER', '314'),
+    ('RPL_ENDOFWHO', '315'),
+    ('RPL_WHOISIDLE', '317'),
+    ('RPL_ENDOFWHOIS', '318'),
+    ('RPL_WHOISCHANNELS', '319'),
+    ('RPL_LISTSTART', '321'),
+    ('RPL_LIST', '322'),
+    ('RPL_LISTEND', '323'),
+    ('RPL_CHANNELMODEIS', '324'),
+    ('RPL_UNIQOPIS', '325'),
+    ('RPL_NOTOPIC', '331'),
+    ('RPL_TOPIC', '332'),
+    ('RPL_INVITING', '341'),
+    ('RPL_SUMMONING', '342'),
+    ('RPL_INVITELIST', '346'),
+    ('RPL_ENDOFINVITELIST', '347'),
+    ('RPL_EXCEPTLIST', '348'),
+    ('RPL_ENDOFEXCEPTLIST', '349'),
+    ('RPL_VERSION', '351'),
+    ('RPL_WHOREPLY', '352'),
+    ('RPL_NAMREPLY', '353'),
+    ('RPL_LINKS', '364'),
+    ('RPL_ENDOFLINKS', '365'),
+    ('RPL_ENDOFNAMES', '366'),
+    ('RPL_BANLIST', '367'),
+    ('RPL_ENDOFBANLIST', '368'),
+    ('RPL_ENDOFWHOWAS', '369'),
+    ('RPL_INFO', '371'),
+    ('RPL_MOTD', '372'),
+    ('RPL_ENDOFINFO', '374'),
+    ('RPL_MOTDSTART', '375'),
+    ('RPL_ENDOFMOTD', '376'),
+    ('RPL_YOUREOPER', '381'),
+    ('RPL_REHASHING', '382'),
+    ('RPL_YOURESERVICE', '383'),
+    ('RPL_TIME', '391'),
+    ('RPL_USERSSTART', '392'),
+    ('RPL_USERS', '393'),
+    ('RPL_ENDOFUSERS', '394'),
+    ('RPL_NOUSERS', '395'),
+    ('ERR_NOSUCHNICK', '401'),
+    ('ERR_NOSUCHSERVER', '402'),
+    ('ERR_NOSUCHCHANNEL', '403'),
+    ('ERR_CANNOTSENDTOCHAN', '404'),
+    ('ERR_TOOMANYCHANNELS', '405'),
+    ('ERR_WASNOSUCHNICK', '406'),
+    ('ERR_TOOMANYTARGETS', '407'),
+    ('ERR_NOSUCHSERVICE', '408'),
+    ('ERR_NOORIGIN', '409'),
+    ('ERR_NORECIPIENT', '411'),
+    ('ERR_NOTEXTTOSEND', '412'),
+    ('ERR_NOTOPLEVEL', '413'),
+    ('ERR_WILDTOPLEVEL', '414'),
+    ('ERR_BADMASK', '415'),
+    ('ERR_UNKNOWNCOMMAND', '421'),
+    ('ERR_NOMOTD', '422'),
+    ('ERR_NOADMININFO', '423'),
+    ('ERR_FILEERROR', '424'),
+    ('ERR_NONICKNAMEGIVEN', '431'),
+    ('ERR_ERRONEUSNICKNAME', '432'),
+    ('ERR_NICKNAMEINUSE', '433'),
+    ('ERR_NICKCOLLISION', '436'),
+    ('ERR_UNAVAILRESOURCE', '437'),
+    ('ERR_USERNOTINCHANNEL', '441'),
+    ('ERR_NOTONCHANNEL', '442'),
+    ('ERR_USERONCHANNEL', '443'),
+    ('ERR_NOLOGIN', '444'),
+    ('ERR_SUMMONDISABLED', '445'),
+    ('ERR_USERSDISABLED', '446'),
+    ('ERR_NOTREGISTERED', '451'),
+    ('ERR_NEEDMOREPARAMS', '461'),
+    ('ERR_ALREADYREGISTRED', '462'),
+    ('ERR_NOPERMFORHOST', '463'),
+    ('ERR_PASSWDMISMATCH', '464'),
+    ('ERR_YOUREBANNEDCREEP', '465'),
+    ('ERR_YOUWILLBEBANNED', '466'),
+    ('ERR_KEYSET', '467'),
+    ('ERR_CHANNELISFULL', '471'),
+    ('ERR_UNKNOWNMODE', '472'),
+    ('ERR_INVITEONLYCHAN', '473'),
+    ('ERR_BANNEDFROMCHAN', '474'),
+    ('ERR_BADCHANNELKEY', '475'),
+    ('ERR_BADCHANMASK', '476'),
+    ('ERR_NOCHANMODES', '477'),
+    ('ERR_BANLISTFULL', '478'),
+    ('ERR_NOPRIVILEGES', '481'),
+    ('ERR_CHANOPRIVSNEEDED', '482'),
+    ('ERR_CANTKILLSERVER', '483'),
+    ('ERR_RESTRICTED', '484'),
+    ('ERR_UNIQOPPRIVSNEEDED', '485'),
+    ('ERR_NOOPERHOST', '491'),
+    ('ERR_NOSERVICEHOST', '492'),
+    ('ERR_UMODEUNKNOWNFLAG', '501'),
+    ('ERR_USERSDONTMATCH', '502'),
+)
+
+# Not in the RFC but sent by most ircds (ratbox/charybdis/solanum, inspircd, unrealircd, hybrid)
+ircd_extensions = (
+    ('RPL_SNOMASK', '008'),
+    ('RPL_BOUNCE', '010'),
+    ('RPL_YOURID', '042'),
+    ('RPL_STATSCLINE', '213'),
+    ('RPL_STATSILINE', '215'),
+    ('RPL_STATSKLINE', '216'),
+    ('RPL_STATSYLINE', '218'),
+    ('RPL_STATSLLINE', '241'),
+    ('RPL_STATSHLINE', '244'),
+    ('RPL_STATSCONN', '250'),
+    ('RPL_LOCALUSERS', '265'),
+    ('RPL_GLOBALUSERS', '266'),
+    ('RPL_WHOISCERTFP', '276'),
+    ('RPL_WHOISREGNICK', '307'),
+    ('RPL_WHOISSPECIAL', '320'),
+    ('RPL_CHANNEL_URL', '328'),
+    ('RPL_CREATIONTIME', '329'),
+    ('RPL_WHOISACCOUNT', '330'),
+    ('RPL_TOPICWHOTIME', '333'),
+    ('RPL_WHOISBOT', '335'),
+    ('RPL_WHOISACTUALLY', '338'),
+    ('RPL_WHOSPCRPL', '354'),
+    ('RPL_WHOISHOST', '378'),
+    ('RPL_WHOISMODES', '379'),
+    ('RPL_HOSTHIDDEN', '396'),
+    ('ERR_UNKNOWNERROR', '400'),
+    ('ERR_TOOMANYMATCHES', '416'),
+    ('ERR_INPUTTOOLONG', '417'),
+    ('ERR_BANONCHAN', '435'),
+    ('ERR_TARGETTOOFAST', '439'),
+    ('ERR_SERVICESDOWN', '440'),
+    ('ERR_NOTIMPLEMENTED', '449'),
+    ('ERR_INVALIDUSERNAME', '468'),
+    ('ERR_LINKCHANNEL', '470'),
+    ('ERR_BADCHANNAME', '479'),
+    ('ERR_HELPNOTFOUND', '524'),
+    ('ERR_INVALIDKEY', '525'),
+    ('RPL_WHOISSECURE', '671'),
+    ('ERR_INVALIDMODEPARAM', '696'),
+    ('RPL_HELPSTART', '704'),
+    ('RPL_HELPTXT', '705'),
+    ('RPL_ENDOFHELP', '706'),
+    ('RPL_KNOCK', '710'),
+    ('RPL_KNOCKDLVR', '711'),
+    ('ERR_TOOMANYKNOCK', '712'),
+    ('ERR_CHANOPEN', '713'),
+    ('ERR_KNOCKONCHAN', '714'),
+    ('RPL_OMOTDSTART', '720'),
+    ('RPL_OMOTD', '721'),
+    ('RPL_ENDOFOMOTD', '722'),
+    ('ERR_NOPRIVS', '723'),
+    ('RPL_QUIETLIST', '728'),
+    ('RPL_ENDOFQUIETLIST', '729'),
+    ('ERR_MLOCKRESTRICTED', '742'),
+)
+
+# Defined by IRCv3 specs (capability negotiation, STARTTLS, MONITOR, SASL and metadata)
+ircv3 = (
+    ('ERR_INVALIDCAPCMD', '410'),
+    ('RPL_STARTTLS', '670'),
+    ('ERR_STARTTLS', '691'),
+    ('RPL_MONONLINE', '730'),
+    ('RPL_MONOFFLINE', '731'),
+    ('RPL_MONLIST', '732'),
+    ('RPL_ENDOFMONLIST', '733'),
+    ('ERR_MONLISTFULL', '734'),
+    ('RPL_WHOISKEYVALUE', '760'),
+    ('RPL_KEYVALUE', '761'),
+    ('RPL_METADATAEND', '762'),
+    ('ERR_METADATALIMIT', '764'),
+    ('ERR_TARGETINVALID', '765'),
+    ('ERR_NOMATCHINGKEY', '766'),
+    ('ERR_KEYINVALID', '767'),
+    ('ERR_KEYNOTSET', '768'),
+    ('ERR_KEYNOPERMISSION', '769'),
+    ('RPL_LOGGEDIN', '900'),
+    ('RPL_LOGGEDOUT', '901'),
+    ('ERR_NICKLOCKED', '902'),
+    ('RPL_SASLSUCCESS', '903'),
+    ('ERR_SASLFAIL', '904'),
+    ('ERR_SASLTOOLONG', '905'),
+    ('ERR_SASLABORTED', '906'),
+    ('ERR_SASLALREADY', '907'),
+    ('RPL_SASLMECHS', '908'),
+)
+
+
+# Old names, kept so code using them still works: alias -> the name the numeric is now dispatched as
+aliases = {
+    # pircel used to have both ADMINLOC numerics under this name, the second one (258) won
+    'RPL_ADMINLOC': 'RPL_ADMINLOC2',
+}
+
+
+class CommandRegistry:
+    def __init__(self, *tables, aliases=None):
+        """ Maps numerics to symbolic names and back, in constant time both ways.
+
+        Args:
+            tables: Iterables of `(name, numeric)` pairs to start with. Unlike `register` these aren't checked (that's
+                most of the time it takes to import us), they have to be upper case and mustn't clash.
+            aliases (dict): Other names for some of the names in `tables`, see `canonical`.
+        """
+        self.symbolic_to_numeric = {}
+        for table in tables:
+            self.symbolic_to_numeric.update(table)
+        self.numeric_to_symbolic = {numeric: name for name, numeric in self.symbolic_to_numeric.items()}
+        self.aliases = dict(aliases or {})
+
+    def canonical(self, name):
+        """ Returns the name a numeric is dispatched as, given it or one of its aliases (in either case). """
+        upper = name.upper()
+        canonical = self.aliases.get(upper)
+        if canonical is None:
+            return name
+        return canonical if name == upper else canonical.lower()
+
+    def register(self, name, numeric, replace=False):
+        """ Adds a numeric.
+
+        Args:
+            name (str): Symbolic name, e.g. 'RPL_WELCOME'. Signals are named after it in lower case.
+            numeric (str or int): The numeric, e.g. '001' or 1.
+            replace (bool): Whether to replace an existing registration of the name or numeric rather than raise
+                `DuplicateCommandError`.
+        """
+        if isinstance(numeric, int):
+            numeric = '{:03d}'.format(numeric)
+        if len(numeric) != 3 or not numeric.isdecimal():
+            raise ValueError('Numerics are three digits, got {!r}'.format(numeric))
+        name = name.upper()
+
+        old_numeric = self.symbolic_to_numeric.get(name)
+        old_name = self.numeric_to_symbolic.get(numeric)
+        if (old_numeric, old_name) == (numeric, name):
+            return
+        if not replace and (old_numeric is not None or old_name is not None):
+            raise DuplicateCommandError('{} {} is already registered as {} {}'.format(
+                name, numeric, old_name or name, old_numeric or numeric))
+
+        if old_numeric is not None:
+            del self.numeric_to_symbolic[old_numeric]
+        if old_name is not None:
+            del self.symbolic_to_numeric[old_name]
+        self.symbolic_to_numeric[name] = numeric
+        self.numeric_to_symbolic[numeric] = name
+
+    def unregister(self, name):
+        del self.numeric_to_symbolic[self.symbolic_to_numeric.pop(name.upper())]
+
+    def symbolic(self, numeric):
+        """ Returns the name for a numeric, raises KeyError for unknown ones. """
+        return self.numeric_to_symbolic[numeric]
+
+    def numeric(self, name):
+        """ Returns the numeric for a name (or alias), raises KeyError for unknown ones. """
+        name = name.upper()
+        return self.symbolic_to_numeric[self.aliases.get(name, name)]
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['symbolic_to_numeric'][self.__dict__['aliases'].get(name, name)]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, name_or_numeric):
+        return name_or_numeric in self.numeric_to_symbolic or name_or_numeric in self.symbolic_to_numeric
+
+    def __len__(self):
+        return len(self.numeric_to_symbolic)
+
+    def __iter__(self):
+        return iter(self.symbolic_to_numeric.items())
+
+
+registry = CommandRegistry(rfc2812, ircd_extensions, ircv3, aliases=aliases)
+register = registry.register
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.history
+--------------
+
+In-memory recent history per channel, for "the last 200 messages in #chan" without a database.
+
+Each channel gets a ring of at most `capacity` lines: timestamps in an `array`, kinds in a `bytearray` and prefixes and
+texts in lists, growing as lines arrive until the ring is full and then overwriting the oldest, so appending is O(1)
+and a quiet channel only takes up as much room as it has lines. The cache as a whole is kept under `max_bytes` (an
+estimate of what the lines take up) by dropping whole channels, least recently used first, so channels nobody's talking
+in or asking about go first.
+
+`recent` returns a `HistoryView`, which reads lines out of the ring as it's iterated rather than copying them.
+"""
+import array
+import collections
+import sys
+import time
+
+from pircel import scrollback, state
+
+_kind_numbers = {kind: number for number, kind in enumerate(scrollback.kinds)}
+
+# Rough cost of a slot in a ring (the array and bytearray entries and two list pointers) and of an empty ring
+_slot_bytes = 8 + 1 + 8 + 8
+_ring_bytes = 512
+
+
+class ChannelHistory:
+    __slots__ = ('name', 'capacity', 'timestamps', 'kinds', 'prefixes', 'texts', 'count', 'size')
+
+    def __init__(self, name, capacity):
+        """ The ring of recent lines in one channel.
+
+        `count` is how many lines have ever been appended, line `n` (counting from 0) lives in slot `n % capacity` for
+        as long as it's one of the last `capacity`.
+        """
+        self.name = name
+        self.capacity = capacity
+        self.timestamps = array.array('d')
+        self.kinds = bytearray()
+        self.prefixes = []
+        self.texts = []
+        self.count = 0
+        self.size = _ring_bytes
+
+    def __len__(self):
+        return len(self.texts)
+
+    def append(self, timestamp, kind, prefix, text):
+        """ Adds a line, returns how many more bytes the ring takes up than it did. """
+        added = sys.getsizeof(prefix) + sys.getsizeof(text)
+        if len(self.texts) < self.capacity:
+            self.timestamps.append(timestamp)
+            self.kinds.append(kind)
+            self.prefixes.append(prefix)
+            self.texts.append(text)
+            added += _slot_bytes
+        else:
+            slot = self.count % self.capacity
+            added -= sys.getsizeof(self.prefixes[slot]) + sys.getsizeof(self.texts[slot])
+            self.timestamps[slot] = timestamp
+            self.kinds[slot] = kind
+            self.prefixes[slot] = prefix
+            self.texts[slot] = text
+        self.count += 1
+        self.size += added
+        return added
+
+    def line(self, number):
+        """ Returns line `number` (as counted by `count`) as a `pircel.scrollback.Line`. """
+        if not self.count - len(self.texts) <= number < self.count:
+            raise IndexError('Line {} is no longer (or not yet) in the history of {}'.format(number, self.name))
+        slot = number % self.capacity
+        return scrollback.Line(self.timestamps[slot], scrollback.kinds[self.kinds[slot]], self.name,
+                               self.prefixes[slot], self.texts[slot])
+
+
+class HistoryView:
+    __slots__ = ('history', 'start', 'stop')
+
+    def __init__(self, history, start, stop):
+        """ Lines `start` to `stop` (as counted by `ChannelHistory.count`) of a channel's history, oldest first.
+
+        Nothing is copied, lines are read out of the ring when they're asked for. Lines that are overwritten (by new
+        ones arriving) before then drop out of the view, so it gets shorter and indexes count from the oldest line
+        that's left.
+        """
+        self.history = history
+        self.start = start
+        self.stop = stop
+
+    def _first(self):
+        """ The first line of the view that's still in the ring. """
+        history = self.history
+        return max(self.start, history.count - len(history))
+
+    def __len__(self):
+        return max(0, self.stop - self._first())
+
+    def __iter__(self):
+        history = self.history
+        for number in range(self._first(), self.stop):
+            yield history.line(number)
+
+    def __reversed__(self):
+        history = self.history
+        for number in range(self.stop - 1, self._first() - 1, -1):
+            yield history.line(number)
+
+    def __getitem__(self, index):
+        first = self._first()
+        length = max(0, self.stop - first)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(length)
+            if step != 1:
+                raise ValueError('History views can only be sliced with a step of 1')
+            return HistoryView(self.history, first + start, first + max(start, stop))
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(index)
+        return self.history.line(first + index)
+
+    def __repr__(self):
+        return '<HistoryView of {} lines in {}>'.format(len(self), self.history.name)
+
+
+class HistoryCache:
+    def __init__(self, capacity=200, max_bytes=64 * 1024 * 1024, casemapping='rfc1459', clock=time.time):
+        """ Recent lines for every channel, within a memory budget.
+
+        Args:
+            capacity (int): Most lines kept per channel.
+            max_bytes (int): Roughly how much memory the lot can use, least recently used channels are dropped to stay
+                under it.
+            casemapping (str): How the network compares channel names, one of `pircel.state.casemapping_tables`.
+            clock (callable): Returns the timestamp to record lines with.
+        """
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.fold_table = state.casemapping_tables[casemapping]
+        self.clock = clock
+
+        # Folded channel name -> ChannelHistory, least recently used first
+        self._channels = collections.OrderedDict()
+        self.size = 0
+        self.evicted = 0
+        self._handlers = []
+
+    def __len__(self):
+        return len(self._channels)
+
+    def __contains__(self, channel):
+        return channel.translate(self.fold_table) in self._channels
+
+    def channels(self):
+        """ The (case folded) names of all the channels with history, least recently used first. """
+        return list(self._channels)
+
+    def append(self, kind, channel, prefix, text='', timestamp=None):
+        key = channel.translate(self.fold_table)
+        history = self._channels.get(key)
+        if history is None:
+            history = self._channels[key] = ChannelHistory(channel, self.capacity)
+            self.size += history.size
+        else:
+            self._channels.move_to_end(key)
+        self.size += history.append(self.clock() if timestamp is None else timestamp, _kind_numbers[kind],
+                                    sys.intern(prefix), text)
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        channels = self._channels
+        while self.size > self.max_bytes and len(channels) > 1:
+            _, history = channels.popitem(last=False)
+            self.size -= history.size
+            self.evicted += 1
+
+    def recent(self, channel, limit=None):
+        """ Returns a `HistoryView` of the last `limit` (all of them if None) lines in `channel`, oldest first. """
+        key = channel.translate(self.fold_table)
+        history = self._channels.get(key)
+        if history is None:
+            return HistoryView(ChannelHistory(channel, 0), 0, 0)
+        self._channels.move_to_end(key)
+        available = len(history)
+        if limit is not None and limit < available:
+            available = limit
+        return HistoryView(history, history.count - available, history.count)
+
+    def forget(self, channel):
+        history = self._channels.pop(channel.translate(self.fold_table), None)
+        if history is not None:
+            self.size -= history.size
+
+    def clear(self):
+        self._channels.clear()
+        self.size = 0
+
+    def attach(self, server_handler):
+        """ Records PRIVMSGs and NOTICEs seen by `server_handler`. """
+        self._handlers.extend(scrollback.attach_recorder(server_handler, self.append, ('privmsg', 'notice')))
+
+    def detach(self):
+        scrollback.detach_recorder(self._handlers)
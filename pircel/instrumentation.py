@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.instrumentation
+----------------------
+
+Optional timing and counting for the line handling hot path, for working out why a connection is lagging.
+
+An `Instrumentation` is attached to a server handler by setting `IRCServerHandler.instrumentation`. While it is, every
+line is counted by command and the time spent in each phase of handling it goes into a histogram:
+    - "parse": splitting the raw line into a message
+    - "decode": decoding the prefix and params of a message parsed from bytes
+    - "handler": the handler's own `on_*` method
+    - "receivers": everything connected to the command's signal
+
+Handlers and receivers that take longer than `slow_threshold` are logged (by name) and counted. Other numbers, such as
+the depth of an `OutboundQueue`, can be added as gauges that are read whenever the results are.
+
+Results are pulled rather than pushed, with `snapshot` (a dict) or `prometheus` (the Prometheus text exposition format,
+for serving on a metrics endpoint). Nothing is timed unless an `Instrumentation` is attached; the handler swaps in its
+instrumented methods when one is and back when it's removed, so there's nothing to pay for it otherwise.
+"""
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+phases = ('parse', 'decode', 'handler', 'receivers')
+
+# Upper bounds (in seconds) of the buckets in the Prometheus exposition
+prometheus_buckets = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2,
+                      5e-2, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    def __init__(self, significant_bits=4):
+        """ Records integer values (e.g. nanoseconds) with a fixed relative precision, HdrHistogram style.
+
+        Values below `2 ** significant_bits` get a bucket each, above that every power of two is split into
+        `2 ** significant_bits` equal buckets, so a value is only ever out by one part in `2 ** significant_bits`
+        (about 6% with the default) however big it is. Only buckets that have been used take up any memory.
+        """
+        self.significant_bits = significant_bits
+        self._sub_buckets = 1 << significant_bits
+        self.counts = collections.defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def _index(self, value):
+        shift = value.bit_length() - self.significant_bits - 1
+        if shift < 0:
+            return value
+        return (shift + 1) * self._sub_buckets + (value >> shift) - self._sub_buckets
+
+    def _bounds(self, index):
+        """ Returns the lowest value in the bucket and the lowest value in the next one. """
+        if index < self._sub_buckets:
+            return index, index + 1
+        shift = index // self._sub_buckets - 1
+        mantissa = index % self._sub_buckets + self._sub_buckets
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def record(self, value):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """ Returns (the top of the bucket holding) the value `fraction` of the recorded values are at or below. """
+        if not self.count:
+            return 0
+        wanted = max(1, fraction * self.count)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(self._bounds(index)[1] - 1, self.max)
+        return self.max
+
+    def count_below(self, value):
+        """ Returns how many recorded values were in buckets entirely at or below `value`. """
+        return sum(count for index, count in self.counts.items() if self._bounds(index)[1] - 1 <= value)
+
+    def clear(self):
+        self.counts.clear()
+        self.count = self.total = self.max = 0
+
+
+def callable_name(function):
+    """ Returns a name for a handler or receiver that's useful in a log message. """
+    name = getattr(function, '__qualname__', None)
+    if name is None:
+        return repr(function)
+    module = getattr(function, '__module__', None)
+    return '{}.{}'.format(module, name) if module else name
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Instrumentation:
+    def __init__(self, slow_threshold=0.05, clock=time.perf_counter_ns):
+        """ Counters, histograms and gauges for one or more server handlers.
+
+        Args:
+            slow_threshold (float): Seconds a single handler or receiver call can take before it's logged as slow.
+            clock (callable): Returns the time in nanoseconds.
+        """
+        self.clock = clock
+        self.slow_threshold = slow_threshold
+        self._slow_ns = int(slow_threshold * 1e9)
+
+        # Keyed by the command as it was parsed (str or bytes), folded together when read
+        self._commands = collections.defaultdict(int)
+        self.histograms = {phase: Histogram() for phase in phases}
+        self.slow = collections.Counter()
+        self.gauges = {}
+
+    def add_gauge(self, name, function):
+        """ Adds a gauge whose value is `function()` at the time the results are read. """
+        self.gauges[name] = function
+
+    def watch_outbound(self, outbound, name='outbound_queue_depth'):
+        """ Adds a gauge for the number of lines waiting in an `OutboundQueue`. """
+        self.add_gauge(name, lambda: outbound.depth)
+
+    def count(self, command):
+        self._commands[command] += 1
+
+    def record(self, phase, elapsed):
+        self.histograms[phase].record(elapsed)
+
+    def call(self, function, *args):
+        """ Calls an `on_*` handler, timing it as the "handler" phase. """
+        start = self.clock()
+        function(*args)
+        elapsed = self.clock() - start
+        self.histograms['handler'].record(elapsed)
+        if elapsed > self._slow_ns:
+            self._slow(function, elapsed)
+
+    def send(self, signal, sender, **kwargs):
+        """ Does what `signal.send` would, timing each receiver and the lot as the "receivers" phase. """
+        clock = self.clock
+        slow_ns = self._slow_ns
+        start = clock()
+        for receiver in signal.receivers_for(sender):
+            receiver_start = clock()
+            receiver(sender, **kwargs)
+            elapsed = clock() - receiver_start
+            if elapsed > slow_ns:
+                self._slow(receiver, elapsed)
+        self.histograms['receivers'].record(clock() - start)
+
+    def _slow(self, function, elapsed):
+        name = callable_name(function)
+        self.slow[name] += 1
+        logger.warning('%s took %.1fms (more than %.1fms)', name, elapsed / 1e6, self.slow_threshold * 1e3)
+
+    @property
+    def commands(self):
+        """ Lines handled per command. """
+        commands = collections.Counter()
+        for command, count in self._commands.items():
+            if isinstance(command, bytes):
+                command = command.decode('ascii', 'replace')
+            commands[command.upper()] += count
+        return commands
+
+    def snapshot(self):
+        """ Returns everything recorded so far as a dict, latencies in microseconds. """
+        return {
+            'commands': dict(self.commands),
+            'phases': {
+                phase: {
+                    'count': histogram.count,
+                    'mean_us': histogram.total / histogram.count / 1e3 if histogram.count else 0.0,
+                    'p50_us': histogram.percentile(0.5) / 1e3,
+                    'p99_us': histogram.percentile(0.99) / 1e3,
+                    'p999_us': histogram.percentile(0.999) / 1e3,
+                    'max_us': histogram.max / 1e3,
+                }
+                for phase, histogram in self.histograms.items()
+            },
+            'slow': dict(self.slow),
+            'gauges': {name: function() for name, function in self.gauges.items()},
+        }
+
+    def prometheus(self, prefix='pircel'):
+        """ Returns everything recorded so far in the Prometheus text exposition format. """
+        lines = [
+            '# HELP {}_lines_total Lines handled, by command.'.format(prefix),
+            '# TYPE {}_lines_total counter'.format(prefix),
+        ]
+        for command, count in sorted(self.commands.items()):
+            lines.append('{}_lines_total{{command="{}"}} {}'.format(prefix, _escape_label(command), count))
+
+        lines.append('# HELP {}_phase_seconds Time spent in each phase of handling a line.'.format(prefix))
+        lines.append('# TYPE {}_phase_seconds histogram'.format(prefix))
+        for phase, histogram in self.histograms.items():
+            for bound in prometheus_buckets:
+                lines.append('{}_phase_seconds_bucket{{phase="{}",le="{}"}} {}'.format(
+                    prefix, phase, bound, histogram.count_below(int(bound * 1e9))))
+            lines.append('{}_phase_seconds_bucket{{phase="{}",le="+Inf"}} {}'.format(prefix, phase, histogram.count))
+            lines.append('{}_phase_seconds_sum{{phase="{}"}} {}'.format(prefix, phase, histogram.total / 1e9))
+            lines.append('{}_phase_seconds_count{{phase="{}"}} {}'.format(prefix, phase, histogram.count))
+
+        lines.append('# HELP {}_slow_calls_total Handler and receiver calls slower than the threshold.'.format(prefix))
+        lines.append('# TYPE {}_slow_calls_total counter'.format(prefix))
+        for name, count in sorted(self.slow.items()):
+            lines.append('{}_slow_calls_total{{callable="{}"}} {}'.format(prefix, _escape_label(name), count))
+
+        for name, function in sorted(self.gauges.items()):
+            lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+            lines.append('{}_{} {}'.format(prefix, name, function()))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        self._commands.clear()
+        self.slow.clear()
+        for histogram in self.histograms.values():
+            histogram.clear()
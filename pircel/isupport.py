@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.isupport
+---------------
+
+What the server told us about itself in RPL_ISUPPORT (005): how it compares names, which modes take parameters, how
+many targets a command can have, how long lines can be and so on.
+
+`ServerCapabilities.from_tokens` turns the raw tokens into an immutable object with everything worked out up front (the
+case folding table, mode lookup sets, target limits), so code that needs them does a dict or set lookup per message
+rather than parsing the tokens again. `IRCServerHandler.capabilities` builds one lazily from the tokens it's been sent,
+and sends the `rpl_isupport` signal as usual so anything that precomputes its own tables from it can rebuild them.
+
+Servers that don't send a token get the RFC 1459 behaviour (or the most conservative limit).
+"""
+import collections
+import re
+import types
+
+_rfc1459_upper = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\^'
+_rfc1459_lower = 'abcdefghijklmnopqrstuvwxyz{}|~'
+casemapping_tables = {
+    'ascii': str.maketrans(_rfc1459_upper[:26], _rfc1459_lower[:26]),
+    'rfc1459': str.maketrans(_rfc1459_upper, _rfc1459_lower),
+    'strict-rfc1459': str.maketrans(_rfc1459_upper[:-1], _rfc1459_lower[:-1]),
+}
+
+_escape = re.compile(r'\\x([0-9A-Fa-f]{2})')
+_prefix = re.compile(r'^\((.*)\)(.*)$')
+
+
+def _unescape(value):
+    """ Token values escape some characters as \\xHH (e.g. a space in NETWORK as \\x20). """
+    if '\\' not in value:
+        return value
+    return _escape.sub(lambda match: chr(int(match.group(1), 16)), value)
+
+
+def _int(value, default):
+    return int(value) if value.isdecimal() else default
+
+
+def _limits(value):
+    """ Parses 'A:1,B:,C:3' style values (TARGMAX, CHANLIMIT) into a dict, an empty limit means no limit (None). """
+    limits = {}
+    for entry in value.split(','):
+        key, _, limit = entry.partition(':')
+        if key:
+            limits[key.upper()] = int(limit) if limit.isdecimal() else None
+    return limits
+
+
+def update_tokens(tokens, params):
+    """ Adds the tokens from one RPL_ISUPPORT's params (without the trailing text) to a dict, '-TOKEN' removes one. """
+    for param in params:
+        key, _, value = param.partition('=')
+        if key.startswith('-'):
+            tokens.pop(key[1:], None)
+        elif key:
+            tokens[key] = _unescape(value)
+
+
+class ServerCapabilities(collections.namedtuple('ServerCapabilities', [
+        'tokens', 'network', 'casemapping', 'fold_table', 'prefix_modes', 'prefix_symbols', 'symbol_to_mode',
+        'mode_to_symbol', 'chanmodes', 'list_modes', 'parameter_modes', 'set_parameter_modes', 'chantypes',
+        'targmax', 'maxtargets', 'chanlimit', 'linelen', 'hostlen', 'nicklen', 'channellen', 'topiclen', 'modes'])):
+    """ Everything from RPL_ISUPPORT that pircel uses, worked out once.
+
+    Attributes:
+        tokens (mapping): The raw tokens, name -> value ('' for tokens without one).
+        fold_table (dict): `str.translate` table that case folds names the way the server does.
+        symbol_to_mode, mode_to_symbol (dict): Between prefix symbols (e.g. '@') and modes (e.g. 'o').
+        chanmodes (tuple): The four CHANMODES groups as strings.
+        list_modes (frozenset): Modes that are lists (e.g. bans), they always have a parameter.
+        parameter_modes (frozenset): Modes that always have a parameter, whether being set or unset (list modes and
+            prefix modes included).
+        set_parameter_modes (frozenset): Modes that only have a parameter when they're being set.
+        targmax (mapping): Command -> most targets it can have, None for no limit, see `max_targets`.
+        modes (int): Most modes with a parameter in one MODE command, None for no limit.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        get = tokens.get
+
+        casemapping = get('CASEMAPPING', 'rfc1459').lower()
+        if casemapping not in casemapping_tables:
+            casemapping = 'rfc1459'
+
+        prefix_modes, prefix_symbols = 'ov', '@+'
+        if 'PREFIX' in tokens:
+            match = _prefix.match(tokens['PREFIX'])
+            prefix_modes, prefix_symbols = match.groups() if match else ('', '')
+
+        chanmodes = (get('CHANMODES') or 'beI,k,l,imnpst').split(',')
+        chanmodes = tuple((chanmodes + [''] * 4)[:4])
+
+        return cls(
+            tokens=types.MappingProxyType(dict(tokens)),
+            network=get('NETWORK'),
+            casemapping=casemapping,
+            fold_table=casemapping_tables[casemapping],
+            prefix_modes=prefix_modes,
+            prefix_symbols=prefix_symbols,
+            symbol_to_mode=dict(zip(prefix_symbols, prefix_modes)),
+            mode_to_symbol=dict(zip(prefix_modes, prefix_symbols)),
+            chanmodes=chanmodes,
+            list_modes=frozenset(chanmodes[0]),
+            parameter_modes=frozenset(chanmodes[0] + chanmodes[1] + prefix_modes),
+            set_parameter_modes=frozenset(chanmodes[2]),
+            chantypes=get('CHANTYPES', '#&'),
+            targmax=types.MappingProxyType(_limits(get('TARGMAX', ''))),
+            maxtargets=_int(get('MAXTARGETS', ''), None),
+            chanlimit=types.MappingProxyType(_limits(get('CHANLIMIT', ''))),
+            linelen=_int(get('LINELEN', ''), 512),
+            hostlen=_int(get('HOSTLEN', ''), 63),
+            nicklen=_int(get('NICKLEN', ''), 9),
+            channellen=_int(get('CHANNELLEN', ''), 200),
+            topiclen=_int(get('TOPICLEN', ''), None),
+            modes=_int(get('MODES', ''), None) if 'MODES' in tokens else 3,
+        )
+
+    def fold(self, name):
+        return name.translate(self.fold_table)
+
+    def is_channel(self, name):
+        return name[:1] in self.chantypes if name else False
+
+    def max_targets(self, command, default=1):
+        """ Most targets (comma separated) `command` can have, None for no limit.
+
+        From TARGMAX if it mentions the command, MAXTARGETS for PRIVMSG and NOTICE if it doesn't, otherwise `default`.
+        """
+        command = command.upper()
+        if command in self.targmax:
+            return self.targmax[command]
+        if self.maxtargets is not None and command in ('PRIVMSG', 'NOTICE'):
+            return self.maxtargets
+        return default
+
+
+default_capabilities = ServerCapabilities.from_tokens({})
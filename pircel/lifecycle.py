@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.lifecycle
+----------------
+
+Keeps a connection to a server up: reconnects when it drops, notices when it has died without dropping, and gets back
+into the channels we were in.
+
+    - `Backoff` spreads reconnection attempts out exponentially, with jitter so that lots of clients that lost their
+      connections at the same time (e.g. when a network restarts) don't all come back at the same moment
+    - `LagMonitor` pings the server, measures how long the replies take and declares the link dead if one doesn't come
+    - `ConnectionLifecycle` ties them together with an adapter, remembers which channels (and keys) we're in and
+      rejoins them with as few JOIN lines as possible once we've registered again
+
+Like `pircel.outbound` none of this is tied to an event loop, it's given a `call_later(delay, callback)` function such
+as `asyncio.AbstractEventLoop.call_later` or `tornado.ioloop.IOLoop.call_later`.
+"""
+import itertools
+import logging
+import random
+import time
+
+from pircel import protocol
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    def __init__(self, base=1, maximum=300, jitter=1.0, random=random.random):
+        """ Exponential backoff with jitter.
+
+        The delay before attempt `n` (counting from 0) is drawn from between `(1 - jitter) * cap` and `cap`, where
+        `cap` is `base * 2 ** n` up to `maximum`. The default (full jitter) spreads reconnections the most.
+
+        Args:
+            base (float): Cap on the delay before the first attempt.
+            maximum (float): Most the cap will grow to.
+            jitter (float): Fraction of the cap to randomize, 0 for none.
+            random (callable): Returns a random float in [0, 1).
+        """
+        self.base = base
+        self.maximum = maximum
+        self.jitter = jitter
+        self.random = random
+
+    def delay(self, attempt):
+        cap = min(self.maximum, self.base * 2 ** min(attempt, 64))
+        return cap * (1 - self.jitter * self.random())
+
+
+class LagMonitor:
+    def __init__(self, server_handler, call_later, interval=60, timeout=180, dead_callback=None, clock=time.monotonic):
+        """ Pings the server every `interval` seconds to measure the lag and notice dead connections.
+
+        Args:
+            server_handler (IRCServerHandler): The connection to ping.
+            call_later (callable): `call_later(delay, callback)`.
+            interval (float): Seconds between pings.
+            timeout (float): Seconds to wait for a ping to be answered before calling `dead_callback`.
+            dead_callback (callable): Called (with no arguments) when the server stops answering.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.server_handler = server_handler
+        self.call_later = call_later
+        self.interval = interval
+        self.timeout = timeout
+        self.dead_callback = dead_callback
+        self.clock = clock
+
+        # Round trip time of the last answered ping and the worst so far, None until one's been answered
+        self.lag = None
+        self.max_lag = None
+
+        self._tokens = itertools.count()
+        self._outstanding = None
+        self._running = False
+        # Bumped on start/stop so callbacks scheduled before then know to do nothing
+        self._generation = 0
+        server_handler.add_callback('pong', self._on_pong)
+
+    def start(self):
+        self._generation += 1
+        self._outstanding = None
+        self._running = True
+        self._schedule()
+
+    def stop(self):
+        self._generation += 1
+        self._outstanding = None
+        self._running = False
+
+    def _schedule(self):
+        generation = self._generation
+        self.call_later(self.interval, lambda: self._check(generation))
+
+    def _check(self, generation):
+        if generation != self._generation:
+            return
+        now = self.clock()
+        if self._outstanding is not None:
+            if now - self._outstanding[1] > self.timeout:
+                logger.info('No reply to a ping in %ss, connection is dead', self.timeout)
+                self.stop()
+                if self.dead_callback is not None:
+                    self.dead_callback()
+                return
+        else:
+            token = 'lag{}'.format(next(self._tokens))
+            self._outstanding = (token, now)
+            self.server_handler.send_ping(token)
+        self._schedule()
+
+    def _on_pong(self, server_handler, prefix, args):
+        if self._outstanding is None or not args or args[-1] != self._outstanding[0]:
+            return
+        self.lag = self.clock() - self._outstanding[1]
+        if self.max_lag is None or self.lag > self.max_lag:
+            self.max_lag = self.lag
+        self._outstanding = None
+
+
+class ConnectionLifecycle:
+    def __init__(self, server_handler, connect, call_later, drop=None, channels=(), backoff=None, ping_interval=60,
+                 ping_timeout=180, clock=time.monotonic):
+        """ Reconnects, watches for dead links and rejoins channels for one connection.
+
+        The adapter tells us what's happening by calling `connected` once the connection is up (before registering)
+        and `disconnected` when it's lost or couldn't be made.
+
+        Args:
+            server_handler (IRCServerHandler): The connection to look after.
+            connect (callable): Starts connecting, called with no arguments.
+            call_later (callable): `call_later(delay, callback)`.
+            drop (callable): Closes the connection (e.g. when it's found to be dead), the adapter should then call
+                `disconnected`.
+            channels: Channels to join, or a dict of channel names to keys (None for channels without one).
+            backoff (Backoff): How long to wait between attempts, defaults to a `Backoff()`.
+            ping_interval (float): Seconds between lag checking pings, None to not ping at all.
+            ping_timeout (float): Seconds without a reply to a ping before the connection is considered dead.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.server_handler = server_handler
+        self._connect = connect
+        self.call_later = call_later
+        self.drop = drop
+        self.backoff = backoff if backoff is not None else Backoff()
+
+        # Folded name -> (name, key), the channels to be in next time we register
+        self.fold_table = server_handler.capabilities.fold_table
+        self.channels = {}
+        if not isinstance(channels, dict):
+            channels = dict.fromkeys(channels)
+        for name, key in channels.items():
+            self.channels[name.translate(self.fold_table)] = (name, key)
+
+        self.lag_monitor = None
+        if ping_interval is not None:
+            self.lag_monitor = LagMonitor(server_handler, call_later, ping_interval, ping_timeout, self._dead, clock)
+
+        self.state = 'idle'
+        self.attempts = 0
+        self.reconnects = 0
+        self._closing = False
+        self._generation = 0
+
+        for signal, callback in (
+                ('rpl_welcome', self._on_welcome),
+                ('join', self._on_join),
+                ('part', self._on_part),
+                ('kick', self._on_kick),
+                ('rpl_isupport', self._on_isupport),
+        ):
+            server_handler.add_callback(signal, callback)
+
+    @property
+    def lag(self):
+        return self.lag_monitor.lag if self.lag_monitor is not None else None
+
+    def start(self):
+        self._closing = False
+        self.state = 'connecting'
+        self._connect()
+
+    def connected(self):
+        self.state = 'registering'
+        if self.lag_monitor is not None:
+            self.lag_monitor.start()
+
+    def disconnected(self, exc=None):
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
+        self.server_handler.disconnected()
+        if self._closing:
+            self.state = 'closed'
+            return
+
+        self.state = 'disconnected'
+        delay = self.backoff.delay(self.attempts)
+        self.attempts += 1
+        self.reconnects += 1
+        logger.info('Disconnected (%s), reconnecting in %.1fs', exc, delay)
+        self._generation += 1
+        generation = self._generation
+        self.call_later(delay, lambda: self._reconnect(generation))
+
+    def _reconnect(self, generation):
+        if self._closing or generation != self._generation:
+            return
+        self.state = 'connecting'
+        self._connect()
+
+    def _dead(self):
+        if self.drop is not None:
+            self.drop()
+
+    def close(self):
+        """ Stops reconnecting, call before closing the connection. """
+        self._closing = True
+        self._generation += 1
+        self.state = 'closed'
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
+
+    # =========================================================================
+    # Channels
+    # =========================================================================
+    def join(self, channel, key=None):
+        """ Joins a channel now (if we're registered) and whenever we reconnect. """
+        self.channels[channel.translate(self.fold_table)] = (channel, key)
+        if self.state == 'connected':
+            self.server_handler.join(channel, key)
+
+    def part(self, channel):
+        self.channels.pop(channel.translate(self.fold_table), None)
+        if self.state == 'connected':
+            self.server_handler.part(channel)
+
+    def _is_us(self, nick):
+        return nick.translate(self.fold_table) == self.server_handler.identity.nick.translate(self.fold_table)
+
+    def _on_welcome(self, server_handler, **kwargs):
+        self.state = 'connected'
+        # We made it all the way so start the backoff from scratch
+        self.attempts = 0
+        if self.channels:
+            server_handler.join_channels(dict(self.channels.values()))
+
+    def _on_join(self, server_handler, prefix, args):
+        if self._is_us(protocol.parse_identity(prefix).nick):
+            folded = args[0].translate(self.fold_table)
+            # Keep the key if we joined it with one
+            self.channels[folded] = (args[0], self.channels.get(folded, (None, None))[1])
+
+    def _on_part(self, server_handler, prefix, args):
+        if self._is_us(protocol.parse_identity(prefix).nick):
+            self.channels.pop(args[0].translate(self.fold_table), None)
+
+    def _on_kick(self, server_handler, prefix, args):
+        if len(args) > 1 and self._is_us(args[1]):
+            self.channels.pop(args[0].translate(self.fold_table), None)
+
+    def _on_isupport(self, server_handler, prefix, args):
+        fold_table = server_handler.capabilities.fold_table
+        if fold_table is not self.fold_table:
+            self.fold_table = fold_table
+            self.channels = {name.translate(fold_table): (name, key) for name, key in self.channels.values()}
+    # =========================================================================
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pircel.manager
+--------------
+
+Runs lots of IRC connections (e.g. one identity on hundreds of networks) on a single asyncio loop.
+
+Rather than every connection having its own ping timer all of the periodic work (pings, dead connection detection and
+reconnect backoff) goes through one `TimerWheel`, and (re)connections are queued and started `connect_stagger` seconds
+apart by a single callback. That way the number of timers on the loop doesn't grow with the number of connections.
+"""
+import asyncio
+import collections
+import logging
+import math
+import time
+
+from pircel import asyncio_adapter, lifecycle, protocol
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """ A hashed timer wheel, lots of cheap timers that only need `tick` precision driven by one loop timer.
+
+    Timers are put in the slot for the tick they expire on (going around the wheel as many times as needed), each tick
+    only looks at the timers in one slot.
+    """
+    def __init__(self, loop, tick=0.5, slots=512):
+        self.loop = loop
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.position = 0
+        self._handle = None
+
+    def schedule(self, delay, callback, *args):
+        """ Calls `callback(*args)` after roughly `delay` seconds, returns a handle that can be passed to `cancel`. """
+        ticks = max(1, math.ceil(delay / self.tick))
+        rounds, offset = divmod(ticks, len(self.slots))
+        if offset == 0:
+            rounds, offset = rounds - 1, len(self.slots)
+        # [rounds remaining, callback, args], mutable so we can cancel it and count down the rounds in place
+        timer = [rounds, callback, args]
+        self.slots[(self.position + offset) % len(self.slots)].append(timer)
+        return timer
+
+    @staticmethod
+    def cancel(timer):
+        timer[1] = None
+
+    def __len__(self):
+        return sum(1 for slot in self.slots for timer in slot if timer[1] is not None)
+
+    @property
+    def running(self):
+        return self._handle is not None
+
+    def start(self):
+        if self._handle is None:
+            self._handle = self.loop.call_later(self.tick, self._advance)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _advance(self):
+        self._handle = self.loop.call_later(self.tick, self._advance)
+        self.position = (self.position + 1) % len(self.slots)
+
+        slot = self.slots[self.position]
+        if not slot:
+            return
+        expired = []
+        remaining = []
+        for timer in slot:
+            if timer[1] is None:
+                continue
+            elif timer[0]:
+                timer[0] -= 1
+                remaining.append(timer)
+            else:
+                expired.append(timer)
+        self.slots[self.position] = remaining
+
+        for _, callback, args in expired:
+            if callback is None:  # cancelled by an earlier callback in this tick
+                continue
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception('Error in timer callback %r', callback)
+
+
+class ManagedConnection:
+    """ One connection owned by a `ConnectionManager`. """
+    def __init__(self, manager, server_handler, host, port, secure, channels, outbound=None):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.channels = list(channels)
+
+        self.line_stream = asyncio_adapter.LineStream(loop=manager.loop)
+        self.client = asyncio_adapter.IRCClient(self.line_stream, server_handler, ping_interval=None, outbound=outbound)
+        self.server_handler = server_handler
+        self._write_function = server_handler.write_function
+        self._write_bytes = server_handler.write_bytes
+
+        # Count lines on the way in and out without getting in the way of the handler
+        self.line_stream.lines_callback = self._handle_lines
+        self.line_stream.line_callback = None
+        self.line_stream.disconnect_callback = self._disconnected
+        server_handler.write_function = self._write
+        server_handler.write_bytes = self._write_encoded
+
+        self.state = 'idle'
+        self.attempts = 0
+        self.reconnects = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.last_received = None
+        self._ping_timer = None
+        self._closing = False
+
+    @property
+    def connected(self):
+        return self.line_stream.transport is not None
+
+    def _handle_lines(self, lines):
+        self.lines_in += len(lines)
+        self.last_received = self.manager.loop.time()
+        self.server_handler.handle_lines(lines)
+
+    def _write(self, line):
+        self.lines_out += 1
+        self._write_function(line)
+
+    def _write_encoded(self, data):
+        self.lines_out += 1
+        self._write_bytes(data)
+
+    def connect(self):
+        if self._closing or self.state in ('connecting', 'connected'):
+            return
+        self.state = 'connecting'
+        self.manager.loop.create_task(self._connect())
+
+    async def _connect(self):
+        try:
+            await self.line_stream.connect(self.host, self.port, self.secure)
+        except OSError as e:
+            logger.info('Connecting to %s:%s failed: %s', self.host, self.port, e)
+            self.state = 'disconnected'
+            self._schedule_reconnect()
+            return
+        self.state = 'connected'
+        self.last_received = self.manager.loop.time()
+        self._ping_timer = self.manager.wheel.schedule(self.manager.ping_interval, self._ping)
+
+    def _ping(self):
+        if not self.connected:
+            return
+        if self.manager.loop.time() - self.last_received > self.manager.ping_timeout:
+            logger.info('No data from %s:%s for %ss, disconnecting', self.host, self.port, self.manager.ping_timeout)
+            self.line_stream.transport.close()
+            return
+        self.server_handler.send_ping(time.time())
+        self._ping_timer = self.manager.wheel.schedule(self.manager.ping_interval, self._ping)
+
+    def _disconnected(self, exc):
+        if self._ping_timer is not None:
+            self.manager.wheel.cancel(self._ping_timer)
+            self._ping_timer = None
+        self.server_handler.disconnected()
+        if self.state == 'connected':
+            # We made it all the way so start the backoff from scratch
+            self.attempts = 0
+        self.state = 'disconnected'
+        if not self._closing:
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._closing:
+            return
+        delay = self.manager.reconnect_delay(self.attempts)
+        self.attempts += 1
+        self.reconnects += 1
+        logger.debug('Reconnecting to %s:%s in %ss', self.host, self.port, delay)
+        self.manager.wheel.schedule(delay, self.manager.queue_connect, self)
+
+    def on_welcome(self):
+        if self.channels:
+            self.server_handler.join_channels(self.channels)
+
+    def close(self):
+        self._closing = True
+        self.state = 'closed'
+        self.client.close()
+
+
+class ConnectionManager:
+    """ Owns many connections on one loop, sharing a single timer for all of them. """
+    def __init__(self, loop=None, ping_interval=60, ping_timeout=180, connect_stagger=0.05, reconnect_base=1,
+                 reconnect_max=300, reconnect_jitter=1.0, tick=0.5):
+        """
+        Args:
+            loop (asyncio.AbstractEventLoop): The loop to run on, defaults to the current event loop.
+            ping_interval (float): Seconds between pings on each connection.
+            ping_timeout (float): Seconds without hearing anything from a server before we consider it dead and
+                reconnect.
+            connect_stagger (float): Seconds between starting each connection when starting lots at once.
+            reconnect_base (float): Delay before the first reconnection attempt, doubling with each failed attempt.
+            reconnect_max (float): Longest we'll wait between reconnection attempts.
+            reconnect_jitter (float): Fraction of each reconnection delay that's random, so that connections dropped
+                together don't all come back together (see `pircel.lifecycle.Backoff`).
+            tick (float): Resolution of the timer wheel.
+        """
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.connect_stagger = connect_stagger
+        self.reconnect_base = reconnect_base
+        self.reconnect_max = reconnect_max
+        self.backoff = lifecycle.Backoff(reconnect_base, reconnect_max, reconnect_jitter)
+
+        self.wheel = TimerWheel(self.loop, tick=tick)
+        self.connections = []
+        self._by_handler = {}
+        self._pending_connects = collections.deque()
+        self._connect_handle = None
+        self._welcome_signal = protocol.signal_factory('rpl_welcome')
+        self._welcome_signal.connect(self._on_welcome)
+
+    def add(self, server_handler, host, port, secure=True, channels=(), outbound=None):
+        """ Adds a connection to the manager, it'll be connected when `start` is called (or now if it already has).
+
+        Args:
+            outbound (pircel.outbound.OutboundQueue): Optional flood control for the connection, it should use this
+                manager's loop.
+        """
+        connection = ManagedConnection(self, server_handler, host, port, secure, channels, outbound)
+        self.connections.append(connection)
+        self._by_handler[server_handler] = connection
+        if self.wheel.running:
+            self.queue_connect(connection)
+        return connection
+
+    def start(self):
+        """ Starts the timer wheel and connects everything, `connect_stagger` seconds apart. """
+        self.wheel.start()
+        for connection in self.connections:
+            self.queue_connect(connection)
+
+    def queue_connect(self, connection):
+        """ Connects `connection` once everything queued before it has had its turn.
+
+        All (re)connections go through here so that lots of them at once (e.g. when a network restarts) are spread out
+        rather than all hitting the server together.
+        """
+        self._pending_connects.append(connection)
+        if self._connect_handle is None:
+            self._connect_handle = self.loop.call_soon(self._connect_next)
+
+    def _connect_next(self):
+        self._connect_handle = None
+        if self._pending_connects:
+            self._pending_connects.popleft().connect()
+        if self._pending_connects:
+            self._connect_handle = self.loop.call_later(self.connect_stagger, self._connect_next)
+
+    def close(self):
+        self.wheel.stop()
+        if self._connect_handle is not None:
+            self._connect_handle.cancel()
+            self._connect_handle = None
+        self._pending_connects.clear()
+        self._welcome_signal.disconnect(self._on_welcome)
+        for connection in self.connections:
+            connection.close()
+
+    def reconnect_delay(self, attempt):
+        return self.backoff.delay(attempt)
+
+    def _on_welcome(self, server_handler, **kwargs):
+        connection = self._by_handler.get(server_handler)
+        if connection is not None:
+            connection.on_welcome()
+
+    def stats(self):
+        """ Aggregate counters across all connections. """
+        states = collections.Counter(connection.state for connection in self.connections)
+        return {
+            'connections': len(self.connections),
+            'connected': states['connected'],
+            'connecting': states['connecting'],
+            'disconnected': states['disconnected'],
+            'reconnects': sum(connection.reconnects for connection in self.connections),
+            'lines_in': sum(connection.lines_in for connection in self.connections),
+            'lines_out': sum(connection.lines_out for connection in self.connections),
+            'pending_connects': len(self._pending_connects),
+            'timers': len(self.wheel),
+        }
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pircel.outbound
+---------------
+
+Client-side flood control for lines going to the server.
+
+An `OutboundQueue` sits between an `IRCServerHandler` (as its write function) and a line stream (via the stream's
+`write_bytes`). Lines are paced with a token bucket so we don't get killed for flooding, PONGs jump the queue so we
+don't get disconnected for not answering pings, lines for different targets are interleaved so one long message to one
+channel doesn't hold everything else up, and whatever is allowed out at once is sent in a single write.
+
+Like the protocol module this isn't tied to an event loop, it just needs a `call_later(delay, callback)` function such
+as `asyncio.AbstractEventLoop.call_later` or `tornado.ioloop.IOLoop.call_later`.
+"""
+import collections
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+URGENT = 0
+HIGH = 1
+NORMAL = 2
+LOW = 3
+
+# Commands whose first argument is who/where the line is going to
+_targeted_commands = frozenset(('PRIVMSG', 'NOTICE', 'JOIN', 'PART', 'MODE', 'TOPIC', 'KICK', 'INVITE', 'WHO', 'NAMES'))
+_urgent_commands = frozenset(('PONG',))
+
+
+def _target(line):
+    if isinstance(line, bytes):
+        # Only decode the command and target (to compare with the ones given to `set_priority`), not the whole line
+        command, _, rest = line.partition(b' ')
+        target = rest.partition(b' ')[0].rstrip(b'\r\n')
+        line = '{} {}'.format(command.decode('ascii', 'replace'), target.decode('utf8', 'replace'))
+    command, _, rest = line.partition(' ')
+    command = command.upper()
+    if command in _urgent_commands:
+        return command, None
+    if command in _targeted_commands:
+        return command, rest.partition(' ')[0]
+    return command, None
+
+
+class OutboundQueue:
+    def __init__(self, call_later, write_bytes=None, burst=5, rate=1.0, clock=time.monotonic, encoding='utf8'):
+        """
+        Args:
+            call_later (callable): `call_later(delay, callback)`, used to schedule sending.
+            write_bytes (callable): Called with the bytes to send, e.g. `LineStream.write_bytes`. Can be set later.
+            burst (int): How many lines can be sent at once after being idle, at least 1.
+            rate (float): How many lines per second can be sent once the burst is used up, must be more than 0 (there's
+                no unlimited, a big rate does the same).
+            clock (callable): Returns the current time in seconds.
+            encoding (str): Encoding to send lines in.
+        """
+        if rate <= 0:
+            raise ValueError('The rate must be more than 0 lines per second, not {}'.format(rate))
+        if burst < 1:
+            # Lines are only sent once there's a whole token, there never would be
+            raise ValueError('The burst must be at least 1 line, not {}'.format(burst))
+        self.call_later = call_later
+        self.write_bytes = write_bytes
+        self.burst = burst
+        self.rate = rate
+        self.clock = clock
+        self.encoding = encoding
+
+        self._tokens = float(burst)
+        self._last_refill = clock()
+        # When the next flush is due and a counter so that flushes superseded by an earlier one can be ignored
+        self._flush_at = None
+        self._flush_generation = 0
+
+        # priority -> {target: deque of (line bytes, time queued)}, the dict's order is the round robin order
+        self._lanes = collections.defaultdict(collections.OrderedDict)
+        self._priorities = {}
+        self.depth = 0
+
+        # Metrics
+        self.sent = 0
+        self.writes = 0
+        self.max_depth = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def set_priority(self, target, priority):
+        """ Sets the priority of lines to `target` (e.g. a channel), lower numbers go first (default `NORMAL`). """
+        self._priorities[target] = priority
+
+    def write(self, line):
+        """ Queues a line to be sent, suitable for use as an `IRCServerHandler`'s write function.
+
+        Lines can also be given already encoded (e.g. as its `write_bytes`), they're queued as they are.
+        """
+        command, target = _target(line)
+        if command in _urgent_commands:
+            priority = URGENT
+        else:
+            priority = self._priorities.get(target, NORMAL)
+
+        if isinstance(line, str):
+            if not line.endswith('\n'):
+                line += '\r\n'
+            line = line.encode(self.encoding)
+        elif not line.endswith(b'\n'):
+            line += b'\r\n'
+        lane = self._lanes[priority].get(target)
+        if lane is None:
+            lane = self._lanes[priority][target] = collections.deque()
+        lane.append((line, self.clock()))
+
+        self.depth += 1
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+        self._schedule(0)
+
+    def _schedule(self, delay):
+        when = self.clock() + delay
+        if self._flush_at is not None and self._flush_at <= when:
+            return
+        self._flush_at = when
+        self._flush_generation += 1
+        self.call_later(delay, functools.partial(self._flush, self._flush_generation))
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _next_line(self):
+        for priority in sorted(self._lanes):
+            targets = self._lanes[priority]
+            if not targets:
+                continue
+            target, lane = next(iter(targets.items()))
+            item = lane.popleft()
+            # Move this target to the back of the round robin (or drop it if it's done)
+            del targets[target]
+            if lane:
+                targets[target] = lane
+            return item
+
+    def _flush(self, generation):
+        if generation != self._flush_generation:
+            return
+        self._flush_at = None
+        if not self.depth:
+            return
+
+        now = self.clock()
+        self._refill(now)
+
+        chunks = []
+        while self.depth:
+            # Urgent lines always go but still use up a token if there is one
+            if self._tokens < 1 and not self._lanes[URGENT]:
+                break
+            data, queued_at = self._next_line()
+            self._tokens = max(0.0, self._tokens - 1)
+            self.depth -= 1
+
+            latency = now - queued_at
+            self.total_latency += latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+            chunks.append(data)
+
+        if chunks:
+            self.sent += len(chunks)
+            self.writes += 1
+            self.write_bytes(b''.join(chunks))
+
+        if self.depth:
+            self._schedule((1 - self._tokens) / self.rate)
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'writes': self.writes,
+            'mean_latency': self.total_latency / self.sent if self.sent else 0.0,
+            'max_latency': self.max_latency,
+        }
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pircel.parallel
+---------------
+
+Optional multi-core execution for busy connections.
+
+The network I/O stays on the event loop but a `ParallelDispatcher` (used as a line stream's `lines_callback`) sends each
+batch of raw lines to a pool of worker processes to be decoded and parsed, then dispatches the resulting `Message`s on
+the loop in the order the lines arrived. Lines that aren't utf8 are only parsed by the workers, they're decoded on the
+loop by the server handler's decoder so they come out exactly as they would without the pool.
+
+User callbacks can also be moved off the loop: mark them with `offloadable` and add them with
+`ParallelDispatcher.add_callback` and they'll be run on a thread (or process) pool instead. Calls for the same key (by
+default the first argument of the command, i.e. the channel or nick for most commands) run one at a time and in order,
+different keys run in parallel.
+
+Like the protocol module this isn't tied to an event loop, it needs a thread-safe `post(callback)` function to get back
+onto the loop, e.g. `asyncio.AbstractEventLoop.call_soon_threadsafe` or `tornado.ioloop.IOLoop.add_callback`.
+"""
+import collections
+import concurrent.futures
+import functools
+import logging
+import threading
+
+from pircel import protocol
+
+logger = logging.getLogger(__name__)
+
+
+def parse_batch(lines):
+    """ Parses a batch of raw lines, returning a list of `Message`s (None for malformed lines).
+
+    This is what runs in the worker processes. Lines that are valid utf8 are decoded here, anything else is left as
+    bytes (like `parse_message_bytes` leaves it) for the server handler's `LineDecoder` to decode when it's dispatched,
+    since only that knows the connection's CHARSET and fallback and the encodings it's learnt.
+    """
+    parse_message = protocol.parse_message
+    parse_message_bytes = protocol.parse_message_bytes
+
+    messages = []
+    for line in lines:
+        try:
+            text = str(line, 'utf8')
+        except UnicodeDecodeError:
+            text = None
+        try:
+            messages.append(parse_message(text) if text is not None else parse_message_bytes(line))
+        except protocol.MalformedLineError:
+            messages.append(None)
+    return messages
+
+
+def default_key(prefix, args, messages=None):
+    """ Orders offloaded calls by the first argument of the command (usually the channel).
+
+    Batch receivers (sent `messages` too) are ordered by the batch's first parameter, or if it has none the first
+    argument of its first message.
+    """
+    if args:
+        return args[0]
+    if messages:
+        return messages[0].params[0] if messages[0].params else None
+    return None
+
+
+def offloadable(function=None, key=default_key):
+    """ Marks a callback as safe to run off the event loop.
+
+    Can be used bare (`@offloadable`) or with a key function (`@offloadable(key=...)`) that takes `(prefix, args)` and
+    returns what calls should be ordered by. Key functions for batch receivers are also given the `messages` keyword
+    argument.
+    """
+    if function is None:
+        return functools.partial(offloadable, key=key)
+    function.offload_key = key
+    return function
+
+
+class OrderedExecutor:
+    """ Runs calls on an executor, calls with the same key run one at a time in the order they were submitted. """
+    def __init__(self, executor):
+        self.executor = executor
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, function, *args, **kwargs):
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((function, args, kwargs))
+                return
+            self._queues[key] = collections.deque()
+        self._run(key, function, args, kwargs)
+
+    def _run(self, key, function, args, kwargs):
+        future = self.executor.submit(function, *args, **kwargs)
+        future.add_done_callback(functools.partial(self._done, key, function))
+
+    def _done(self, key, function, future):
+        if future.exception() is not None:
+            logger.error('Offloaded callback %r failed', function, exc_info=future.exception())
+        with self._lock:
+            queue = self._queues[key]
+            if not queue:
+                del self._queues[key]
+                return
+            function, args, kwargs = queue.popleft()
+        self._run(key, function, args, kwargs)
+
+    def idle(self):
+        with self._lock:
+            return not self._queues
+
+
+class ParallelDispatcher:
+    def __init__(self, server_handler, post, parse_executor=None, callback_executor=None, min_batch=64):
+        """
+        Args:
+            server_handler (IRCServerHandler): Where parsed messages are dispatched.
+            post (callable): Thread-safe way to run a callback on the event loop.
+            parse_executor (concurrent.futures.Executor): Where lines are decoded and parsed, defaults to a process
+                pool with a worker per core.
+            callback_executor (concurrent.futures.Executor): Where offloadable callbacks are run, defaults to a thread
+                pool. With a process pool callbacks get None rather than the server handler as their first argument
+                (since it can't be sent to another process) and both they and their arguments need to be picklable.
+            min_batch (int): Batches smaller than this are parsed on the loop when nothing is waiting on the pool, it's
+                not worth the round trip.
+        """
+        self.server_handler = server_handler
+        self.post = post
+        self.parse_executor = parse_executor if parse_executor is not None else concurrent.futures.ProcessPoolExecutor()
+        self.callback_executor = OrderedExecutor(callback_executor if callback_executor is not None
+                                                 else concurrent.futures.ThreadPoolExecutor())
+        self._pass_sender = not isinstance(self.callback_executor.executor, concurrent.futures.ProcessPoolExecutor)
+        self.min_batch = min_batch
+
+        # (future, raw lines) in the order the lines arrived
+        self._pending = collections.deque()
+        self._offloaded = {}
+
+    def handle_lines(self, lines):
+        """ Decodes and parses `lines` on the pool then dispatches them on the loop, use as a `lines_callback`. """
+        if not self._pending and len(lines) < self.min_batch:
+            self.server_handler.handle_lines(lines)
+            return
+        future = self.parse_executor.submit(parse_batch, lines)
+        self._pending.append((future, lines))
+        future.add_done_callback(lambda future: self.post(self._drain))
+
+    def _drain(self):
+        pending = self._pending
+        handle_message = self.server_handler.handle_message
+        while pending and pending[0][0].done():
+            future, lines = pending.popleft()
+            try:
+                messages = future.result()
+            except Exception:
+                logger.exception('Parsing a batch of %s lines failed, parsing on the loop instead', len(lines))
+                self.server_handler.handle_lines(lines)
+                continue
+            for message, line in zip(messages, lines):
+                if message is None:
+                    self.server_handler.log_unhandled(line)
+                else:
+                    handle_message(message, line)
+
+    def add_callback(self, signal, callback):
+        """ Like `IRCServerHandler.add_callback` but callbacks marked `offloadable` are run off the loop. """
+        key_function = getattr(callback, 'offload_key', None)
+        if key_function is None:
+            self.server_handler.add_callback(signal, callback, weak=False)
+            return
+
+        def offloaded(sender, prefix, args, **kwargs):
+            sender = sender if self._pass_sender else None
+            self.callback_executor.submit(key_function(prefix, args, **kwargs), callback, sender, prefix=prefix,
+                                          args=args, **kwargs)
+
+        self._offloaded[(signal, callback)] = offloaded
+        self.server_handler.add_callback(signal, offloaded, weak=False)
+
+    def remove_callback(self, signal, callback):
+        self.server_handler.remove_callback(signal, self._offloaded.pop((signal, callback), callback))
+
+    def shutdown(self, wait=True):
+        self.parse_executor.shutdown(wait=wait)
+        self.callback_executor.executor.shutdown(wait=wait)
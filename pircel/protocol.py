@@ -11,11 +11,14 @@ This module defines functions and objects for interacting with an IRC server inc
       (e.g. it'll work with both asyncio and tornado if you set them up right; though twisted won't work at the moment
       because it doesn't support python 3)
 """
+import collections
+import functools
 import logging
-
-import chardet
+import sys
 
 import pircel
+import pircel.commands
+import pircel.isupport
 import pircel.signals
 
 logger = logging.getLogger(__name__)
@@ -36,9 +39,125 @@ class UnknownModeCommandError(Error):
     """ Exception thrown on unknown mode change command. """
 
 
+class MalformedLineError(Error):
+    """ Exception thrown when a line from the server can't be split into a message. """
+
+
+Message = collections.namedtuple('Message', ['tags', 'prefix', 'command', 'params'])
+Message.__doc__ = """ A single parsed IRC message.
+
+Attributes:
+    tags (dict or None): IRCv3 message tags, None if the line had none.
+    prefix (str): Who the message is from, empty if the server didn't give one.
+    command (str): The command exactly as the server sent it (e.g. 'PRIVMSG' or '001').
+    params (list): The arguments to the command, the trailing argument (if any) included as the last item.
+"""
+
+# Skips the python-level `__new__` of our namedtuples, we're calling these for every line so it's worth it
+_new_message = _new_identity = tuple.__new__
+
+_tag_escapes = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+def _unescape_tag_value(value):
+    """ Reverses the IRCv3 message tag value escaping. """
+    chars = []
+    escaped = False
+    for char in value:
+        if escaped:
+            chars.append(_tag_escapes.get(char, char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            chars.append(char)
+    return ''.join(chars)
+
+
+def parse_tags(tag_string):
+    """ Splits an IRCv3 tag string (without the leading '@') into a dict.
+
+    Tags without a value (or with an empty one) map to the empty string.
+    """
+    tags = {}
+    for tag in tag_string.split(';'):
+        if not tag:
+            continue
+        key, _, value = tag.partition('=')
+        if '\\' in value:
+            value = _unescape_tag_value(value)
+        tags[key] = value
+    return tags
+
+
+def _make_parser(space, space_colon, at, colon, line_end, empty, decode_tags):
+    """ Builds a line parser for either `str` or `bytes` lines, see `parse_message`.
+
+    Both parsers share this one implementation with the separators passed in; `at` and `colon` are compared against
+    `line[0]`, which is an int for bytes. `decode_tags` turns the tag string into the `str` that `parse_tags` wants.
+    """
+    def parse(line):
+        # Indexing past what's there is how a line without a command shows up, it's cheaper than checking first
+        try:
+            first = line[0]
+            tags = None
+            if first == at:
+                tag_string, _, line = line.partition(space)
+                tags = parse_tags(decode_tags(tag_string[1:]))
+                line = line.lstrip(space)
+                first = line[0]
+
+            # The prefix can't contain a space so the first ' :' is always the start of the trailing argument, and
+            # `split()` throws away the line terminator for us when there isn't one
+            middle, separator, trailing = line.partition(space_colon)
+            params = middle.split()
+            if first == colon:
+                prefix = params[0][1:]
+                command = params[1]
+                del params[:2]
+            else:
+                prefix = empty
+                command = params.pop(0)
+        except IndexError:
+            raise MalformedLineError('No command in line: {!r}'.format(line)) from None
+
+        if separator:
+            params.append(trailing.rstrip(line_end))
+        return _new_message(Message, (tags, prefix, command, params))
+    return parse
+
+
+parse_message = _make_parser(' ', ' :', '@', ':', '\r\n', '', str)
+parse_message.__name__ = parse_message.__qualname__ = 'parse_message'
+parse_message.__doc__ = """ Splits a decoded line from the server into a `Message`.
+
+Unlike `split_irc_line` this understands IRCv3 message tags, copes with runs of spaces between arguments and only strips
+the line terminator (so whitespace at the end of a trailing argument is preserved). The line is split once on ' :' and
+once on whitespace, there's no separate strip or prefix pass and untagged lines don't look for tags beyond `line[0]`.
+
+Raises:
+    MalformedLineError: If the line has no command.
+"""
+
+parse_message_bytes = _make_parser(b' ', b' :', b'@'[0], b':'[0], b'\r\n', b'',
+                                   lambda tag_string: tag_string.decode('utf8', 'replace'))
+parse_message_bytes.__name__ = parse_message_bytes.__qualname__ = 'parse_message_bytes'
+parse_message_bytes.__doc__ = """ Splits a raw line from the server into a `Message` without decoding it.
+
+Works exactly like `parse_message` (it's the same code) but on bytes. The tags are decoded (they're always utf8) but the
+prefix, command and params are left as bytes so nothing else is decoded until something actually wants the message, see
+`LineDecoder.decode_message`.
+
+Raises:
+    MalformedLineError: If the line has no command.
+"""
+
+
 def split_irc_line(s):
     """Breaks a message from an IRC server into its prefix, command, and arguments.
 
+    Superseded by `parse_message`, kept around for compatibility (and as a baseline for the parser benchmarks).
+
     Copied straight from twisted, license and copyright for this function follows:
     Copyright (c) 2001-2014
     Allen Short
@@ -117,15 +236,50 @@ def split_irc_line(s):
     return prefix, command, args
 
 
+Identity = collections.namedtuple('Identity', ['nick', 'username', 'host'])
+Identity.__doc__ = """ Who a message is from, as returned by `parse_identity`.
+
+Attributes:
+    nick (str): The nick, or the server name for messages from a server.
+    username (str): The username without any leading '~', None if the prefix didn't have one.
+    host (str): None if the prefix didn't have one.
+"""
+
+
+@functools.lru_cache(maxsize=65536)
 def parse_identity(who):
-    """ Extract the parts out of an IRC user identifier string. """
-    nick, rest = who.split('!')
-    username, host = rest.split('@')
+    """ Extract the parts out of an IRC user identifier string (a message prefix) into an `Identity`.
+
+    The same few thousand prefixes make up most of the traffic in busy channels so the results are cached (the cache
+    hit rate is available from `identity_cache_stats`) and the strings in them interned, i.e. every message from the
+    same user gets the same `Identity` object and every user on the same host shares the same host string.
+
+    Server prefixes (no '!') have the server name as the nick.
+    """
+    nick, has_username, rest = who.partition('!')
+    if has_username:
+        username, _, host = rest.partition('@')
+        if username.startswith('~'):
+            username = username[1:]
+    else:
+        username = None
+        nick, _, host = who.partition('@')
+
+    return _new_identity(Identity, (sys.intern(nick), sys.intern(username) if username else None,
+                                    sys.intern(host) if host else None))
 
-    if username.startswith('~'):
-        username = username[1:]
 
-    return nick, username, host
+def identity_cache_stats():
+    """ Returns counters for `parse_identity`'s cache. """
+    info = parse_identity.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_rate': info.hits / lookups if lookups else 0.0,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+    }
 
 
 def get_symbolic_command(command):
@@ -145,6 +299,8 @@ def decode(line):
         line = str(line, encoding='utf8')
     except UnicodeDecodeError:
         logger.debug('UTF8 decode failed, bytes: %s', line)
+        # chardet is slow to import and we hardly ever need it
+        import chardet
         encoding = chardet.detect(line)['encoding']
         logger.debug('Tried autodetecting and got %s, decoding now', encoding)
         line = str(line, encoding=encoding)
@@ -154,26 +310,268 @@ def decode(line):
     return line
 
 
+def _sender_and_target(line):
+    """ Cheaply picks the sender's nick and the first argument (usually a channel or nick) out of a raw line. """
+    if line.startswith(b'@'):
+        line = line.partition(b' ')[2].lstrip(b' ')
+    sender = None
+    if line.startswith(b':'):
+        prefix, _, line = line.partition(b' ')
+        sender = prefix[1:].partition(b'!')[0]
+    target = line.lstrip(b' ').split(b' ', 2)[1:2]
+    return sender, target[0] if target and not target[0].startswith(b':') else None
+
+
+class LineDecoder:
+    """ Decodes lines from one server, remembering which encoding worked for each sender and channel.
+
+    Lines are decoded as utf8 if possible. Failing that we try (in order):
+        * the encoding that last worked for the sender's nick or the line's target (channel or nick)
+        * the CHARSET the server advertised in its ISUPPORT
+        * the fallback encoding if one was given, otherwise chardet (the result of which is remembered for next time)
+
+    If the server advertised UTF8ONLY undecodable bytes are just replaced.
+
+    The number of lines that were decoded each way (other than plain utf8) is kept in `counters`.
+    """
+    def __init__(self, fallback=None, cache_size=1024):
+        """
+        Args:
+            fallback (str): Encoding to use instead of running chardet, e.g. 'latin-1' or 'cp1252'. Use
+                'surrogateescape' to decode as utf8 while keeping undecodable bytes as lone surrogates (so they can be
+                encoded back to the original bytes with the same error handler).
+            cache_size (int): How many senders/channels to remember encodings for before discarding the least recently
+                used ones.
+        """
+        self.fallback = fallback
+        self.cache_size = cache_size
+        self.charset = None
+        self.utf8_only = False
+        self.counters = collections.Counter()
+        self._encodings = collections.OrderedDict()
+
+    def decode(self, line):
+        if isinstance(line, str):
+            return line
+        try:
+            return str(line, encoding='utf8')
+        except UnicodeDecodeError:
+            return str(line, *self._encoding_for(line))
+
+    def decode_message(self, message, line):
+        """ Decodes a `Message` from `parse_message_bytes`, `line` being the raw line it was parsed from. """
+        prefix, params = self.decode_params(message.prefix, message.params, line)
+        return _new_message(Message, (message.tags, prefix, str(message.command, 'ascii', 'replace'), params))
+
+    def decode_params(self, prefix, params, line):
+        """ Decodes the (bytes) prefix and params of a message, returns them as `(prefix, params)`. """
+        # One decode call for the lot, lines never contain '\n' so it's safe to join and split on
+        parts = params[:]
+        parts.append(prefix)
+        joined = b'\n'.join(parts)
+        try:
+            parts = str(joined, 'utf8').split('\n')
+        except UnicodeDecodeError:
+            parts = str(joined, *self._encoding_for(line)).split('\n')
+        prefix = parts.pop()
+        return prefix, parts
+
+    def _encoding_for(self, line):
+        """ Works out how to decode a line that isn't utf8, returns `(encoding, errors)`. """
+        logger.debug('UTF8 decode failed, bytes: %s', line)
+        if self.utf8_only:
+            self.counters['replaced'] += 1
+            return 'utf8', 'replace'
+
+        keys = [key for key in _sender_and_target(line) if key]
+        for key in keys:
+            encoding = self._encodings.get(key)
+            if encoding is None:
+                continue
+            try:
+                line.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+            self._encodings.move_to_end(key)
+            self.counters['cached'] += 1
+            return encoding, 'strict'
+
+        if self.charset is not None:
+            try:
+                line.decode(self.charset)
+            except (UnicodeDecodeError, LookupError):
+                pass
+            else:
+                self.counters['charset'] += 1
+                return self.charset, 'strict'
+
+        if self.fallback == 'surrogateescape':
+            self.counters['fallback'] += 1
+            return 'utf8', 'surrogateescape'
+        elif self.fallback is not None:
+            self.counters['fallback'] += 1
+            return self.fallback, 'replace'
+
+        self.counters['chardet'] += 1
+        import chardet
+        encoding = chardet.detect(line)['encoding'] or 'latin-1'
+        logger.debug('Tried autodetecting and got %s, decoding now', encoding)
+        for key in keys:
+            self._remember(key, encoding)
+        return encoding, 'replace'
+
+    def _remember(self, key, encoding):
+        self._encodings[key] = encoding
+        self._encodings.move_to_end(key)
+        while len(self._encodings) > self.cache_size:
+            self._encodings.popitem(last=False)
+
+    def update_from_isupport(self, tokens):
+        """ Picks out the CHARSET and UTF8ONLY tokens from an RPL_ISUPPORT message. """
+        for token in tokens:
+            key, _, value = token.partition('=')
+            if key == 'CHARSET' and value:
+                self.charset = value
+            elif key == 'UTF8ONLY':
+                self.utf8_only = True
+
+
+def split_encoded(text, max_bytes, encoding='utf8'):
+    """ Splits `text` into pieces that are at most `max_bytes` long once encoded, never in the middle of a character.
+
+    Returns a list of strings (with a single empty string for empty text).
+    """
+    if max_bytes < 1:
+        raise ValueError('Can\'t split text into pieces of {} bytes'.format(max_bytes))
+    data = text.encode(encoding)
+    if len(data) <= max_bytes:
+        return [text]
+
+    pieces = []
+    start = 0
+    while start < len(data):
+        end = min(start + max_bytes, len(data))
+        while True:
+            try:
+                piece = data[start:end].decode(encoding)
+            except UnicodeDecodeError:
+                end -= 1  # cut a multi-byte character in half, back off to the start of it
+                if end == start:
+                    raise ValueError('{} bytes is too short for a character'.format(max_bytes))
+            else:
+                break
+        pieces.append(piece)
+        start = end
+    return pieces
+
+
+class _Template:
+    """ An outbound command with its fixed parts encoded up front.
+
+    `text` is a `str.format` string for sending through a write function, `encoded` is the same command as a bytes
+    %-format string (line terminator included) for sending through a bytes one.
+    """
+    __slots__ = ('text', 'encoded')
+
+    def __init__(self, text):
+        self.text = text
+        self.encoded = text.replace('{}', '%b').encode('ascii') + b'\r\n'
+
+
+_pong = _Template('PONG :{}')
+_nick = _Template('NICK {}')
+_user = _Template('USER {} 0 * :{}')
+_who = _Template('WHO {}')
+_whois = _Template('WHOIS {}')
+_names = _Template('NAMES {}')
+_join = _Template('JOIN {}')
+_join_with_key = _Template('JOIN {} {}')
+_part = _Template('PART {}')
+_quit = _Template('QUIT :{}')
+_ping = _Template('PING {}')
+_privmsg = _Template('PRIVMSG {} :{}')
+_notice = _Template('NOTICE {} :{}')
+_cap_ls = _Template('CAP LS 302')
+_cap_req = _Template('CAP REQ :{}')
+_cap_end = _Template('CAP END')
+
+_batch_commands = frozenset(('BATCH', b'BATCH'))
+
+
 def parse_line(line):
-    """ Normalizes the line from the server and splits it into component parts. """
-    line = decode(line)
-    line = line.strip()
-    return split_irc_line(line)
+    """ Normalizes the line from the server and splits it into component parts.
+
+    Returns a `(prefix, command, args)` tuple, use `parse_message` directly if you need the message tags.
+    """
+    message = parse_message(decode(line))
+    return message.prefix, message.command, message.params
 
 
 class IRCServerHandler:
-    def __init__(self, identity):
+    # IRCv3 capabilities we ask for if the server has them
+    default_caps = frozenset(('batch', 'server-time', 'message-tags', 'multi-prefix', 'userhost-in-names',
+                              'away-notify', 'extended-join', 'account-notify', 'cap-notify'))
+
+    def __init__(self, identity, decoder=None, caps=None):
         """ Protocol parser (and response generator) for an IRC server.
 
         Args:
             identity (User object): "Our" nick and user name etc.
+            decoder (LineDecoder): Used to decode lines from the server, one with the default settings is created if
+                not given.
+            caps (set): IRCv3 capabilities to ask for, defaults to `default_caps`.
         """
         self._write = None
         self.identity = identity
+        self.decoder = decoder if decoder is not None else LineDecoder()
+
+        # If set lines are sent as bytes, built from pre-encoded templates, rather than through the write function
+        self.write_bytes = None
+        self.encoding = 'utf8'
+
+        # Maps commands as the server sends them (e.g. '001' or 'PRIVMSG') to `(signal_name, handler, signal)` so that
+        # we only work out which `on_*` method and which signal a command goes to the first time we see it.
+        # Unknown numerics map to None.
+        self._dispatch = {}
+
+        # Capabilities we want, the ones the server offered (name -> value) and the ones it gave us
+        self.wanted_caps = frozenset(caps) if caps is not None else self.default_caps
+        self.available_caps = {}
+        self.caps = set()
+        self._caps_requested = set()
+        self._negotiating_caps = False
+
+        # Open batches, reference -> (type, prefix, params, [(message, line)])
+        self._batches = {}
+        # Tags of the message currently being dispatched (e.g. its server-time), None if it didn't have any
+        self.tags = None
+
+        self._instrumentation = None
+
+        # RPL_ISUPPORT tokens seen so far, turned into `capabilities` when something first wants them
+        self._isupport_tokens = {}
+        self._capabilities = pircel.isupport.default_capabilities
 
         # Default values
         self.motd = ''
 
+    @property
+    def capabilities(self):
+        """ The server's `pircel.isupport.ServerCapabilities`, the RFC 1459 defaults until it's sent RPL_ISUPPORT. """
+        if self._capabilities is None:
+            self._capabilities = pircel.isupport.ServerCapabilities.from_tokens(self._isupport_tokens)
+        return self._capabilities
+
+    @property
+    def max_line_bytes(self):
+        """ Longest line the server will send (including the terminator), LINELEN or 512. """
+        return self.capabilities.linelen
+
+    @property
+    def max_host_length(self):
+        """ Longest host the server could give us, HOSTLEN or 63. """
+        return self.capabilities.hostlen
+
     @property
     def _user_string(self):
         return ':{}!~{}@localhost'.format(self.identity.nick, self.identity.username)
@@ -186,40 +584,172 @@ class IRCServerHandler:
     # =========================================================================
     def handle_line(self, line):
         verbatim_logger.debug(line)
-        # Parse the line
-        prefix, command, args = parse_line(line)
+        # Parse the line, raw lines stay as bytes until we know someone wants them
+        try:
+            if isinstance(line, bytes):
+                message = parse_message_bytes(line)
+            else:
+                message = parse_message(line)
+        except MalformedLineError:
+            self.log_unhandled(line)
+            return
+        self.handle_message(message, line)
+
+    def handle_message(self, message, line):
+        """ Dispatches an already parsed `Message` to the `on_*` handler and signal for its command.
+
+        Args:
+            message (Message): The parsed line, either decoded or straight from `parse_message_bytes`.
+            line: The raw line the message was parsed from, used for logging and decoding.
+        """
+        tags = message.tags
+        command = message.command
+        if tags is not None and self._batches and self._hold_for_batch(message, line):
+            return
+        instrumentation = self._instrumentation
+        if instrumentation is not None:
+            instrumentation.count(command)
 
         try:
-            symbolic_command = get_symbolic_command(command)
-        except UnknownNumericCommandError:
+            entry = self._dispatch[command]
+        except KeyError:
+            entry = self._add_dispatch_entry(command)
+        if entry is None:
+            self.log_unhandled(line)
+            return
+        _, handler, signal = entry
+
+        # Nothing wants it so don't bother decoding it
+        if handler is None and not signal.receivers:
             self.log_unhandled(line)
             return
 
+        _, prefix, _, args = message
+        if isinstance(command, bytes):
+            if instrumentation is None:
+                prefix, args = self.decoder.decode_params(prefix, args, line)
+            else:
+                start = instrumentation.clock()
+                prefix, args = self.decoder.decode_params(prefix, args, line)
+                instrumentation.record('decode', instrumentation.clock() - start)
+        self.tags = tags
+        self._deliver(handler, signal, prefix, args)
+
+    def _deliver(self, handler, signal, prefix, args):
+        """ Calls the `on_*` handler and signal receivers for a message. """
         # local callbacks deal with the protocol stuff
-        try:
-            handler_name = 'on_{}'.format(symbolic_command.lower())
-            handler = getattr(self, handler_name)
-        except AttributeError:
-            handled = False
-        else:
+        if handler is not None:
             handler(prefix, *args)
-            handled = True
 
-        # user callbacks do whatever they want them to do
-        signal = signal_factory(symbolic_command.lower())
-        signal.send(self, prefix=prefix, args=args)
+        # user callbacks do whatever they want them to do, blinker's send isn't free so skip it if nobody's listening
         if signal.receivers:
-            handled = True
+            signal.send(self, prefix=prefix, args=args)
 
-        if not handled:
+    def _deliver_instrumented(self, handler, signal, prefix, args):
+        """ `_deliver` with the handler and receivers timed. """
+        if handler is not None:
+            self._instrumentation.call(handler, prefix, *args)
+        if signal.receivers:
+            self._instrumentation.send(signal, self, prefix=prefix, args=args)
+
+    def _hold_for_batch(self, message, line):
+        """ Holds back a message that's part of an open batch until the batch ends, returns True if it was. """
+        if message.command in _batch_commands:
+            # Nested batches are opened (and delivered when they end) as usual
+            return False
+        batch = self._batches.get(message.tags.get('batch'))
+        if batch is None:
+            return False
+        batch[3].append((message, line))
+        return True
+
+    @property
+    def instrumentation(self):
+        """ A `pircel.instrumentation.Instrumentation` to count and time lines with, None (the default) to not.
+
+        Setting one swaps in instrumented versions of `handle_line` and `_deliver` (and setting None swaps them back)
+        so there's next to no cost when there isn't one. Adapters hold on to `handle_line`, so set it before connecting.
+        """
+        return self._instrumentation
+
+    @instrumentation.setter
+    def instrumentation(self, instrumentation):
+        self._instrumentation = instrumentation
+        if instrumentation is None:
+            self.__dict__.pop('handle_line', None)
+            self.__dict__.pop('_deliver', None)
+        else:
+            self.handle_line = self._handle_line_instrumented
+            self._deliver = self._deliver_instrumented
+
+    def _handle_line_instrumented(self, line):
+        """ `handle_line` with the parsing timed. """
+        verbatim_logger.debug(line)
+        clock = self._instrumentation.clock
+        start = clock()
+        try:
+            if isinstance(line, bytes):
+                message = parse_message_bytes(line)
+            else:
+                message = parse_message(line)
+        except MalformedLineError:
             self.log_unhandled(line)
+            return
+        self._instrumentation.record('parse', clock() - start)
+        self.handle_message(message, line)
+
+    def handle_lines(self, lines):
+        """ Handles a batch of lines from the server (in order), e.g. everything that arrived in one read. """
+        handle_line = self.handle_line
+        for line in lines:
+            handle_line(line)
+
+    def _add_dispatch_entry(self, command):
+        """ Works out (and remembers) where lines with the given command (str or bytes) should be sent. """
+        try:
+            if isinstance(command, bytes):
+                signal_name = get_symbolic_command(command.decode('ascii', 'replace')).lower()
+            else:
+                signal_name = get_symbolic_command(command).lower()
+        except UnknownNumericCommandError:
+            entry = None
+        else:
+            entry = (signal_name, getattr(self, 'on_{}'.format(signal_name), None), signal_factory(signal_name))
+        self._dispatch[command] = entry
+        return entry
+
+    def _invalidate_dispatch_entries(self, signal_name):
+        """ Forgets the dispatch entries for a signal so they're rebuilt on next use. """
+        for command, entry in list(self._dispatch.items()):
+            if entry is not None and entry[0] == signal_name:
+                del self._dispatch[command]
 
     def log_unhandled(self, line):
         """ Called when we encounter a command we either don't know or don't have a handler for.
 
         Method rather than function because I might later make it send debug logging over IRC sometimes.
         """
-        logger.warning('Unhandled: %s', line.decode().rstrip())
+        if isinstance(line, bytes):
+            line = line.decode('utf8', 'replace')
+        logger.warning('Unhandled: %s', line.rstrip())
+
+    def disconnected(self):
+        """ Forgets everything about the connection that's just been lost so the next one starts from scratch.
+
+        Sends the `disconnected` signal (with no other arguments) so that anything else tracking the connection (e.g.
+        `pircel.state.StateTracker`) can do the same, it'll all be rebuilt from what the server sends once we've
+        reconnected and rejoined.
+        """
+        self.available_caps = {}
+        self.caps = set()
+        self._caps_requested = set()
+        self._negotiating_caps = False
+        self._batches = {}
+        self.tags = None
+        self.motd = ''
+        self._isupport_tokens = {}
+        self._capabilities = pircel.isupport.default_capabilities
+        signal_factory('disconnected').send(self)
     # =========================================================================
 
     # =========================================================================
@@ -240,48 +770,158 @@ class IRCServerHandler:
     def write_function(self, new_write_function):
         self._write = new_write_function
 
+    def _send(self, template, *params):
+        """ Sends a command built from one of the module's `_Template`s. """
+        write_bytes = self.write_bytes
+        if write_bytes is None:
+            self._write(template.text.format(*params))
+            return
+        encoding = self.encoding
+        write_bytes(template.encoded % tuple([
+            param.encode(encoding) if type(param) is str else param if type(param) is bytes else
+            str(param).encode(encoding) for param in params
+        ]))
+
     def pong(self, value):
-        self._write('PONG :{}'.format(value))
+        self._send(_pong, value)
 
     def connect(self):
-        self._write('NICK {}'.format(self.identity.nick))
-        self._write('USER {} 0 * :{}'.format(self.identity.username, self.identity.realname))
+        # The server holds off registering us until we've finished negotiating capabilities
+        self._negotiating_caps = True
+        self._send(_cap_ls)
+        self._send(_nick, self.identity.nick)
+        self._send(_user, self.identity.username, self.identity.realname)
 
     def who(self, mask):
-        self._write('WHO {}'.format(mask))
+        self._send(_who, mask)
+
+    def whois(self, nicks):
+        """ Sends a WHOIS for one nick or several separated with commas (if the server allows it). """
+        self._send(_whois, nicks)
+
+    def names(self, channels):
+        self._send(_names, channels)
 
     def join(self, channel, password=None):
         logger.debug('Joining %s', channel)
         if password:
-            self._write('JOIN {} {}'.format(channel, password))
+            self._send(_join_with_key, channel, password)
         else:
-            self._write('JOIN {}'.format(channel))
+            self._send(_join, channel)
+
+    def join_channels(self, channels):
+        """ Joins lots of channels, packing as many into each JOIN line as will fit (and the server's TARGMAX allows).
+
+        Args:
+            channels: Channel names, or a dict of channel names to keys (None for channels without one).
+        """
+        if not isinstance(channels, dict):
+            channels = dict.fromkeys(channels)
+        # Keys go with the channels in order so channels with keys have to come first
+        ordered = sorted(channels.items(), key=lambda item: not item[1])
+        budget = self.max_line_bytes - len('JOIN  \r\n')
+        max_targets = self.capabilities.max_targets('JOIN', default=None) or len(ordered)
+        names, keys, size = [], [], 0
+        for name, key in ordered:
+            cost = len(name.encode(self.encoding)) + 1
+            if key:
+                cost += len(key.encode(self.encoding)) + 1
+            if names and (size + cost > budget or len(names) >= max_targets):
+                self._send_join(names, keys)
+                names, keys, size = [], [], 0
+            names.append(name)
+            if key:
+                keys.append(key)
+            size += cost
+        if names:
+            self._send_join(names, keys)
+
+    def _send_join(self, names, keys):
+        logger.debug('Joining %s', ', '.join(names))
+        if keys:
+            self._send(_join_with_key, ','.join(names), ','.join(keys))
+        else:
+            self._send(_join, ','.join(names))
 
     def part(self, channel):
-        self._write('PART {}'.format(channel))
+        self._send(_part, channel)
 
     def quit(self, message):
-        self._write('QUIT :{}'.format(message))
+        self._send(_quit, message)
+
+    def _max_text_bytes(self, command, channel):
+        """ How many bytes of text fit in a `command` to `channel` once the server has added our full prefix. """
+        host = 'h' * self.max_host_length
+        overhead = ':{}!~{}@{} {} {} :\r\n'.format(self.identity.nick, self.identity.username, host, command, channel)
+        return self.max_line_bytes - len(overhead.encode(self.encoding))
 
     def _split_line_channel_command(self, command, channel, message):
-        if not isinstance(message, (str, bytes)):
+        if isinstance(message, bytes):
+            message = self.decoder.decode(message)
+        elif not isinstance(message, str):
             message = str(message)
+        template = _privmsg if command == 'PRIVMSG' else _notice
+        if isinstance(channel, (list, tuple, set, frozenset)):
+            self._send_to_targets(command, template, channel, message)
+            return
+        max_bytes = self._max_text_bytes(command, channel)
+
+        lines = []
         for line in message.split('\n'):
-            command = '{} {} :{}'.format(command, channel, line)
-            self._write(command)
-            self.handle_line('{} {}'.format(self._user_string, command))
+            lines.extend(split_encoded(line, max_bytes, self.encoding))
+        for line in lines:
+            self._send(template, channel, line)
+        self._echo(command, self._user_string[1:], [[channel, line] for line in lines])
+
+    def _send_to_targets(self, command, template, targets, message):
+        """ Sends a message to several targets, as many per line as the server's TARGMAX (or MAXTARGETS) allows. """
+        targets = list(targets)
+        if not targets:
+            return
+        limit = self.capabilities.max_targets(command) or len(targets)
+        for start in range(0, len(targets), limit):
+            group = targets[start:start + limit]
+            joined = ','.join(group)
+            # Each target gets its own copy with our prefix added, and the line we send has all of them in it
+            max_bytes = min(self._max_text_bytes(command, max(group, key=len)),
+                            self.max_line_bytes - len('{} {} :\r\n'.format(command, joined).encode(self.encoding)))
+            lines = []
+            for line in message.split('\n'):
+                lines.extend(split_encoded(line, max_bytes, self.encoding))
+            for line in lines:
+                self._send(template, joined, line)
+            self._echo(command, self._user_string[1:], [[target, line] for line in lines for target in group])
+
+    def _echo(self, command, prefix, params_list):
+        """ Dispatches messages we've sent as if the server had sent them back to us.
+
+        They go straight to the handler and signal for `command` (looked up once for the lot) without being formatted
+        and parsed again.
+        """
+        try:
+            entry = self._dispatch[command]
+        except KeyError:
+            entry = self._add_dispatch_entry(command)
+        _, handler, signal = entry
+        self.tags = None
+        deliver = self._deliver
+        for args in params_list:
+            deliver(handler, signal, prefix, args)
 
     def send_message(self, channel, message):
+        """ Sends a PRIVMSG, split over as many lines as it takes. `channel` can also be a list (or tuple or set) of
+        targets.
+        """
         self._split_line_channel_command('PRIVMSG', channel, message)
 
     def send_notice(self, channel, message):
         self._split_line_channel_command('NOTICE', channel, message)
 
     def send_ping(self, value):
-        self._write('PING {}'.format(value))
+        self._send(_ping, value)
 
     def change_nick(self, new_nick):
-        self._write('NICK {}'.format(new_nick))
+        self._send(_nick, new_nick)
         self.identity.nick = new_nick
     # =========================================================================
 
@@ -304,11 +944,19 @@ class IRCServerHandler:
             * The remaining arguments from the command
 
         For example the `join` signal will be called with `(self, who, channel)`.
+
+        When a BATCH ends the messages in it are dispatched, but first the `batch_<type>` signal (e.g.
+        `batch_netsplit`) is sent once for the whole batch with the prefix and params of the BATCH line (after the type)
+        and an extra `messages` keyword argument, the list of `Message`s in the batch.
         """
+        signal = pircel.commands.registry.canonical(signal)
         signal_factory(signal).connect(callback, sender=self, weak=weak)
+        self._invalidate_dispatch_entries(signal)
 
     def remove_callback(self, signal, callback):
+        signal = pircel.commands.registry.canonical(signal)
         signal_factory(signal).disconnect(callback, sender=self)
+        self._invalidate_dispatch_entries(signal)
     # =========================================================================
 
     # =========================================================================
@@ -321,151 +969,83 @@ class IRCServerHandler:
     def on_ping(self, prefix, token, *args):
         logger.debug('Ping received: %s, %s', prefix, token)
         self.pong(token)
+
+    def on_rpl_isupport(self, prefix, target, *tokens):
+        tokens = tokens[:-1]  # the last one is the "are supported by this server" text
+        self.decoder.update_from_isupport(tokens)
+        pircel.isupport.update_tokens(self._isupport_tokens, tokens)
+        self._capabilities = None
+
+    def on_rpl_welcome(self, prefix, *args):
+        # If the server didn't know about CAP we won't get any replies
+        self._negotiating_caps = False
+
+    def on_cap(self, prefix, target, subcommand, *args):
+        if not args:
+            return
+        subcommand = subcommand.upper()
+        caps = args[-1].split()
+
+        if subcommand in ('LS', 'NEW'):
+            for cap in caps:
+                name, _, value = cap.partition('=')
+                self.available_caps[name] = value
+            if subcommand == 'LS' and len(args) > 1 and args[0] == '*':
+                return  # there's another line of them coming
+            self._request_caps()
+        elif subcommand == 'ACK':
+            for cap in caps:
+                if cap.startswith('-'):
+                    self.caps.discard(cap[1:])
+                else:
+                    self.caps.add(cap)
+                self._caps_requested.discard(cap.lstrip('-'))
+            self._end_caps()
+        elif subcommand == 'NAK':
+            self._caps_requested.difference_update(caps)
+            self._end_caps()
+        elif subcommand == 'DEL':
+            for cap in caps:
+                self.caps.discard(cap)
+                self.available_caps.pop(cap, None)
+
+    def _request_caps(self):
+        wanted = sorted(self.wanted_caps.intersection(self.available_caps) - self.caps - self._caps_requested)
+        if wanted:
+            self._caps_requested.update(wanted)
+            self._send(_cap_req, ' '.join(wanted))
+        else:
+            self._end_caps()
+
+    def _end_caps(self):
+        if self._negotiating_caps and not self._caps_requested:
+            self._negotiating_caps = False
+            self._send(_cap_end)
+
+    def on_batch(self, prefix, reference, *args):
+        if reference.startswith('+'):
+            if args:
+                self._batches[reference[1:]] = (args[0], prefix, list(args[1:]), [])
+        elif reference.startswith('-'):
+            self._end_batch(reference[1:])
+
+    def _end_batch(self, reference):
+        batch = self._batches.pop(reference, None)
+        if batch is None:
+            return
+        batch_type, prefix, params, messages = batch
+
+        signal = signal_factory('batch_{}'.format(batch_type.lower()))
+        if signal.receivers:
+            decoded = [self.decoder.decode_message(message, line) if isinstance(message.command, bytes) else message
+                       for message, line in messages]
+            self.tags = None
+            signal.send(self, prefix=prefix, args=params, messages=decoded)
+
+        for message, line in messages:
+            self.handle_message(message, line)
     # =========================================================================
 
-symbolic_to_numeric = {
-    "RPL_WELCOME": '001',
-    "RPL_YOURHOST": '002',
-    "RPL_CREATED": '003',
-    "RPL_MYINFO": '004',
-    "RPL_ISUPPORT": '005',
-    "RPL_BOUNCE": '010',
-    "RPL_STATSCONN": '250',
-    "RPL_LOCALUSERS": '265',
-    "RPL_GLOBALUSERS": '266',
-    "RPL_USERHOST": '302',
-    "RPL_ISON": '303',
-    "RPL_AWAY": '301',
-    "RPL_UNAWAY": '305',
-    "RPL_NOWAWAY": '306',
-    "RPL_WHOISUSER": '311',
-    "RPL_WHOISSERVER": '312',
-    "RPL_WHOISOPERATOR": '313',
-    "RPL_WHOISIDLE": '317',
-    "RPL_ENDOFWHOIS": '318',
-    "RPL_WHOISCHANNELS": '319',
-    "RPL_WHOWASUSER": '314',
-    "RPL_ENDOFWHOWAS": '369',
-    "RPL_LISTSTART": '321',
-    "RPL_LIST": '322',
-    "RPL_LISTEND": '323',
-    "RPL_UNIQOPIS": '325',
-    "RPL_CHANNELMODEIS": '324',
-    "RPL_NOTOPIC": '331',
-    "RPL_TOPIC": '332',
-    "RPL_TOPICWHOTIME": '333',
-    "RPL_INVITING": '341',
-    "RPL_SUMMONING": '342',
-    "RPL_INVITELIST": '346',
-    "RPL_ENDOFINVITELIST": '347',
-    "RPL_EXCEPTLIST": '348',
-    "RPL_ENDOFEXCEPTLIST": '349',
-    "RPL_VERSION": '351',
-    "RPL_WHOREPLY": '352',
-    "RPL_ENDOFWHO": '315',
-    "RPL_NAMREPLY": '353',
-    "RPL_ENDOFNAMES": '366',
-    "RPL_LINKS": '364',
-    "RPL_ENDOFLINKS": '365',
-    "RPL_BANLIST": '367',
-    "RPL_ENDOFBANLIST": '368',
-    "RPL_INFO": '371',
-    "RPL_ENDOFINFO": '374',
-    "RPL_MOTDSTART": '375',
-    "RPL_MOTD": '372',
-    "RPL_ENDOFMOTD": '376',
-    "RPL_YOUREOPER": '381',
-    "RPL_REHASHING": '382',
-    "RPL_YOURESERVICE": '383',
-    "RPL_TIME": '391',
-    "RPL_USERSSTART": '392',
-    "RPL_USERS": '393',
-    "RPL_ENDOFUSERS": '394',
-    "RPL_NOUSERS": '395',
-    "RPL_TRACELINK": '200',
-    "RPL_TRACECONNECTING": '201',
-    "RPL_TRACEHANDSHAKE": '202',
-    "RPL_TRACEUNKNOWN": '203',
-    "RPL_TRACEOPERATOR": '204',
-    "RPL_TRACEUSER": '205',
-    "RPL_TRACESERVER": '206',
-    "RPL_TRACESERVICE": '207',
-    "RPL_TRACENEWTYPE": '208',
-    "RPL_TRACECLASS": '209',
-    "RPL_TRACERECONNECT": '210',
-    "RPL_TRACELOG": '261',
-    "RPL_TRACEEND": '262',
-    "RPL_STATSLINKINFO": '211',
-    "RPL_STATSCOMMANDS": '212',
-    "RPL_ENDOFSTATS": '219',
-    "RPL_STATSUPTIME": '242',
-    "RPL_STATSOLINE": '243',
-    "RPL_UMODEIS": '221',
-    "RPL_SERVLIST": '234',
-    "RPL_SERVLISTEND": '235',
-    "RPL_LUSERCLIENT": '251',
-    "RPL_LUSEROP": '252',
-    "RPL_LUSERUNKNOWN": '253',
-    "RPL_LUSERCHANNELS": '254',
-    "RPL_LUSERME": '255',
-    "RPL_ADMINME": '256',
-    "RPL_ADMINLOC": '257',
-    "RPL_ADMINLOC": '258',
-    "RPL_ADMINEMAIL": '259',
-    "RPL_TRYAGAIN": '263',
-    "ERR_NOSUCHNICK": '401',
-    "ERR_NOSUCHSERVER": '402',
-    "ERR_NOSUCHCHANNEL": '403',
-    "ERR_CANNOTSENDTOCHAN": '404',
-    "ERR_TOOMANYCHANNELS": '405',
-    "ERR_WASNOSUCHNICK": '406',
-    "ERR_TOOMANYTARGETS": '407',
-    "ERR_NOSUCHSERVICE": '408',
-    "ERR_NOORIGIN": '409',
-    "ERR_NORECIPIENT": '411',
-    "ERR_NOTEXTTOSEND": '412',
-    "ERR_NOTOPLEVEL": '413',
-    "ERR_WILDTOPLEVEL": '414',
-    "ERR_BADMASK": '415',
-    "ERR_UNKNOWNCOMMAND": '421',
-    "ERR_NOMOTD": '422',
-    "ERR_NOADMININFO": '423',
-    "ERR_FILEERROR": '424',
-    "ERR_NONICKNAMEGIVEN": '431',
-    "ERR_ERRONEUSNICKNAME": '432',
-    "ERR_NICKNAMEINUSE": '433',
-    "ERR_NICKCOLLISION": '436',
-    "ERR_UNAVAILRESOURCE": '437',
-    "ERR_USERNOTINCHANNEL": '441',
-    "ERR_NOTONCHANNEL": '442',
-    "ERR_USERONCHANNEL": '443',
-    "ERR_NOLOGIN": '444',
-    "ERR_SUMMONDISABLED": '445',
-    "ERR_USERSDISABLED": '446',
-    "ERR_NOTREGISTERED": '451',
-    "ERR_NEEDMOREPARAMS": '461',
-    "ERR_ALREADYREGISTRED": '462',
-    "ERR_NOPERMFORHOST": '463',
-    "ERR_PASSWDMISMATCH": '464',
-    "ERR_YOUREBANNEDCREEP": '465',
-    "ERR_YOUWILLBEBANNED": '466',
-    "ERR_KEYSET": '467',
-    "ERR_CHANNELISFULL": '471',
-    "ERR_UNKNOWNMODE": '472',
-    "ERR_INVITEONLYCHAN": '473',
-    "ERR_BANNEDFROMCHAN": '474',
-    "ERR_BADCHANNELKEY": '475',
-    "ERR_BADCHANMASK": '476',
-    "ERR_NOCHANMODES": '477',
-    "ERR_BANLISTFULL": '478',
-    "ERR_NOPRIVILEGES": '481',
-    "ERR_CHANOPRIVSNEEDED": '482',
-    "ERR_CANTKILLSERVER": '483',
-    "ERR_RESTRICTED": '484',
-    "ERR_UNIQOPPRIVSNEEDED": '485',
-    "ERR_NOOPERHOST": '491',
-    "ERR_NOSERVICEHOST": '492',
-    "ERR_UMODEUNKNOWNFLAG": '501',
-    "ERR_USERSDONTMATCH": '502',
-}
-numeric_to_symbolic = {v: k for k, v in symbolic_to_numeric.items()}
+# Kept for compatibility, these are the registry's own dicts so they include anything registered later
+symbolic_to_numeric = pircel.commands.registry.symbolic_to_numeric
+numeric_to_symbolic = pircel.commands.registry.numeric_to_symbolic
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.queries
+--------------
+
+WHO, WHOIS and NAMES as requests with replies, rather than commands whose numerics turn up later among everything else.
+
+A `QueryManager` returns a future for each query, resolved with the collected replies when the server says it's done
+(RPL_ENDOFWHO, RPL_ENDOFWHOIS or RPL_ENDOFNAMES), and keeps the number of queries actually sent down:
+
+    - results are cached for `ttl` seconds, and dropped early when a JOIN, PART, KICK, NICK or QUIT means they're out
+      of date (everything cached mentioning the nick, or about the channel, goes)
+    - asking for something that's already been asked for (but not answered yet) returns the same future
+    - queries made in the same pass of the event loop are sent together, WHOIS and NAMES with as many targets per line
+      as `max_targets` allows (the server's TARGMAX, 1 if it doesn't say)
+
+The futures come from `future_factory`, `concurrent.futures.Future` by default (wrap them with `asyncio.wrap_future`
+to await them) or e.g. `loop.create_future` to get asyncio futures directly. They're shared between everyone asking
+the same question, so don't cancel them.
+
+Like `pircel.lifecycle` this isn't tied to an event loop, it's given a `call_later(delay, callback)` function.
+"""
+import collections
+import concurrent.futures
+import functools
+import logging
+import re
+import time
+
+import pircel
+from pircel import protocol
+
+logger = logging.getLogger(__name__)
+
+
+class QueryError(pircel.Error):
+    """ Exception set on queries that can't be answered, e.g. because we disconnected before the reply came. """
+
+
+class QueryTimeoutError(QueryError):
+    """ Exception set on queries the server didn't finish answering in time. """
+
+
+WhoReply = collections.namedtuple('WhoReply', ['channel', 'username', 'host', 'server', 'nick', 'flags', 'hops',
+                                               'realname'])
+WhoReply.__doc__ = """ One RPL_WHOREPLY, `channel` is '*' if the user wasn't matched through a channel. """
+
+Whois = collections.namedtuple('Whois', ['nick', 'username', 'host', 'realname', 'server', 'channels', 'account',
+                                         'idle', 'away', 'operator', 'secure'])
+Whois.__doc__ = """ Everything the server told us about a nick in reply to a WHOIS, fields it didn't send are None. """
+
+kinds = ('who', 'whois', 'names')
+
+
+@functools.lru_cache(maxsize=256)
+def _wildcard_pattern(mask):
+    """ Compiles a WHO mask with * and ? wildcards into a regular expression. """
+    return re.compile('.*'.join('.'.join(map(re.escape, part.split('?'))) for part in mask.split('*')) + r'\Z',
+                      re.DOTALL)
+
+# Replies to WHOIS that are collected, and which field of `Whois` they fill in from the args after the nick
+_whois_fields = {
+    'rpl_whoisuser': lambda args: {'username': args[2], 'host': args[3], 'realname': args[-1]},
+    'rpl_whoisserver': lambda args: {'server': args[2]},
+    'rpl_whoisoperator': lambda args: {'operator': True},
+    'rpl_whoisidle': lambda args: {'idle': int(args[2]) if args[2].isdecimal() else None},
+    'rpl_whoischannels': lambda args: {'channels': args[-1].split()},
+    'rpl_whoisaccount': lambda args: {'account': args[2]},
+    'rpl_away': lambda args: {'away': args[-1]},
+    'rpl_whoissecure': lambda args: {'secure': True},
+}
+
+
+class QueryManager:
+    def __init__(self, server_handler, call_later, ttl=60, timeout=30, future_factory=concurrent.futures.Future,
+                 clock=time.monotonic):
+        """ Nicks and channel names are compared, and queries batched, the way the server says to (its RPL_ISUPPORT).
+
+        Args:
+            server_handler (IRCServerHandler): The connection to send queries on.
+            call_later (callable): `call_later(delay, callback)`.
+            ttl (float): Seconds results are cached for, 0 to not cache them.
+            timeout (float): Seconds to wait for a reply before failing the query with `QueryTimeoutError`.
+            future_factory (callable): Makes the futures returned by the queries.
+            clock (callable): Monotonic time in seconds.
+        """
+        self.server_handler = server_handler
+        self.call_later = call_later
+        self.ttl = ttl
+        self.timeout = timeout
+        self.future_factory = future_factory
+        self.clock = clock
+        # Kept up to date from the server's capabilities, see `_handle_rpl_isupport`
+        self.max_targets = {kind: 1 for kind in kinds}
+        self.fold_table = server_handler.capabilities.fold_table
+        self._apply_capabilities(server_handler.capabilities)
+
+        # (kind, folded target) -> (expiry, result)
+        self._cache = {}
+        # Folded nick -> the cache keys of results that mention it
+        self._mentions = collections.defaultdict(set)
+        # kind -> {folded target: target}, queries waiting to be sent
+        self._unsent = {kind: {} for kind in kinds}
+        self._flush_scheduled = False
+        # (kind, folded target) -> future, both unsent and sent queries
+        self._futures = {}
+        # (kind, folded target) -> what's been collected so far, for sent queries
+        self._collected = {}
+        # WHO replies don't say which mask they're for, they're for the oldest WHO that hasn't ended and matches them
+        self._who_order = collections.deque()
+        self._sent_at = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.lines_sent = 0
+
+        self._callbacks = [
+            ('rpl_whoreply', self._handle_rpl_whoreply),
+            ('rpl_endofwho', self._handle_rpl_endofwho),
+            ('rpl_namreply', self._handle_rpl_namreply),
+            ('rpl_endofnames', self._handle_rpl_endofnames),
+            ('rpl_endofwhois', self._handle_rpl_endofwhois),
+            ('err_nosuchnick', self._handle_err_nosuchnick),
+            ('join', self._handle_join),
+            ('part', self._handle_part),
+            ('kick', self._handle_kick),
+            ('nick', self._handle_nick),
+            ('quit', self._handle_quit),
+            ('rpl_isupport', self._handle_rpl_isupport),
+            ('disconnected', self._handle_disconnected),
+        ]
+        for signal, callback in self._callbacks:
+            server_handler.add_callback(signal, callback)
+        for signal, parse in _whois_fields.items():
+            callback = functools.partial(self._handle_whois_reply, parse)
+            server_handler.add_callback(signal, callback, weak=False)
+            self._callbacks.append((signal, callback))
+
+    def close(self):
+        """ Stops listening to the server handler and fails any queries still waiting. """
+        for signal, callback in self._callbacks:
+            self.server_handler.remove_callback(signal, callback)
+        self._fail_all(QueryError('Query manager closed'))
+
+    # =========================================================================
+    # Queries
+    # =========================================================================
+    def who(self, mask):
+        """ Returns a future resolved with the list of `WhoReply`s for `mask` (a channel, nick or wildcard mask). """
+        return self._query('who', mask)
+
+    def whois(self, nick):
+        """ Returns a future resolved with the `Whois` for `nick`, None if there's no such nick. """
+        return self._query('whois', nick)
+
+    def names(self, channel):
+        """ Returns a future resolved with the list of names (with their prefix symbols, e.g. '@op') in `channel`. """
+        return self._query('names', channel)
+
+    def _query(self, kind, target):
+        key = (kind, target.translate(self.fold_table))
+        cached = self._cache.get(key)
+        if cached is not None:
+            if cached[0] > self.clock():
+                self.hits += 1
+                future = self.future_factory()
+                future.set_result(cached[1])
+                return future
+            self._uncache(key)
+
+        future = self._futures.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return future
+
+        self.misses += 1
+        future = self._futures[key] = self.future_factory()
+        self._unsent[kind][key[1]] = target
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.call_later(0, self._flush)
+        return future
+
+    def _flush(self):
+        self._flush_scheduled = False
+        send = {'who': self.server_handler.who, 'whois': self.server_handler.whois,
+                'names': self.server_handler.names}
+        budget = self.server_handler.max_line_bytes - len('WHOIS \r\n')
+        now = self.clock()
+        for kind in kinds:
+            unsent = self._unsent[kind]
+            if not unsent:
+                continue
+            limit = self.max_targets[kind]
+            batch, size = [], 0
+            for folded, target in unsent.items():
+                key = (kind, folded)
+                self._collected[key] = {} if kind == 'whois' else []
+                self._sent_at[key] = now
+                if kind == 'who':
+                    self._who_order.append(folded)
+
+                cost = len(target.encode(self.server_handler.encoding)) + 1
+                if batch and ((limit is not None and len(batch) >= limit) or size + cost > budget):
+                    send[kind](','.join(batch))
+                    self.lines_sent += 1
+                    batch, size = [], 0
+                batch.append(target)
+                size += cost
+            send[kind](','.join(batch))
+            self.lines_sent += 1
+            unsent.clear()
+        self.call_later(self.timeout, lambda: self._expire(now))
+        self.prune()
+
+    def _expire(self, sent_at):
+        """ Fails the queries sent at `sent_at` that still haven't been answered. """
+        for key in [key for key, time_sent in self._sent_at.items() if time_sent == sent_at]:
+            if key[0] == 'who' and key[1] in self._who_order:
+                self._who_order.remove(key[1])
+            kind, target = key
+            self._fail(key, QueryTimeoutError('No reply to {} {} after {}s'.format(kind.upper(), target, self.timeout)))
+
+    def _resolve(self, key, result):
+        self._collected.pop(key, None)
+        self._sent_at.pop(key, None)
+        future = self._futures.pop(key, None)
+        if self.ttl:
+            self._uncache(key)
+            self._cache[key] = (self.clock() + self.ttl, result)
+            for nick in self._nicks_in(key[0], result):
+                self._mentions[nick.translate(self.fold_table)].add(key)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _fail(self, key, exception):
+        self._collected.pop(key, None)
+        self._sent_at.pop(key, None)
+        self._unsent[key[0]].pop(key[1], None)
+        future = self._futures.pop(key, None)
+        if future is not None and not future.done():
+            future.set_exception(exception)
+
+    def _fail_all(self, exception):
+        for key in list(self._futures):
+            self._fail(key, exception)
+        self._who_order.clear()
+
+    def _nicks_in(self, kind, result):
+        if kind == 'who':
+            return [reply.nick for reply in result]
+        elif kind == 'names':
+            return [protocol.parse_identity(name.lstrip(self.prefix_symbols)).nick for name in result]
+        return [result.nick] if result is not None else []
+    # =========================================================================
+
+    # =========================================================================
+    # Cache
+    # =========================================================================
+    def _uncache(self, key):
+        cached = self._cache.pop(key, None)
+        if cached is None:
+            return
+        for nick in self._nicks_in(key[0], cached[1]):
+            folded = nick.translate(self.fold_table)
+            keys = self._mentions.get(folded)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._mentions[folded]
+
+    def prune(self):
+        """ Drops expired results, which are otherwise only dropped when they're asked for again. """
+        now = self.clock()
+        for key in [key for key, (expiry, _) in self._cache.items() if expiry <= now]:
+            self._uncache(key)
+
+    def invalidate_nick(self, nick):
+        """ Forgets everything cached that mentions `nick`. """
+        folded = nick.translate(self.fold_table)
+        for key in list(self._mentions.get(folded, ())):
+            self._uncache(key)
+        self._uncache(('whois', folded))
+
+    def invalidate_channel(self, channel):
+        folded = channel.translate(self.fold_table)
+        self._uncache(('who', folded))
+        self._uncache(('names', folded))
+
+    def clear(self):
+        self._cache.clear()
+        self._mentions.clear()
+    # =========================================================================
+
+    # =========================================================================
+    # Replies
+    # =========================================================================
+    def _handle_rpl_whoreply(self, server_handler, prefix, args):
+        # args: me, channel, username, host, server, nick, flags, "hopcount realname"
+        if not self._who_order or len(args) < 8:
+            return
+        hops, _, realname = args[7].partition(' ')
+        reply = WhoReply(args[1], args[2], args[3], args[4], args[5], args[6], int(hops) if hops.isdecimal() else None,
+                         realname)
+        for mask in self._who_order:
+            if self._who_matches(mask, reply):
+                self._collected[('who', mask)].append(reply)
+                return
+        # Otherwise it's for a WHO someone else sent
+
+    def _who_matches(self, mask, reply):
+        """ Whether a `WhoReply` could be in reply to WHO `mask` (case folded). """
+        fold_table = self.fold_table
+        if '*' not in mask and '?' not in mask:
+            if self.server_handler.capabilities.is_channel(mask):
+                return reply.channel.translate(fold_table) == mask
+            return reply.nick.translate(fold_table) == mask
+        # Servers match wildcard masks against any of these
+        match = _wildcard_pattern(mask).match
+        return any(match(field.translate(fold_table)) for field in (
+            reply.nick, reply.host, reply.server, reply.realname, reply.username, reply.channel,
+            '{}!{}@{}'.format(reply.nick, reply.username, reply.host)))
+
+    def _handle_rpl_endofwho(self, server_handler, prefix, args):
+        # args: me, mask, text
+        folded = args[1].translate(self.fold_table)
+        if folded not in self._who_order:
+            return
+        # Anything before it in the queue must have been dropped by the server
+        while self._who_order:
+            head = self._who_order.popleft()
+            if head == folded:
+                break
+            self._fail(('who', head), QueryError('Server skipped WHO {}'.format(head)))
+        self._resolve(('who', folded), self._collected.get(('who', folded), []))
+
+    def _handle_rpl_namreply(self, server_handler, prefix, args):
+        # args: me, channel type (=, * or @), channel, names
+        names = self._collected.get(('names', args[2].translate(self.fold_table)))
+        if names is not None:
+            names.extend(args[3].split())
+
+    def _handle_rpl_endofnames(self, server_handler, prefix, args):
+        # args: me, channel (or comma separated channels for some servers), text
+        for channel in args[1].split(','):
+            key = ('names', channel.translate(self.fold_table))
+            if key in self._collected:
+                self._resolve(key, self._collected[key])
+
+    def _handle_whois_reply(self, parse, server_handler, prefix, args):
+        # args: me, nick, ...
+        fields = self._collected.get(('whois', args[1].translate(self.fold_table)))
+        if fields is not None and len(args) > 2:
+            fields['nick'] = args[1]
+            fields.update(parse(args))
+
+    def _handle_err_nosuchnick(self, server_handler, prefix, args):
+        fields = self._collected.get(('whois', args[1].translate(self.fold_table)))
+        if fields is not None:
+            fields.clear()
+
+    def _handle_rpl_endofwhois(self, server_handler, prefix, args):
+        for nick in args[1].split(','):
+            key = ('whois', nick.translate(self.fold_table))
+            fields = self._collected.get(key)
+            if fields is None:
+                continue
+            self._resolve(key, Whois(**dict(dict.fromkeys(Whois._fields), **fields)) if fields else None)
+    # =========================================================================
+
+    # =========================================================================
+    # Invalidation
+    # =========================================================================
+    def _handle_join(self, server_handler, prefix, args):
+        self.invalidate_nick(protocol.parse_identity(prefix).nick)
+        self.invalidate_channel(args[0])
+
+    def _handle_part(self, server_handler, prefix, args):
+        self.invalidate_nick(protocol.parse_identity(prefix).nick)
+        self.invalidate_channel(args[0])
+
+    def _handle_kick(self, server_handler, prefix, args):
+        # args: channel, nick, reason
+        self.invalidate_nick(args[1])
+        self.invalidate_channel(args[0])
+
+    def _handle_nick(self, server_handler, prefix, args):
+        self.invalidate_nick(protocol.parse_identity(prefix).nick)
+        self.invalidate_nick(args[0])
+
+    def _handle_quit(self, server_handler, prefix, args):
+        self.invalidate_nick(protocol.parse_identity(prefix).nick)
+
+    def _handle_rpl_isupport(self, server_handler, prefix, args):
+        self._apply_capabilities(server_handler.capabilities)
+
+    def _apply_capabilities(self, capabilities):
+        # WHO stays at 1, replies to several masks at once can't be told apart
+        self.max_targets['whois'] = capabilities.max_targets('WHOIS')
+        self.max_targets['names'] = capabilities.max_targets('NAMES')
+        self.prefix_symbols = capabilities.prefix_symbols
+        if capabilities.fold_table is not self.fold_table:
+            self.fold_table = capabilities.fold_table
+            self.clear()
+
+    def _handle_disconnected(self, server_handler, **kwargs):
+        self.clear()
+        self._fail_all(QueryError('Disconnected before the reply came'))
+    # =========================================================================
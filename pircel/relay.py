@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.relay
+------------
+
+Bouncer mode: lets any number of IRC clients share one upstream connection.
+
+A `Relay` listens on a local socket (TCP or unix) for downstream clients. Once one has registered (NICK and USER, and
+PASS if the relay has a password) it's sent a welcome and the state of every channel we're in (JOIN, topic and NAMES)
+straight out of a `pircel.state.StateTracker`, so the upstream server isn't asked for anything. From then on:
+
+    - every line from upstream is forwarded to it as the bytes that came off the wire, joined once per read for all the
+      clients rather than parsed and re-serialized per client (PINGs, PONGs and CAP are answered by us, not forwarded)
+    - every line it sends goes upstream as is (apart from PING, QUIT and registration, which the relay handles), and
+      PRIVMSGs and NOTICEs are also shown to the other clients since the server won't echo them back
+
+Clients are offered the capabilities the upstream connection holds (those the relay knows how to pass on), and lines
+are rewritten for clients that didn't take them all: tags they didn't ask for are stripped, BATCH, AWAY, ACCOUNT,
+CHGHOST and SETNAME dropped, extended JOINs cut back to plain ones and NAMES replies reduced to one prefix and bare
+nicks. Clients with the same capabilities share one rewritten copy of each batch, and ones with all of them get the
+lines as they came.
+
+Each client's send queue is the transport's write buffer, a client that lets it grow past `max_send_queue` bytes (it's
+not reading fast enough to keep up) is disconnected rather than holding up everyone else or using unbounded memory.
+
+The relay is fed by wrapping the upstream line stream's `lines_callback`, see `Relay.attach_stream`.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upstream commands that are between us and the server
+_not_forwarded = frozenset((b'PING', b'PONG', b'CAP', b'AUTHENTICATE'))
+# Downstream commands the relay deals with itself once a client has registered
+_handled_locally = frozenset((b'PING', b'PONG', b'QUIT', b'PASS', b'USER', b'CAP'))
+_echoed = frozenset((b'PRIVMSG', b'NOTICE'))
+
+# Capabilities that only change what the server sends, so a client can have them if the upstream connection does
+relayable_caps = frozenset(('batch', 'server-time', 'message-tags', 'account-tag', 'multi-prefix', 'userhost-in-names',
+                            'away-notify', 'extended-join', 'account-notify', 'chghost', 'setname'))
+# Tags a client can be sent without message-tags, and the capability it needs for each
+_tag_caps = {b'time': 'server-time', b'account': 'account-tag', b'batch': 'batch'}
+# Commands only sent to clients with a capability
+_cap_commands = {b'BATCH': 'batch', b'AWAY': 'away-notify', b'ACCOUNT': 'account-notify', b'CHGHOST': 'chghost',
+                 b'SETNAME': 'setname'}
+
+
+def _command(line):
+    """ Cheaply picks the command out of a raw line. """
+    if line.startswith(b'@'):
+        line = line.partition(b' ')[2].lstrip(b' ')
+    if line.startswith(b':'):
+        line = line.partition(b' ')[2].lstrip(b' ')
+    return line.partition(b' ')[0].rstrip(b'\r').upper()
+
+
+def downgrade(line, caps, prefix_symbols=b'@+'):
+    """ Rewrites a raw line from upstream for a client that only has `caps`, returns None if it shouldn't get it. """
+    cr = line.endswith(b'\r')
+    if cr:
+        line = line[:-1]
+    tags = b''
+    if line.startswith(b'@'):
+        tags, _, line = line.partition(b' ')
+        line = line.lstrip(b' ')
+        if 'message-tags' not in caps:
+            kept = [tag for tag in tags[1:].split(b';') if _tag_caps.get(tag.partition(b'=')[0]) in caps]
+            tags = b'@' + b';'.join(kept) if kept else b''
+    prefix = b''
+    if line.startswith(b':'):
+        prefix, _, line = line.partition(b' ')
+        line = line.lstrip(b' ')
+    command, _, params = line.partition(b' ')
+    upper = command.upper()
+
+    if upper in _cap_commands:
+        if _cap_commands[upper] not in caps:
+            return None
+    elif upper == b'JOIN':
+        if 'extended-join' not in caps:
+            params = params.partition(b' ')[0]
+    elif upper == b'353':
+        multi_prefix, userhost = 'multi-prefix' in caps, 'userhost-in-names' in caps
+        if not (multi_prefix and userhost):
+            start, _, names = params.partition(b' :')
+            rewritten = []
+            for name in names.split():
+                nick = name.lstrip(prefix_symbols)
+                symbols = name[:len(name) - len(nick)]
+                if not userhost:
+                    nick = nick.partition(b'!')[0]
+                rewritten.append((symbols if multi_prefix else symbols[:1]) + nick)
+            params = start + b' :' + b' '.join(rewritten)
+
+    parts = [part for part in (tags, prefix, command, params) if part]
+    return b' '.join(parts) + (b'\r' if cr else b'')
+
+
+class DownstreamClient(asyncio.Protocol):
+    def __init__(self, relay):
+        """ One client connected to the relay. """
+        self.relay = relay
+        self.transport = None
+        self.nick = None
+        self.registered = False
+        self.caps = frozenset()
+        self._user_received = False
+        # Registration waits for CAP END once the client has started negotiating
+        self._negotiating = False
+        self._password_ok = relay.password is None
+        self._buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        logger.debug('Downstream client connected from %s', transport.get_extra_info('peername'))
+
+    def connection_lost(self, exc):
+        logger.debug('Downstream client %s disconnected: %s', self.nick, exc)
+        self.transport = None
+        self.relay.clients.discard(self)
+
+    def data_received(self, data):
+        buffer = self._buffer
+        buffer += data
+        end = buffer.rfind(b'\n') + 1
+        if end:
+            lines = bytes(buffer[:end]).split(b'\n')
+            del buffer[:end]
+            lines.pop()
+            for line in lines:
+                line = line.rstrip(b'\r')
+                if line and self.transport is not None:
+                    self.handle_line(line)
+
+    def handle_line(self, line):
+        command = _command(line)
+        if not self.registered:
+            self._register(command, line)
+        elif command in _handled_locally:
+            if command == b'PING':
+                self.send(b':' + self.relay.server_name + b' PONG ' + line[5:] + b'\r\n')
+            elif command == b'QUIT':
+                self.close()
+            elif command == b'CAP':
+                self._cap(line.split(b' ', 1)[1] if b' ' in line else b'')
+        else:
+            self.relay.send_upstream(line, self)
+
+    def _register(self, command, line):
+        args = line.split(b' ', 1)[1] if b' ' in line else b''
+        if command == b'PASS':
+            self._password_ok = args.lstrip(b':') == self.relay.password
+        elif command == b'NICK':
+            self.nick = args.lstrip(b':')
+        elif command == b'USER':
+            self._user_received = True
+        elif command == b'CAP':
+            self._cap(args)
+        elif command == b'PING':
+            self.send(b':' + self.relay.server_name + b' PONG ' + line[5:] + b'\r\n')
+
+        if self.nick is not None and self._user_received and not self._negotiating:
+            if not self._password_ok:
+                self.send(b'ERROR :Bad password\r\n')
+                self.close()
+                return
+            self.registered = True
+            self.relay.attach_client(self)
+
+    def _cap(self, args):
+        subcommand, _, rest = args.partition(b' ')
+        subcommand = subcommand.upper()
+        start = b':' + self.relay.server_name + b' CAP ' + (self.nick or b'*')
+        if subcommand == b'LS':
+            self._negotiating = not self.registered
+            offered = ' '.join(sorted(self.relay.offered_caps())).encode('ascii')
+            self.send(start + b' LS :' + offered + b'\r\n')
+        elif subcommand == b'LIST':
+            self.send(start + b' LIST :' + ' '.join(sorted(self.caps)).encode('ascii') + b'\r\n')
+        elif subcommand == b'REQ':
+            self._negotiating = not self.registered
+            requested = rest.lstrip(b':').decode('ascii', 'replace').split()
+            enabled = {cap for cap in requested if not cap.startswith('-')}
+            disabled = {cap[1:] for cap in requested if cap.startswith('-')}
+            if enabled <= self.relay.offered_caps():
+                self.caps = frozenset((self.caps | enabled) - disabled)
+                self.send(start + b' ACK :' + rest.lstrip(b':') + b'\r\n')
+            else:
+                self.send(start + b' NAK :' + rest.lstrip(b':') + b'\r\n')
+        elif subcommand == b'END':
+            self._negotiating = False
+
+    def send(self, data):
+        transport = self.transport
+        if transport is None:
+            return
+        transport.write(data)
+        if transport.get_write_buffer_size() > self.relay.max_send_queue:
+            logger.info('Downstream client %s is too slow (%d bytes queued), disconnecting', self.nick,
+                        transport.get_write_buffer_size())
+            self.relay.evicted += 1
+            self.relay.clients.discard(self)
+            transport.abort()
+            self.transport = None
+
+    def close(self):
+        self.relay.clients.discard(self)
+        if self.transport is not None:
+            self.transport.close()
+
+
+class Relay:
+    def __init__(self, server_handler, tracker, loop=None, max_send_queue=1024 * 1024, password=None,
+                 server_name='pircel.relay'):
+        """
+        Args:
+            server_handler (IRCServerHandler): The upstream connection.
+            tracker (pircel.state.StateTracker): State of the upstream connection, sent to clients when they attach.
+            loop (asyncio.AbstractEventLoop): The loop to run on, defaults to the current event loop.
+            max_send_queue (int): Bytes a client can have waiting to be sent to it before it's disconnected.
+            password (str): Password clients have to give with PASS, None to not need one.
+            server_name (str): What the relay calls itself in the lines it sends clients.
+        """
+        self.server_handler = server_handler
+        self.tracker = tracker
+        self._loop = loop
+        self.max_send_queue = max_send_queue
+        self.password = password.encode('utf8') if password is not None else None
+        self.server_name = server_name.encode('utf8')
+
+        # Registered clients, the ones that get lines from upstream
+        self.clients = set()
+        self.servers = []
+        self.evicted = 0
+        self.lines_forwarded = 0
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    async def listen(self, host='127.0.0.1', port=0):
+        """ Starts accepting clients on a TCP socket, returns the port (useful if `port` was 0). """
+        server = await self.loop.create_server(lambda: DownstreamClient(self), host, port)
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def listen_unix(self, path):
+        """ Starts accepting clients on a unix socket. """
+        self.servers.append(await self.loop.create_unix_server(lambda: DownstreamClient(self), path))
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        self.servers.clear()
+        for client in list(self.clients):
+            client.close()
+
+    # =========================================================================
+    # Upstream -> downstream
+    # =========================================================================
+    def attach_stream(self, line_stream):
+        """ Wraps `line_stream`'s `lines_callback` so everything it reads is also fed to the relay. """
+        lines_callback = line_stream.lines_callback
+
+        def relay_lines(lines):
+            lines_callback(lines)
+            self.feed(lines)
+        line_stream.lines_callback = relay_lines
+
+    def feed(self, lines):
+        """ Forwards a batch of raw lines (bytes, without the trailing newline) from upstream to every client. """
+        if not self.clients:
+            return
+        forwarded = [line for line in lines if _command(line) not in _not_forwarded]
+        if not forwarded:
+            return
+        self.lines_forwarded += len(forwarded)
+
+        offered = self.offered_caps()
+        by_caps = {}
+        for client in list(self.clients):
+            by_caps.setdefault(offered if offered <= client.caps else client.caps, []).append(client)
+        symbols = self._encode(self.server_handler.capabilities.prefix_symbols)
+        for caps, clients in by_caps.items():
+            if offered <= caps:
+                data = b'\n'.join(forwarded) + b'\n'
+            else:
+                downgraded = [line for line in (downgrade(line, caps, symbols) for line in forwarded) if line]
+                if not downgraded:
+                    continue
+                data = b'\n'.join(downgraded) + b'\n'
+            for client in clients:
+                client.send(data)
+
+    def offered_caps(self):
+        """ The capabilities clients can have, the ones the upstream connection has that only change what's sent. """
+        return relayable_caps.intersection(self.server_handler.caps)
+
+    # =========================================================================
+    # Downstream -> upstream
+    # =========================================================================
+    def send_upstream(self, line, client=None):
+        """ Sends a raw line from a client upstream, and shows other clients any messages it contains. """
+        server_handler = self.server_handler
+        if server_handler.write_bytes is not None:
+            server_handler.write_bytes(line + b'\r\n')
+        else:
+            server_handler.write_function(line.decode(server_handler.encoding, 'replace'))
+
+        if _command(line) in _echoed and len(self.clients) > 1:
+            data = self._user_mask() + b' ' + line + b'\r\n'
+            for other in list(self.clients):
+                if other is not client:
+                    other.send(data)
+
+    # =========================================================================
+    # Attaching clients
+    # =========================================================================
+    def _encode(self, text):
+        return text.encode(self.server_handler.encoding)
+
+    def _user_mask(self):
+        identity = self.server_handler.identity
+        user = self.tracker.get_user(identity.nick)
+        host = user.host if user is not None and user.host else 'localhost'
+        return self._encode(':{}!{}@{}'.format(identity.nick, identity.username, host))
+
+    def attach_client(self, client):
+        """ Sends a newly registered client the welcome and channel state, then starts forwarding to it. """
+        client.send(b''.join(self.snapshot(client.nick)))
+        self.clients.add(client)
+
+    def snapshot(self, client_nick=None):
+        """ Returns the lines (bytes, terminated) that bring a new client up to date. """
+        nick = self._encode(self.server_handler.identity.nick)
+        server = b':' + self.server_name
+        tracker = self.tracker
+        lines = [server + b' 001 ' + nick + b' :Welcome, you are attached to ' + nick + b'\r\n']
+        if client_nick is not None and client_nick != nick:
+            lines.append(b':' + client_nick + b' NICK :' + nick + b'\r\n')
+
+        # The upstream server's ISUPPORT, so the client compares names and parses modes the same way
+        capabilities = self.server_handler.capabilities
+        tokens = dict(capabilities.tokens)
+        tokens.setdefault('CASEMAPPING', capabilities.casemapping)
+        tokens.setdefault('PREFIX', '({}){}'.format(capabilities.prefix_modes, capabilities.prefix_symbols))
+        tokens = [key + '=' + value.replace('\\', '\\x5C').replace(' ', '\\x20') if value else key
+                  for key, value in sorted(tokens.items())]
+        for start in range(0, len(tokens), 13):
+            lines.append(b''.join((server, b' 005 ', nick, b' ', self._encode(' '.join(tokens[start:start + 13])),
+                                   b' :are supported by this server\r\n')))
+        lines.append(server + b' 422 ' + nick + b' :No MOTD on the relay\r\n')
+
+        user_mask = self._user_mask()
+        modes, symbols = tracker.prefix_modes, tracker.prefix_symbols
+        max_names = self.server_handler.max_line_bytes - 2
+        for channel in tracker.channels.values():
+            name = self._encode(channel.name)
+            lines.append(user_mask + b' JOIN ' + name + b'\r\n')
+            if channel.topic:
+                lines.append(server + b' 332 ' + nick + b' ' + name + b' :' + self._encode(channel.topic) + b'\r\n')
+
+            start = server + b' 353 ' + nick + b' = ' + name + b' :'
+            names = []
+            size = len(start)
+            for membership in channel.members.values():
+                # Only the highest prefix, we don't know if the client has multi-prefix
+                ranked = [modes.index(mode) for mode in membership.modes if mode in modes]
+                entry = self._encode((symbols[min(ranked)] if ranked else '') + membership.user.nick)
+                if names and size + len(entry) + 1 > max_names:
+                    lines.append(start + b' '.join(names) + b'\r\n')
+                    names, size = [], len(start)
+                names.append(entry)
+                size += len(entry) + 1
+            if names:
+                lines.append(start + b' '.join(names) + b'\r\n')
+            lines.append(server + b' 366 ' + nick + b' ' + name + b' :End of /NAMES list.\r\n')
+        return lines
+    # =========================================================================
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+pircel.router
+-------------
+
+Routes messages to callbacks by command, channel and text, for bots with lots of commands.
+
+`IRCServerHandler.add_callback` subscribes to every message with a given command, so a bot with a few hundred commands
+would have every one of its callbacks called for every PRIVMSG and each would check the text itself. A `Router` is
+connected once per command instead and each route says which messages it wants:
+
+    router = Router(server_handler)
+    router.add_route(on_weather, channel='#bots', prefix='!weather ')
+    router.add_route(on_url, pattern=r'https?://\\S+')
+
+    @router.route(command='notice', prefix='You are now identified')
+    def on_identified(sender, prefix, args, match):
+        ...
+
+Routes are compiled (on the first message after they change) into a table per command and channel: a trie of the text
+prefixes, which is walked once along the text so finding every matching prefix route costs the length of the longest
+match rather than the number of routes, and a single alternation of all the patterns, which rules out all of them in one
+scan for the (usual) text that matches none. Only when that alternation does match are the patterns tried one at a time,
+so each route gets its own match object. Patterns with numeric backreferences are left out of the alternation (their
+groups would be renumbered in it) and always tried. Patterns anchored to some literal text (e.g. `^!seen (\\S+)`) are
+kept in the trie under that text instead, so they're only tried on text that starts with it.
+
+Callbacks are called like signal receivers, with the server handler and `prefix` and `args` keyword arguments, plus
+`match` (the `re.Match` for pattern routes, None otherwise), in the order the routes were added.
+"""
+import functools
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+class Route:
+    __slots__ = ('callback', 'command', 'channel', 'prefix', 'pattern', 'order')
+
+    def __init__(self, callback, command, channel, prefix, pattern, order):
+        self.callback = callback
+        self.command = command
+        self.channel = channel
+        self.prefix = prefix
+        self.pattern = pattern
+        self.order = order
+
+    def __repr__(self):
+        return '<Route {} {} channel={!r} prefix={!r} pattern={!r}>'.format(
+            self.command, getattr(self.callback, '__qualname__', self.callback), self.channel, self.prefix,
+            self.pattern.pattern if self.pattern is not None else None)
+
+
+_metacharacters = frozenset('.^$*+?{}[]()|\\')
+# Numeric backreferences and conditionals, which would point at the wrong group once patterns are combined
+_numbered_group_reference = re.compile(r'\\[1-9]|\(\?\(\d')
+
+
+def _literal_prefix(pattern):
+    """ Returns the literal text a pattern anchored with '^' has to start with ('' if it isn't anchored). """
+    source = pattern.pattern
+    # Alternatives might not all be anchored (or start with the same text)
+    if not source.startswith('^') or '|' in source or pattern.flags & (re.IGNORECASE | re.MULTILINE | re.VERBOSE):
+        return ''
+    literal = []
+    position = 1
+    while position < len(source):
+        char = source[position]
+        if char == '\\' and position + 1 < len(source) and not source[position + 1].isalnum():
+            char = source[position + 1]
+            position += 1
+        elif char in _metacharacters:
+            break
+        literal.append(char)
+        position += 1
+    # A quantifier applies to the last character so it isn't part of the prefix
+    if literal and source[position:position + 1] in ('*', '?', '{'):
+        literal.pop()
+    return ''.join(literal)
+
+
+def _refers_to_groups(pattern):
+    # Escaped backslashes go first so e.g. r'\\1' (a backslash then a 1) isn't taken for a backreference
+    return _numbered_group_reference.search(pattern.pattern.replace('\\\\', '')) is not None
+
+
+class _Table:
+    """ The compiled routes for one command in one channel (or any channel). """
+    __slots__ = ('trie', 'patterns', 'separate', 'combined')
+
+    def __init__(self, routes):
+        # Each node is a (children, routes) pair, children maps the next character to the next node
+        self.trie = ({}, [])
+        self.patterns = []
+        for route in routes:
+            if route.pattern is None:
+                prefix = route.prefix or ''
+            else:
+                # Patterns anchored to a literal go in the trie, they can't match text that doesn't start with it
+                prefix = _literal_prefix(route.pattern)
+                if not prefix:
+                    self.patterns.append(route)
+                    continue
+            node = self.trie
+            for char in prefix:
+                node = node[0].setdefault(char, ({}, []))
+            node[1].append(route)
+
+        # Patterns that refer to their groups by number can't go in the alternation (the groups are renumbered in it),
+        # they're always tried
+        self.separate = [route for route in self.patterns if _refers_to_groups(route.pattern)]
+        combinable = [route for route in self.patterns if not _refers_to_groups(route.pattern)]
+        self.combined = None
+        if len(combinable) > 1:
+            try:
+                self.combined = re.compile('|'.join('(?:{})'.format(route.pattern.pattern) for route in combinable))
+            except re.error:
+                # e.g. global flags part way through, or clashing group names, we'll just have to try them all
+                logger.debug('Patterns can\'t be combined, they\'ll be tried one by one')
+
+    def match(self, text, matches):
+        """ Appends (route, match) for every route matching `text` to `matches`. """
+        node = self.trie
+        self._match_node(node, text, matches)
+        for char in text:
+            node = node[0].get(char)
+            if node is None:
+                break
+            if node[1]:
+                self._match_node(node, text, matches)
+
+        if not self.patterns:
+            return
+        if self.combined is None or self.combined.search(text):
+            routes = self.patterns
+        else:
+            routes = self.separate
+        for route in routes:
+            match = route.pattern.search(text)
+            if match is not None:
+                matches.append((route, match))
+
+    @staticmethod
+    def _match_node(node, text, matches):
+        for route in node[1]:
+            if route.pattern is None:
+                matches.append((route, None))
+            else:
+                match = route.pattern.search(text)
+                if match is not None:
+                    matches.append((route, match))
+
+
+class Router:
+    def __init__(self, server_handler):
+        """ Routes `server_handler`'s messages to callbacks, see the module docs.
+
+        Channel names are compared the way the server says to (its CASEMAPPING).
+        """
+        self.server_handler = server_handler
+        self.fold_table = server_handler.capabilities.fold_table
+        server_handler.add_callback('rpl_isupport', self._handle_rpl_isupport)
+
+        self.routes = []
+        self._order = 0
+        # command -> (folded channel or None) -> _Table, built from `routes` when first needed
+        self._tables = {}
+        self._receivers = {}
+
+    def add_route(self, callback, command='privmsg', channel=None, prefix=None, pattern=None):
+        """ Calls `callback` for messages with `command` (specified symbolically) that match everything given.
+
+        Args:
+            callback (callable): Called with the server handler and `prefix`, `args` and `match` keyword arguments.
+            command (str): The command (e.g. 'privmsg' or 'rpl_whoreply').
+            channel (str): Only messages whose first argument is this channel (or nick), None for any.
+            prefix (str): Only messages whose text (last argument) starts with this.
+            pattern (str or re.Pattern): Only messages whose text this regular expression is found in (with
+                `re.search`).
+
+        Returns:
+            The `Route`, to give to `remove_route`.
+        """
+        if prefix is not None and pattern is not None:
+            raise ValueError('A route can have a prefix or a pattern but not both, put the prefix in the pattern')
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+
+        route = Route(callback, command, channel, prefix, pattern, self._order)
+        self._order += 1
+        self.routes.append(route)
+        self._tables.pop(command, None)
+
+        if command not in self._receivers:
+            receiver = self._receivers[command] = functools.partial(self._dispatch, command)
+            self.server_handler.add_callback(command, receiver, weak=False)
+        return route
+
+    def route(self, command='privmsg', channel=None, prefix=None, pattern=None):
+        """ Decorator version of `add_route`, returns the function as is. """
+        def decorator(callback):
+            self.add_route(callback, command, channel, prefix, pattern)
+            return callback
+        return decorator
+
+    def remove_route(self, route):
+        self.routes.remove(route)
+        self._tables.pop(route.command, None)
+        if not any(other.command == route.command for other in self.routes):
+            self.server_handler.remove_callback(route.command, self._receivers.pop(route.command))
+
+    def clear(self):
+        for command, receiver in self._receivers.items():
+            self.server_handler.remove_callback(command, receiver)
+        self._receivers.clear()
+        self._tables.clear()
+        self.routes.clear()
+
+    def _compile(self, command):
+        by_channel = {}
+        for route in self.routes:
+            if route.command == command:
+                channel = route.channel.translate(self.fold_table) if route.channel is not None else None
+                by_channel.setdefault(channel, []).append(route)
+        tables = self._tables[command] = {channel: _Table(routes) for channel, routes in by_channel.items()}
+        return tables
+
+    def _handle_rpl_isupport(self, server_handler, prefix, args):
+        if server_handler.capabilities.fold_table is not self.fold_table:
+            self.fold_table = server_handler.capabilities.fold_table
+            self._tables.clear()
+
+    def _dispatch(self, command, sender, prefix, args):
+        tables = self._tables.get(command)
+        if tables is None:
+            tables = self._compile(command)
+
+        text = args[-1] if len(args) > 1 else ''
+        matches = []
+        table = tables.get(None)
+        if table is not None:
+            table.match(text, matches)
+        if args:
+            table = tables.get(args[0].translate(self.fold_table))
+            if table is not None:
+                table.match(text, matches)
+        if not matches:
+            return
+
+        if len(matches) > 1:
+            matches.sort(key=lambda route_match: route_match[0].order)
+        for route, match in matches:
+            route.callback(sender, prefix=prefix, args=args, match=match)
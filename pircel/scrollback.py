@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pircel.scrollback
+-----------------
+
+Append-only on-disk scrollback, for replaying channel history without going through the database.
+
+Each network gets a series of segment files holding fixed-header binary records, one per PRIVMSG, NOTICE, JOIN or PART.
+Every record points back at the previous record for the same channel so a channel's history can be walked backwards
+without reading anyone else's, and a sparse per-channel index of (timestamp, position) entries (every `index_interval`
+records, kept in memory and appended to an index file) means "the last N lines before T" only has to walk back at most
+`index_interval` records past T before it starts collecting. Reads go through `mmap` so only the pages touched are read.
+
+Record layout (little endian):
+
+    timestamp   double
+    previous    int64   position of the previous record in the same channel, -1 for the first
+    kind        uint8   index into `kinds`
+    lengths     3 x uint16, of the channel, prefix and text that follow (utf8)
+
+A position is the segment number shifted left 40 bits plus the offset into the segment.
+"""
+import bisect
+import collections
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+
+from pircel import protocol, state
+
+logger = logging.getLogger(__name__)
+
+kinds = ('privmsg', 'notice', 'join', 'part')
+_kind_numbers = {kind: number for number, kind in enumerate(kinds)}
+
+_header = struct.Struct('<dqBHHH')
+_index_entry = struct.Struct('<dqH')
+_segment_bits = 40
+_offset_mask = (1 << _segment_bits) - 1
+
+Line = collections.namedtuple('Line', ['timestamp', 'kind', 'channel', 'prefix', 'text'])
+Line.__doc__ = """ One line of scrollback, `kind` is one of `kinds`. """
+
+
+def attach_recorder(server_handler, append, kinds):
+    """ Calls `append(kind, target, prefix, text)` for each message of one of `kinds` seen by `server_handler`.
+
+    Returns the `(server_handler, kind, callback)` connections, for `detach_recorder`.
+    """
+    def handler(kind):
+        def record(sender, prefix, args):
+            target = args[0]
+            if kind in ('privmsg', 'notice') and target == sender.identity.nick:
+                # Private messages are filed under who they're from
+                target = protocol.parse_identity(prefix).nick
+            append(kind, target, prefix, args[1] if len(args) > 1 else '')
+        return record
+
+    handlers = []
+    for kind in kinds:
+        callback = handler(kind)
+        server_handler.add_callback(kind, callback, weak=False)
+        handlers.append((server_handler, kind, callback))
+    return handlers
+
+
+def detach_recorder(handlers):
+    """ Disconnects (and forgets) what `attach_recorder` connected. """
+    for server_handler, kind, callback in handlers:
+        server_handler.remove_callback(kind, callback)
+    handlers.clear()
+
+
+class ScrollbackStore:
+    def __init__(self, directory, network, segment_size=256 * 1024 * 1024, index_interval=256, buffer_size=65536,
+                 casemapping='rfc1459', clock=time.time):
+        """
+        Args:
+            directory (str): Where to keep the segment and index files, created if it doesn't exist.
+            network (str): Name of the network, used to name the files so networks can share a directory.
+            segment_size (int): Start a new segment file once the current one is this big.
+            index_interval (int): Add an index entry every this many records in a channel.
+            buffer_size (int): How many bytes of records to buffer before writing them out.
+            casemapping (str): How the network compares channel names, one of `pircel.state.casemapping_tables`.
+            clock (callable): Returns the timestamp to record lines with.
+        """
+        self.directory = directory
+        self.network = network
+        self.segment_size = segment_size
+        self.index_interval = index_interval
+        self.buffer_size = buffer_size
+        self.fold_table = state.casemapping_tables[casemapping]
+        self.clock = clock
+
+        # folded channel -> (timestamp, position) of its latest record
+        self._heads = {}
+        # folded channel -> ([timestamps], [positions]) every `index_interval` records
+        self._index = {}
+        # folded channel -> records since its last index entry
+        self._since_indexed = collections.Counter()
+
+        # segment number -> mmap, the current segment's is replaced as it grows
+        self._maps = {}
+        # Records and index entries waiting to be written, index entries go after the records they point at
+        self._buffer = bytearray()
+        self._index_buffer = bytearray()
+        self._handlers = []
+
+        os.makedirs(directory, exist_ok=True)
+        self._index_file = open(os.path.join(directory, '{}.idx'.format(network)), 'a+b')
+        closed_at = self._load_index()
+
+        segments = self._existing_segments()
+        self._segment = segments[-1] if segments else 0
+        self._offset = self._recover(self._segment, closed_at) if segments else 0
+        self._file = open(self._segment_path(self._segment), 'ab')
+
+    # =========================================================================
+    # Files
+    # =========================================================================
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, '{}.{:06d}.seg'.format(self.network, segment))
+
+    def _existing_segments(self):
+        pattern = re.compile(r'{}\.(\d+)\.seg$'.format(re.escape(self.network)))
+        matches = (pattern.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def _load_index(self):
+        self._index_file.seek(0)
+        data = self._index_file.read()
+        offset = 0
+        closed_at = None
+        while offset + _index_entry.size <= len(data):
+            timestamp, position, length = _index_entry.unpack_from(data, offset)
+            end = offset + _index_entry.size + length
+            if end > len(data):
+                break
+            key = data[offset + _index_entry.size:end].decode('utf8')
+            offset = end
+            if not key:
+                # Written by `close`, nothing after this position needs to be scanned for
+                closed_at = position
+                continue
+            closed_at = None
+            if self._add_index_entry(key, timestamp, position):
+                self._heads[key] = (timestamp, position)
+        if offset != len(data):
+            logger.warning('Ignoring %s bytes of partial index entry in %s', len(data) - offset, self._index_file.name)
+            self._index_file.truncate(offset)
+        return closed_at
+
+    def _recover(self, segment, closed_at):
+        """ Catches up the channel heads from the last segment and drops any partly written record at its end.
+
+        Skipped if the store was closed cleanly (and nothing's been written since), the index has all the heads then.
+        """
+        path = self._segment_path(segment)
+        size = os.path.getsize(path)
+        if closed_at == segment << _segment_bits | size:
+            return size
+        offset = 0
+        if size:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while offset + _header.size <= size:
+                    timestamp, _, _, channel_length, prefix_length, text_length = _header.unpack_from(data, offset)
+                    end = offset + _header.size + channel_length + prefix_length + text_length
+                    if end > size:
+                        break
+                    channel = bytes(data[offset + _header.size:offset + _header.size + channel_length]).decode('utf8')
+                    self._heads[channel] = (timestamp, segment << _segment_bits | offset)
+                    offset = end
+        if offset != size:
+            logger.warning('Dropping %s bytes of partial record at the end of %s', size - offset, path)
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        return offset
+
+    def _roll(self):
+        self._write_buffer()
+        self._file.close()
+        self._segment += 1
+        self._offset = 0
+        self._file = open(self._segment_path(self._segment), 'ab')
+
+        # Make sure every channel's latest record is in the index, recovery only scans the newest segment
+        for key, (timestamp, position) in self._heads.items():
+            self._write_index_entry(key, timestamp, position)
+        self._write_buffer()
+
+    def _write_buffer(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._file.flush()
+            self._buffer.clear()
+        if self._index_buffer:
+            self._index_file.write(self._index_buffer)
+            self._index_file.flush()
+            self._index_buffer.clear()
+
+    def flush(self):
+        """ Writes out any buffered records and index entries. """
+        self._write_buffer()
+
+    def close(self):
+        self.detach()
+        for key, (timestamp, position) in self._heads.items():
+            self._write_index_entry(key, timestamp, position)
+        self._index_buffer += _index_entry.pack(0, self._segment << _segment_bits | self._offset, 0)
+        self.flush()
+        self._file.close()
+        self._index_file.close()
+        for data in self._maps.values():
+            data.close()
+        self._maps.clear()
+    # =========================================================================
+
+    # =========================================================================
+    # Writing
+    # =========================================================================
+    def append(self, kind, channel, prefix, text='', timestamp=None):
+        """ Appends a line to `channel`'s scrollback. """
+        if timestamp is None:
+            timestamp = self.clock()
+        key = channel.translate(self.fold_table)
+        channel_bytes = key.encode('utf8')
+        prefix_bytes = (prefix or '').encode('utf8')
+        text_bytes = (text or '').encode('utf8')
+        length = _header.size + len(channel_bytes) + len(prefix_bytes) + len(text_bytes)
+
+        if self._offset and self._offset + length > self.segment_size:
+            self._roll()
+
+        position = self._segment << _segment_bits | self._offset
+        head = self._heads.get(key)
+        self._buffer += _header.pack(timestamp, head[1] if head is not None else -1, _kind_numbers[kind],
+                                     len(channel_bytes), len(prefix_bytes), len(text_bytes))
+        self._buffer += channel_bytes
+        self._buffer += prefix_bytes
+        self._buffer += text_bytes
+        self._offset += length
+        self._heads[key] = (timestamp, position)
+
+        if head is None or self._since_indexed[key] >= self.index_interval:
+            self._write_index_entry(key, timestamp, position)
+        else:
+            self._since_indexed[key] += 1
+
+        if len(self._buffer) >= self.buffer_size:
+            self._write_buffer()
+
+    def _add_index_entry(self, key, timestamp, position):
+        timestamps, positions = self._index.setdefault(key, ([], []))
+        if positions and positions[-1] >= position:
+            return False
+        timestamps.append(timestamp)
+        positions.append(position)
+        return True
+
+    def _write_index_entry(self, key, timestamp, position):
+        self._since_indexed[key] = 0
+        if self._add_index_entry(key, timestamp, position):
+            key_bytes = key.encode('utf8')
+            self._index_buffer += _index_entry.pack(timestamp, position, len(key_bytes))
+            self._index_buffer += key_bytes
+
+    def attach(self, server_handler):
+        """ Records PRIVMSGs, NOTICEs, JOINs and PARTs seen by `server_handler`. """
+        self._handlers.extend(attach_recorder(server_handler, self.append, kinds))
+
+    def detach(self):
+        detach_recorder(self._handlers)
+    # =========================================================================
+
+    # =========================================================================
+    # Reading
+    # =========================================================================
+    def channels(self):
+        """ The (case folded) names of all the channels with scrollback. """
+        return list(self._heads)
+
+    def _map(self, segment, end):
+        data = self._maps.get(segment)
+        if data is None or len(data) < end:
+            if segment == self._segment:
+                self._write_buffer()
+            if data is not None:
+                data.close()
+            with open(self._segment_path(segment), 'rb') as f:
+                data = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return data
+
+    def _read(self, position):
+        """ Returns the record at `position` and the position of the previous one in its channel. """
+        segment, offset = position >> _segment_bits, position & _offset_mask
+        data = self._map(segment, offset + _header.size)
+        timestamp, previous, kind, channel_length, prefix_length, text_length = _header.unpack_from(data, offset)
+        start = offset + _header.size
+        end = start + channel_length + prefix_length + text_length
+        if len(data) < end:
+            data = self._map(segment, end)
+        channel = data[start:start + channel_length].decode('utf8')
+        start += channel_length
+        prefix = data[start:start + prefix_length].decode('utf8')
+        start += prefix_length
+        text = data[start:end].decode('utf8')
+        return Line(timestamp, kinds[kind], channel, prefix, text), previous
+
+    def before(self, channel, limit, until=None):
+        """ Returns up to `limit` of `channel`'s lines from before `until` (default now), oldest first.
+
+        Assumes timestamps only go forwards, lines recorded across the system clock going backwards may be missed.
+        """
+        key = channel.translate(self.fold_table)
+        head = self._heads.get(key)
+        if head is None or limit <= 0:
+            return []
+
+        position = head[1]
+        if until is not None:
+            # Start from the first index entry at or after `until`, everything before it is earlier
+            timestamps, positions = self._index.get(key, ((), ()))
+            i = bisect.bisect_left(timestamps, until)
+            if i < len(positions):
+                position = positions[i]
+        else:
+            until = float('inf')
+
+        lines = []
+        while position != -1 and len(lines) < limit:
+            line, position = self._read(position)
+            if line.timestamp < until:
+                lines.append(line)
+        lines.reverse()
+        return lines
+    # =========================================================================
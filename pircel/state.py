@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pircel.state
+------------
+
+In-memory tracking of the channels we're in and the users in them, driven entirely by `IRCServerHandler` signals.
+
+Everything is indexed by case-folded nick/channel name so lookups are a dict access, and each user knows which channels
+they're in so e.g. a QUIT only touches that user's channels rather than scanning all of them.
+"""
+import logging
+
+from pircel import isupport, protocol
+
+logger = logging.getLogger(__name__)
+
+casemapping_tables = isupport.casemapping_tables
+
+
+class User:
+    __slots__ = ('nick', 'username', 'host', 'realname', 'account', 'away', 'channels')
+
+    def __init__(self, nick, username=None, host=None):
+        self.nick = nick
+        self.username = username
+        self.host = host
+        self.realname = None
+        self.account = None
+        self.away = False
+
+        # folded channel name -> Channel
+        self.channels = {}
+
+    def __repr__(self):
+        return '<User {}>'.format(self.nick)
+
+
+class Membership:
+    __slots__ = ('user', 'modes')
+
+    def __init__(self, user, modes=''):
+        self.user = user
+        self.modes = modes  # prefix modes the user has in the channel, e.g. 'ov'
+
+
+class Channel:
+    __slots__ = ('name', 'members', 'topic', 'modes')
+
+    def __init__(self, name):
+        self.name = name
+        self.topic = None
+        self.modes = set()
+
+        # folded nick -> Membership
+        self.members = {}
+
+    def __repr__(self):
+        return '<Channel {}>'.format(self.name)
+
+
+class StateTracker:
+    def __init__(self, server_handler):
+        """ Keeps track of channels and users by listening to `server_handler`'s signals.
+
+        Nicks and channel names are compared, and modes parsed, the way the server says to (its RPL_ISUPPORT), starting
+        with whatever it's already said.
+        """
+        self.server_handler = server_handler
+        self.fold_table = server_handler.capabilities.fold_table
+
+        self.users = {}
+        self.channels = {}
+
+        self._apply_capabilities(server_handler.capabilities)
+
+        for signal, callback in (
+                ('join', self._handle_join),
+                ('part', self._handle_part),
+                ('kick', self._handle_kick),
+                ('quit', self._handle_quit),
+                ('nick', self._handle_nick),
+                ('mode', self._handle_mode),
+                ('away', self._handle_away),
+                ('account', self._handle_account),
+                ('topic', self._handle_topic),
+                ('rpl_topic', self._handle_rpl_topic),
+                ('rpl_namreply', self._handle_rpl_namreply),
+                ('rpl_whoreply', self._handle_rpl_whoreply),
+                ('rpl_isupport', self._handle_rpl_isupport),
+                ('disconnected', self._handle_disconnected),
+        ):
+            server_handler.add_callback(signal, callback)
+
+    # =========================================================================
+    # Lookups
+    # =========================================================================
+    def fold(self, name):
+        return name.translate(self.fold_table)
+
+    def get_user(self, nick):
+        return self.users.get(nick.translate(self.fold_table))
+
+    def get_channel(self, name):
+        return self.channels.get(name.translate(self.fold_table))
+
+    def is_on(self, nick, channel):
+        channel = self.channels.get(channel.translate(self.fold_table))
+        return channel is not None and nick.translate(self.fold_table) in channel.members
+
+    def modes_in(self, nick, channel):
+        """ Returns the prefix modes (e.g. 'o' for op) `nick` has in `channel`, None if they're not in it. """
+        channel = self.channels.get(channel.translate(self.fold_table))
+        if channel is None:
+            return None
+        membership = channel.members.get(nick.translate(self.fold_table))
+        return membership.modes if membership is not None else None
+    # =========================================================================
+
+    # =========================================================================
+    # Server details
+    # =========================================================================
+    def set_prefix(self, modes, symbols):
+        """ Sets which channel modes show up as nick prefixes (e.g. `('ov', '@+')`). """
+        self.prefix_modes = modes
+        self.prefix_symbols = symbols
+        self._symbol_to_mode = dict(zip(symbols, modes))
+
+    def set_chanmodes(self, always_param, always_param_setting, set_param, no_param):
+        """ Sets the CHANMODES groups, i.e. which modes take a parameter and when.
+
+        Call `set_prefix` first, prefix modes always take a parameter too.
+        """
+        self._list_modes = set(always_param)
+        self._always_param = set(always_param) | set(always_param_setting) | set(self.prefix_modes)
+        self._set_param = set(set_param)
+    # =========================================================================
+
+    # =========================================================================
+    # Internals
+    # =========================================================================
+    @property
+    def _our_key(self):
+        return self.fold(self.server_handler.identity.nick)
+
+    def _get_or_create_user(self, nick, username=None, host=None):
+        key = nick.translate(self.fold_table)
+        user = self.users.get(key)
+        if user is None:
+            user = self.users[key] = User(nick, username, host)
+        else:
+            if username is not None:
+                user.username = username
+            if host is not None:
+                user.host = host
+        return key, user
+
+    def _add_member(self, channel, nick, username=None, host=None, modes=None):
+        """ Adds a user to a channel (if they're not already in it), `modes` of None leaves their modes alone. """
+        key, user = self._get_or_create_user(nick, username, host)
+        membership = channel.members.get(key)
+        if membership is None:
+            channel.members[key] = Membership(user, modes or '')
+        elif modes is not None:
+            membership.modes = modes
+        user.channels[channel.name.translate(self.fold_table)] = channel
+        return user
+
+    def _remove_member(self, channel_key, nick_key):
+        channel = self.channels.get(channel_key)
+        if channel is None:
+            return
+        if nick_key == self._our_key:
+            # We left, forget the channel and anyone we no longer share a channel with
+            del self.channels[channel_key]
+            for member_key, membership in channel.members.items():
+                membership.user.channels.pop(channel_key, None)
+                if not membership.user.channels and member_key != nick_key:
+                    del self.users[member_key]
+            user = self.users.get(nick_key)
+            if user is not None:
+                user.channels.pop(channel_key, None)
+            return
+
+        membership = channel.members.pop(nick_key, None)
+        if membership is None:
+            return
+        user = membership.user
+        user.channels.pop(channel_key, None)
+        if not user.channels:
+            del self.users[nick_key]
+
+    def _handle_rpl_isupport(self, server_handler, prefix, args):
+        self._apply_capabilities(server_handler.capabilities)
+
+    def _apply_capabilities(self, capabilities):
+        self.set_prefix(capabilities.prefix_modes, capabilities.prefix_symbols)
+        self.set_chanmodes(*capabilities.chanmodes)
+        if capabilities.fold_table is not self.fold_table:
+            self._refold(capabilities.fold_table)
+
+    def _refold(self, fold_table):
+        """ Re-indexes everything under a new casemapping, it's sent before we've joined anything but just in case. """
+        self.fold_table = fold_table
+        self.users = {user.nick.translate(fold_table): user for user in self.users.values()}
+        self.channels = {channel.name.translate(fold_table): channel for channel in self.channels.values()}
+        for channel in self.channels.values():
+            channel.members = {membership.user.nick.translate(fold_table): membership
+                               for membership in channel.members.values()}
+        for user in self.users.values():
+            user.channels = {channel.name.translate(fold_table): channel for channel in user.channels.values()}
+
+    def _handle_disconnected(self, server_handler, **kwargs):
+        # Everything will be sent again when we rejoin, anything kept would just be stale
+        self.users.clear()
+        self.channels.clear()
+
+    def _handle_join(self, server_handler, prefix, args):
+        nick, username, host = protocol.parse_identity(prefix)
+        channel_key = args[0].translate(self.fold_table)
+        channel = self.channels.get(channel_key)
+        if channel is None:
+            channel = self.channels[channel_key] = Channel(args[0])
+        user = self._add_member(channel, nick, username, host)
+
+        if len(args) >= 3:  # extended-join
+            user.account = args[1] if args[1] != '*' else None
+            user.realname = args[2]
+
+    def _handle_part(self, server_handler, prefix, args):
+        nick = protocol.parse_identity(prefix).nick
+        self._remove_member(args[0].translate(self.fold_table), nick.translate(self.fold_table))
+
+    def _handle_kick(self, server_handler, prefix, args):
+        self._remove_member(args[0].translate(self.fold_table), args[1].translate(self.fold_table))
+
+    def _handle_quit(self, server_handler, prefix, args):
+        nick = protocol.parse_identity(prefix).nick
+        key = nick.translate(self.fold_table)
+        user = self.users.pop(key, None)
+        if user is None:
+            return
+        for channel in user.channels.values():
+            channel.members.pop(key, None)
+        user.channels.clear()
+
+    def _handle_nick(self, server_handler, prefix, args):
+        old_nick = protocol.parse_identity(prefix).nick
+        old_key = old_nick.translate(self.fold_table)
+        new_key = args[0].translate(self.fold_table)
+        user = self.users.pop(old_key, None)
+        if user is None:
+            return
+        user.nick = args[0]
+        self.users[new_key] = user
+        for channel in user.channels.values():
+            channel.members[new_key] = channel.members.pop(old_key)
+
+    def _handle_mode(self, server_handler, prefix, args):
+        if len(args) < 2:
+            return
+        channel = self.channels.get(args[0].translate(self.fold_table))
+        if channel is None:  # user mode or a channel we don't know about
+            return
+
+        params = iter(args[2:])
+        adding = True
+        for mode in args[1]:
+            if mode == '+':
+                adding = True
+            elif mode == '-':
+                adding = False
+            elif mode in self._always_param or (adding and mode in self._set_param):
+                param = next(params, None)
+                if mode in self.prefix_modes and param is not None:
+                    membership = channel.members.get(param.translate(self.fold_table))
+                    if membership is not None:
+                        if adding and mode not in membership.modes:
+                            membership.modes = ''.join(m for m in self.prefix_modes
+                                                       if m in membership.modes or m == mode)
+                        elif not adding:
+                            membership.modes = membership.modes.replace(mode, '')
+                elif mode not in self._list_modes:
+                    if adding:
+                        channel.modes.add(mode)
+                    else:
+                        channel.modes.discard(mode)
+            elif adding:
+                channel.modes.add(mode)
+            else:
+                channel.modes.discard(mode)
+
+    def _handle_away(self, server_handler, prefix, args):
+        nick = protocol.parse_identity(prefix).nick
+        user = self.users.get(nick.translate(self.fold_table))
+        if user is not None:
+            user.away = bool(args)
+
+    def _handle_account(self, server_handler, prefix, args):
+        nick = protocol.parse_identity(prefix).nick
+        user = self.users.get(nick.translate(self.fold_table))
+        if user is not None:
+            user.account = args[0] if args[0] != '*' else None
+
+    def _handle_topic(self, server_handler, prefix, args):
+        channel = self.channels.get(args[0].translate(self.fold_table))
+        if channel is not None:
+            channel.topic = args[-1]
+
+    def _handle_rpl_topic(self, server_handler, prefix, args):
+        channel = self.channels.get(args[1].translate(self.fold_table))
+        if channel is not None:
+            channel.topic = args[-1]
+
+    def _handle_rpl_namreply(self, server_handler, prefix, args):
+        # args: me, channel type (=, * or @), channel, names
+        channel = self.channels.get(args[2].translate(self.fold_table))
+        if channel is None:
+            return
+        symbol_to_mode = self._symbol_to_mode
+        for name in args[3].split():
+            # multi-prefix means there could be more than one prefix symbol
+            modes = ''
+            while name and name[0] in symbol_to_mode:
+                modes += symbol_to_mode[name[0]]
+                name = name[1:]
+            # userhost-in-names gives us the whole mask
+            nick, username, host = protocol.parse_identity(name)
+            self._add_member(channel, nick, username, host, modes)
+
+    def _handle_rpl_whoreply(self, server_handler, prefix, args):
+        # args: me, channel, username, host, server, nick, flags, "hopcount realname"
+        if len(args) < 8:
+            return
+        _, channel_name, username, host, _, nick, flags, rest = args[:8]
+        if username.startswith('~'):  # to match `parse_identity`
+            username = username[1:]
+        channel = self.channels.get(channel_name.translate(self.fold_table))
+        if channel is not None:
+            modes = ''.join(self._symbol_to_mode[flag] for flag in flags if flag in self._symbol_to_mode)
+            user = self._add_member(channel, nick, username, host, modes)
+        else:
+            user = self.users.get(nick.translate(self.fold_table))
+            if user is None:
+                return
+        user.away = flags.startswith('G')
+        user.realname = rest.partition(' ')[2]
+    # =========================================================================
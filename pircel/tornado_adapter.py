@@ -1,12 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import datetime
 import logging
 import ssl
 
-from tornado import gen, ioloop, tcpclient
+from tornado import gen, ioloop, iostream, tcpclient
 
-from pircel import protocol
+from pircel import lifecycle, protocol
 
 
 logger = logging.getLogger(__name__)
@@ -14,10 +13,27 @@ loopinstance = ioloop.IOLoop.current()
 
 
 class LineStream:
-    def __init__(self):
+    def __init__(self, batched=True, chunk_size=65536):
+        """ Reads lines from (and writes lines to) a TCP connection to an IRC server.
+
+        Args:
+            batched (bool): Read whatever is available (up to `chunk_size` bytes at a time) and pass every complete line
+                in it to `lines_callback` at once rather than doing a `read_until` per line. If `lines_callback` isn't
+                set the lines are passed to `line_callback` one by one. Batched lines don't include the trailing
+                newline.
+            chunk_size (int): Maximum number of bytes to read in one go when batched.
+        """
         self.tcp_client_factory = tcpclient.TCPClient()
         self.line_callback = None
+        self.lines_callback = None
         self.connect_callback = None
+        self.disconnect_callback = None
+        self.connection = None
+        self.batched = batched
+        self.chunk_size = chunk_size
+
+        # Holds any partial line left at the end of the last chunk, reused for the life of the stream
+        self._buffer = bytearray()
 
     @gen.coroutine
     def connect(self, host, port, secure):
@@ -29,11 +45,18 @@ class LineStream:
             ssl_options = None
 
         self.connection = yield self.tcp_client_factory.connect(host, port, ssl_options=ssl_options)
+        self._buffer.clear()
         logger.debug('Connected.')
         if self.connect_callback is not None:
             self.connect_callback()
             logger.debug('Called post-connection callback')
-        self._schedule_line()
+        self.start_reading()
+
+    def start_reading(self):
+        if self.batched:
+            self._schedule_chunk()
+        else:
+            self._schedule_line()
 
     def handle_line(self, line):
         if self.line_callback is not None:
@@ -42,63 +65,146 @@ class LineStream:
         self._schedule_line()
 
     def _schedule_line(self):
-        self.connection.read_until(b'\n', self.handle_line)
+        future = self.connection.read_until(b'\n')
+        ioloop.IOLoop.current().add_future(future, self._handle_line_future)
+
+    def _handle_line_future(self, future):
+        try:
+            line = future.result()
+        except iostream.StreamClosedError as e:
+            self._closed(e)
+            return
+        self.handle_line(line)
+
+    def _closed(self, exc):
+        logger.debug('Connection closed: %s', exc.real_error or exc)
+        self.connection = None
+        if self.disconnect_callback is not None:
+            self.disconnect_callback(exc.real_error or exc)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    def handle_lines(self, lines):
+        if self.lines_callback is not None:
+            self.lines_callback(lines)
+        elif self.line_callback is not None:
+            for line in lines:
+                self.line_callback(line)
+
+    def _handle_chunk(self, future):
+        try:
+            data = future.result()
+        except iostream.StreamClosedError as e:
+            self._closed(e)
+            return
+
+        buffer = self._buffer
+        buffer += data
+
+        end = buffer.rfind(b'\n') + 1
+        if end:
+            with memoryview(buffer) as view:
+                lines = bytes(view[:end]).split(b'\n')
+            del buffer[:end]
+            lines.pop()  # Always empty, it's whatever came after the last newline
+            self.handle_lines(lines)
+
+        self._schedule_chunk()
+
+    def _schedule_chunk(self):
+        future = self.connection.read_bytes(self.chunk_size, partial=True)
+        ioloop.IOLoop.current().add_future(future, self._handle_chunk)
 
     def write_function(self, line):
         if line[-1] != '\n':
             line += '\n'
         return self.connection.write(line.encode('utf8'))
 
+    def write_bytes(self, data):
+        """ Writes already encoded and terminated line(s). """
+        return self.connection.write(data)
+
     def start(self):
         loopinstance.start()
 
 
 class IRCClient:
-    def __init__(self, line_stream, server_handler, interface=None):
+    def __init__(self, line_stream, server_handler, interface=None, outbound=None, backoff=None, ping_interval=60,
+                 ping_timeout=180):
+        """
+        Args:
+            outbound (pircel.outbound.OutboundQueue): If given lines to the server go through this for flood control.
+            backoff (pircel.lifecycle.Backoff): Delays between reconnection attempts.
+            ping_interval (float): Seconds between lag checking pings, None to not ping at all.
+            ping_timeout (float): Seconds without a reply to a ping before reconnecting.
+        """
         if interface is not None:
             interface.server_handler = server_handler
 
         # Attach instances
-        server_handler.write_function = line_stream.write_function
+        if outbound is not None:
+            outbound.write_bytes = line_stream.write_bytes
+            server_handler.write_function = outbound.write
+            server_handler.write_bytes = outbound.write
+        else:
+            server_handler.write_function = line_stream.write_function
+            server_handler.write_bytes = line_stream.write_bytes
         line_stream.connect_callback = self.connect_callback
         line_stream.line_callback = server_handler.handle_line
+        line_stream.lines_callback = server_handler.handle_lines
 
         self.line_stream = line_stream
         self.server_handler = server_handler
         self.interface = interface
+        self.outbound = outbound
+        self.backoff = backoff
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.lifecycle = None
+        self._connection_details = None
 
     def connect_callback(self):
         self.server_handler.connect()
+        if self.lifecycle is not None:
+            self.lifecycle.connected()
 
-    def _ping(self):
-        self.server_handler.send_ping(datetime.datetime.utcnow().timestamp())
+    def _connect(self):
+        future = self.line_stream.connect(*self._connection_details)
+        ioloop.IOLoop.current().add_future(future, self._connect_done)
+
+    def _connect_done(self, future):
+        try:
+            future.result()
+        except (OSError, iostream.StreamClosedError) as e:
+            logger.info('Connecting to %s:%s failed: %s', self._connection_details[0], self._connection_details[1], e)
+            self.lifecycle.disconnected(e)
 
     def connect(self, server=None, port=None, insecure=None, channels=None):
+        """ Connects to the server and keeps connecting again whenever the connection is lost.
+
+        Channels are joined (as few JOIN lines as possible) once we're registered, and rejoined along with any others
+        we've joined since whenever we reconnect.
+        """
         # If we have a interface we ignore the above inputs
         if self.interface is not None:
             server, port, secure = self.interface.connection_details
             insecure = not secure
             channels = (channel.name for channel in self.interface.channels if channel.current)
 
-        self.ping_callback = ioloop.PeriodicCallback(self._ping, 60000)
-        self.ping_callback.start()
-
-        # Connect to server
-        self.line_stream.connect(server, port, not insecure)
-
-        # Channel autojoin stuff
-        connected_rpl = 'rpl_welcome'
-
-        def _join_channel(channel):
-            def inner_func(*args, **kwargs):
-                logger.debug('Joining channel: %s', channel)
-                self.server_handler.join(channel)
-                self.server_handler.remove_callback(connected_rpl, inner_func)
-            return inner_func
-
-        # Join channels
-        for channel in channels:
-            self.server_handler.add_callback(connected_rpl, _join_channel(channel), weak=False)
+        self._connection_details = (server, port, not insecure)
+        self.lifecycle = lifecycle.ConnectionLifecycle(
+            self.server_handler, self._connect, ioloop.IOLoop.current().call_later, drop=self.line_stream.close,
+            channels=channels or (), backoff=self.backoff, ping_interval=self.ping_interval,
+            ping_timeout=self.ping_timeout)
+        self.line_stream.disconnect_callback = self.lifecycle.disconnected
+        self.lifecycle.start()
+
+    def close(self):
+        if self.lifecycle is not None:
+            self.lifecycle.close()
+        self.line_stream.close()
 
     @classmethod
     def from_interface(cls, interface):
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pircel.writebehind
+------------------
+
+Write-behind batching for peewee models.
+
+Writing every IRC event to the database as it happens means a transaction (and with SQLite an fsync) per line, all on
+the event loop. A `WriteBehind` queues inserts and updates in memory instead and a background thread writes them out in
+bulk (`insert_many` inside one transaction) whenever enough have built up or they've been waiting long enough.
+
+`select` merges what's queued with what's in the database so readers see their own writes, and the queue is bounded:
+once it's full writers block (or get a `BacklogFullError`) until the background thread catches up.
+
+The background thread uses its own database connection so this won't work with SQLite's `:memory:` databases.
+"""
+import logging
+import threading
+import time
+
+import pircel
+
+logger = logging.getLogger(__name__)
+
+
+class Error(pircel.Error):
+    """ Root exception for write-behind errors. """
+
+
+class BacklogFullError(Error):
+    """ Exception thrown when the queue is full and didn't drain in time. """
+
+
+class WriteBehind:
+    def __init__(self, database, max_batch=1000, max_delay=0.5, max_backlog=50000, timeout=None):
+        """
+        Args:
+            database (peewee.Database): The database the models being written belong to.
+            max_batch (int): Write as soon as this many mutations are queued.
+            max_delay (float): Write mutations that have been queued for this many seconds even if there aren't
+                `max_batch` of them.
+            max_backlog (int): Most mutations that can be queued before writers have to wait.
+            timeout (float): How long writers wait for space in the queue before getting a `BacklogFullError`, None to
+                wait forever.
+        """
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_backlog = max_backlog
+        self.timeout = timeout
+
+        # ('insert', model, row) or ('update', model, values, where), in the order they were made
+        self._queue = []
+        # What the writer thread is currently writing, still visible to readers until it's committed
+        self._writing = []
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._closed = False
+        # Held while a batch is being committed so readers never see a row both in the database and still queued
+        self._commit_lock = threading.Lock()
+
+        # Metrics
+        self.written = 0
+        self.batches = 0
+        self.blocked = 0
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._run, name='pircel-writebehind', daemon=True)
+        self._thread.start()
+
+    # =========================================================================
+    # Writing
+    # =========================================================================
+    def insert(self, model, **row):
+        """ Queues inserting a row (given as field=value keyword arguments) into `model`'s table. """
+        self._enqueue(('insert', model, row))
+
+    def update(self, model, values, **where):
+        """ Queues setting `values` (a field: value dict) on `model`'s rows matching `where` (field=value). """
+        self._enqueue(('update', model, values, where))
+
+    def _enqueue(self, mutation):
+        with self._condition:
+            if self._closed:
+                raise Error('Write-behind queue is closed')
+            if len(self._queue) >= self.max_backlog:
+                self.blocked += 1
+                if not self._condition.wait_for(lambda: len(self._queue) < self.max_backlog or self._closed,
+                                                self.timeout):
+                    raise BacklogFullError('{} mutations waiting to be written'.format(len(self._queue)))
+                # Woken by `close`, the final batch may already have been taken so this would never be written
+                if self._closed:
+                    raise Error('Write-behind queue was closed while waiting for space')
+            self._queue.append(mutation)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._queue) >= self.max_batch:
+                self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ Waits until everything queued so far has been written, returns False if it timed out. """
+        with self._condition:
+            self._oldest = float('-inf')  # make the writer go now
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._queue and not self._writing, timeout)
+
+    def close(self):
+        """ Writes everything that's queued then stops the background thread. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    @property
+    def backlog(self):
+        return len(self._queue) + len(self._writing)
+    # =========================================================================
+
+    # =========================================================================
+    # Reading
+    # =========================================================================
+    def select(self, model, **where):
+        """ Returns all of `model`'s rows matching `where` (field=value), including ones that haven't been written yet.
+
+        Queued inserts come back as unsaved model instances and queued updates are applied to the results.
+        """
+        with self._commit_lock:
+            with self._condition:
+                pending = [mutation for mutation in self._writing + self._queue if mutation[1] is model]
+
+            # Rows could match only because of a queued update so don't filter the database on anything those change
+            updated_fields = {field for mutation in pending if mutation[0] == 'update' for field in mutation[2]}
+            query = model.select()
+            for field, value in where.items():
+                if field not in updated_fields:
+                    query = query.where(getattr(model, field) == value)
+            results = list(query)
+
+        for mutation in pending:
+            if mutation[0] == 'insert':
+                results.append(model(**mutation[2]))
+            else:
+                _, _, values, update_where = mutation
+                for instance in results:
+                    if all(getattr(instance, field) == value for field, value in update_where.items()):
+                        for field, value in values.items():
+                            setattr(instance, field, value)
+
+        return [instance for instance in results
+                if all(getattr(instance, field) == value for field, value in where.items())]
+    # =========================================================================
+
+    # =========================================================================
+    # Background thread
+    # =========================================================================
+    def _due(self):
+        if self._closed or len(self._queue) >= self.max_batch:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.max_delay
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._due():
+                    timeout = None if self._oldest is None else self._oldest + self.max_delay - time.monotonic()
+                    self._condition.wait(timeout)
+                if not self._queue:
+                    if self._closed:
+                        break
+                    self._oldest = None
+                    continue
+                self._writing, self._queue = self._queue, []
+                self._oldest = None
+                # There's room in the queue again
+                self._condition.notify_all()
+
+            with self._commit_lock:
+                try:
+                    self._write(self._writing)
+                except Exception:
+                    self.dropped += len(self._writing)
+                    logger.exception('Writing %s queued mutations failed, they have been dropped (%s so far)',
+                                     len(self._writing), self.dropped)
+
+                with self._condition:
+                    self._writing = []
+                    self._condition.notify_all()
+
+        self.database.close()
+
+    def _write(self, mutations):
+        with self.database.atomic():
+            for group in _group_inserts(mutations):
+                if group[0] == 'insert':
+                    _, model, rows = group
+                    for start in range(0, len(rows), self.max_batch):
+                        model.insert_many(rows[start:start + self.max_batch]).execute()
+                else:
+                    _, model, values, where = group
+                    query = model.update(**values)
+                    for field, value in where.items():
+                        query = query.where(getattr(model, field) == value)
+                    query.execute()
+        self.written += len(mutations)
+        self.batches += 1
+    # =========================================================================
+
+
+def _group_inserts(mutations):
+    """ Merges runs of inserts into the same table (with the same fields) into one, keeping everything in order. """
+    groups = []
+    for mutation in mutations:
+        if mutation[0] == 'insert':
+            _, model, row = mutation
+            previous = groups[-1] if groups else None
+            same_table = previous is not None and previous[0] == 'insert' and previous[1] is model
+            if same_table and previous[2][0].keys() == row.keys():
+                previous[2].append(row)
+            else:
+                groups.append(('insert', model, [row]))
+        else:
+            groups.append(mutation)
+    return groups
@@ -12,6 +12,10 @@ install_requires = [
     'blinker>=1.4',
 ]
 
+extras_require = {
+    'analysis': ['numpy'],
+}
+
 classifiers = [
     'Development Status :: 2 - Pre-Alpha',
     'Topic :: Communications :: Chat :: Internet Relay Chat',
@@ -40,5 +44,6 @@ setup(
     py_modules=[],
     zip_safe=False,
     install_requires=install_requires,
+    extras_require=extras_require,
     package_data={},
 )
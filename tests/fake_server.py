@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+A very small in-process IRC server for testing the adapters against.
+
+It registers clients (replying to NICK/USER with RPL_WELCOME, once any CAP negotiation is over), negotiates IRCv3
+capabilities, answers PINGs, records every line it receives and lets tests push arbitrary lines to connected clients.
+"""
+import asyncio
+
+
+class FakeClientConnection:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.nick = None
+        self.received = []
+        self.caps = set()
+        self._negotiating = False
+        self._user_received = False
+
+    def send(self, line):
+        self.writer.write(line.encode('utf8') + b'\r\n')
+
+    async def run(self):
+        while True:
+            try:
+                line = await self.reader.readline()
+            except (asyncio.CancelledError, ConnectionError):
+                break
+            if not line:
+                break
+            line = line.decode('utf8').rstrip('\r\n')
+            self.received.append(line)
+            self.server.received.append(line)
+            self.handle(line)
+            self.server.line_received.set()
+        self.server.clients.remove(self)
+
+    def welcome(self):
+        self.send(':fake.server 001 {} :Welcome to the fake network'.format(self.nick))
+
+    def handle_cap(self, rest):
+        subcommand, _, rest = rest.partition(' ')
+        if subcommand == 'LS':
+            self._negotiating = True
+            # Split over two lines like a server with lots of capabilities would
+            caps = sorted(self.server.caps)
+            half = len(caps) // 2
+            self.send(':fake.server CAP * LS * :{}'.format(' '.join(caps[:half])))
+            self.send(':fake.server CAP * LS :{}'.format(' '.join(caps[half:])))
+        elif subcommand == 'REQ':
+            requested = rest.lstrip(':').split()
+            if all(cap in self.server.caps for cap in requested):
+                self.caps.update(requested)
+                self.send(':fake.server CAP * ACK :{}'.format(' '.join(requested)))
+            else:
+                self.send(':fake.server CAP * NAK :{}'.format(' '.join(requested)))
+        elif subcommand == 'END':
+            self._negotiating = False
+            if self._user_received:
+                self.welcome()
+
+    def handle(self, line):
+        command, _, rest = line.partition(' ')
+        if command == 'NICK':
+            self.nick = rest
+        elif command == 'USER':
+            self._user_received = True
+            if not self._negotiating:
+                self.welcome()
+        elif command == 'CAP':
+            self.handle_cap(rest)
+        elif command == 'PING':
+            self.send(':fake.server PONG fake.server :{}'.format(rest.lstrip(':')))
+        elif command == 'JOIN':
+            for channel in rest.split(' ')[0].split(','):
+                self.send(':{0}!~{0}@localhost JOIN {1}'.format(self.nick, channel))
+        responder = self.server.responders.get(command)
+        if responder is not None:
+            for response in responder(self, line):
+                self.send(response)
+
+
+class FakeIRCServer:
+    def __init__(self, caps=('batch', 'multi-prefix', 'server-time', 'userhost-in-names', 'sasl')):
+        self.caps = set(caps)
+        self.clients = []
+        self.received = []
+        self.responders = {}
+        self.line_received = asyncio.Event()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._client_connected, '127.0.0.1', 0, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        for client in list(self.clients):
+            client.writer.close()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _client_connected(self, reader, writer):
+        client = FakeClientConnection(self, reader, writer)
+        self.clients.append(client)
+        await client.run()
+
+    def send_all(self, line):
+        for client in self.clients:
+            client.send(line)
+
+    async def wait_for(self, predicate, timeout=5):
+        """ Waits until `predicate(received_lines)` is true. """
+        async def wait():
+            while not predicate(self.received):
+                self.line_received.clear()
+                await self.line_received.wait()
+        await asyncio.wait_for(wait(), timeout)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+
+from pircel import analysis
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = [
+    b'@time=2024-01-01T00:00:00.000Z :Alice!a@h JOIN #Chan\r\n',
+    b'@time=2024-01-01T00:00:10.000Z :alice!a@h PRIVMSG #chan :hello there\r\n',
+    b'@time=2024-01-01T00:00:20.000Z :Bob!b@h PRIVMSG #chan :hi\r\n',
+    b'@time=2024-01-02T00:00:00.000Z :Bob!b@h PRIVMSG #other :elsewhere\r\n',
+    b'@time=2024-01-02T00:00:05.000Z :alice!a@h PRIVMSG bob :private\r\n',
+    b'@time=2024-01-02T00:00:30.000Z :Bob!b@h QUIT :bye\r\n',
+    b'PING :server\r\n',
+    b'\r\n',
+]
+
+
+class TestColumns(unittest.TestCase):
+    def setUp(self):
+        self.columns = analysis.from_lines(log)
+
+    def test_columns(self):
+        columns = self.columns
+        self.assertEqual(len(columns), 7)
+        self.assertEqual(columns.malformed, 1)
+        self.assertEqual(columns.timestamps[0], 1704067200.0)
+        self.assertNotEqual(columns.timestamps[-1], columns.timestamps[-1])  # NaN, PING has no time tag
+
+        self.assertListEqual(list(columns.nicks), [0, 0, 1, 1, 0, 1, -1])
+        self.assertListEqual(columns.nick_names, [b'alice', b'bob'])
+        self.assertListEqual(list(columns.channels), [0, 0, 0, 1, -1, -1, -1])
+        self.assertEqual(columns.command_names[columns.commands[1]], b'PRIVMSG')
+        self.assertEqual(columns.line_text(1), b'hello there')
+        self.assertEqual(columns.line_text(0), b'')
+        self.assertEqual(columns.line_text(3), b'elsewhere')
+        self.assertEqual(columns.channel_id('#CHAN'), 0)
+
+    def test_timestamped(self):
+        columns = analysis.from_lines([b'1700000000.5 :n!u@h PRIVMSG #c :x', b'junk :n!u@h PRIVMSG #c :y'],
+                                      timestamped=True)
+        self.assertEqual(columns.timestamps[0], 1700000000.5)
+        self.assertEqual(columns.line_text(1), b'y')
+
+    def test_read_file(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as log_file:
+            log_file.write(b''.join(log * 20))
+
+        whole = analysis.read_file(path)
+        chunked = analysis.read_file(path, processes=2, chunk_size=300)
+        self.assertEqual(len(whole), 140)
+        for columns in (whole, chunked):
+            self.assertListEqual(columns.nick_names, [b'alice', b'bob'])
+            self.assertListEqual(list(columns.nicks), list(self.columns.nicks) * 20)
+            self.assertListEqual(list(columns.channels), list(self.columns.channels) * 20)
+            self.assertEqual(columns.text, self.columns.text * 20)
+            self.assertEqual(columns.line_text(71), b'hello there')
+            self.assertEqual(columns.malformed, 20)
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestAggregations(unittest.TestCase):
+    def setUp(self):
+        self.columns = analysis.from_lines(log)
+
+    def test_channel_activity(self):
+        self.assertListEqual(analysis.channel_activity(self.columns), [('#chan', 2), ('#other', 1)])
+        self.assertListEqual(analysis.channel_activity(self.columns, limit=1), [('#chan', 2)])
+
+    def test_top_talkers(self):
+        self.assertListEqual(analysis.top_talkers(self.columns), [('alice', 2), ('bob', 2)])
+        self.assertListEqual(analysis.top_talkers(self.columns, channel='#chan'), [('alice', 1), ('bob', 1)])
+
+    def test_unknown_channel(self):
+        # The private message has no channel, it mustn't count as being in one that isn't in the log
+        self.assertListEqual(analysis.top_talkers(self.columns, channel='#nonexistent'), [])
+        starts, counts = analysis.activity_over_time(self.columns, channel='#nonexistent')
+        self.assertEqual(len(counts), 0)
+        starts, joins, leaves = analysis.nick_churn(self.columns, channel='#nonexistent')
+        self.assertEqual((len(joins), len(leaves)), (0, 0))
+
+    def test_over_time(self):
+        starts, counts = analysis.activity_over_time(self.columns)
+        self.assertListEqual(list(starts), [1704067200.0, 1704153600.0])
+        self.assertListEqual(list(counts), [2, 2])
+
+        starts, joins, leaves = analysis.nick_churn(self.columns, channel='#chan')
+        self.assertListEqual(list(joins), [1, 0])
+        self.assertListEqual(list(leaves), [0, 1])
+
+    def test_churn_quits(self):
+        columns = analysis.from_lines(log + [
+            b'@time=2024-01-02T00:01:00.000Z :carol!c@h PRIVMSG #other :never in #chan\r\n',
+            b'@time=2024-01-02T00:02:00.000Z :carol!c@h QUIT :bye\r\n',
+            b'@time=2024-01-02T00:03:00.000Z :dave!d@h QUIT :quit before joining\r\n',
+            b'@time=2024-01-02T00:04:00.000Z :dave!d@h JOIN #chan\r\n',
+        ])
+        starts, joins, leaves = analysis.nick_churn(columns, channel='#chan')
+        self.assertListEqual(list(joins), [1, 1])
+        self.assertListEqual(list(leaves), [0, 1])  # only bob's
+        starts, joins, leaves = analysis.nick_churn(columns, channel='#other')
+        self.assertListEqual(list(leaves), [2])  # bob's and carol's
+
+    def test_parse_time_tag(self):
+        self.assertEqual(analysis.parse_time_tag('2024-01-01T00:00:00.000Z'), 1704067200.0)
+        self.assertEqual(analysis.parse_time_tag('2024-01-01T01:00:00+01:00'), 1704067200.0)
+        self.assertNotEqual(analysis.parse_time_tag('yesterday'), analysis.parse_time_tag('yesterday'))
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
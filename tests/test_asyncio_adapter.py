@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+from unittest import mock
+
+from pircel import asyncio_adapter, protocol
+
+from tests import fake_server
+
+
+class TestIRCClient(unittest.IsolatedAsyncioTestCase):
+    nick = 'pircel'
+
+    async def asyncSetUp(self):  # noqa
+        self.server = await fake_server.FakeIRCServer().start()
+
+        identity = mock.MagicMock()
+        identity.nick = self.nick
+        identity.username = 'pircel'
+        identity.realname = 'Percy Wendel'
+        self.server_handler = protocol.IRCServerHandler(identity)
+        self.client = asyncio_adapter.IRCClient(asyncio_adapter.LineStream(), self.server_handler, ping_interval=None)
+
+    async def asyncTearDown(self):  # noqa
+        self.client.close()
+        await self.server.stop()
+
+    async def test_connect_and_autojoin(self):
+        await self.client.connect('127.0.0.1', self.server.port, insecure=True, channels=['#a', '#b'])
+        await self.server.wait_for(lambda lines: 'JOIN #a,#b' in lines)
+
+        self.assertListEqual(self.server.received[:3], ['CAP LS 302', 'NICK pircel', 'USER pircel 0 * :Percy Wendel'])
+
+    async def test_caps(self):
+        welcomed = asyncio.Event()
+        self.server_handler.add_callback('rpl_welcome', lambda sender, **kwargs: welcomed.set(), weak=False)
+        await self.client.connect('127.0.0.1', self.server.port, insecure=True)
+        await asyncio.wait_for(welcomed.wait(), 5)
+
+        self.assertSetEqual(self.server_handler.caps, {'batch', 'multi-prefix', 'server-time', 'userhost-in-names'})
+        self.assertSetEqual(self.server.clients[0].caps, self.server_handler.caps)
+        self.assertIn('sasl', self.server_handler.available_caps)
+
+    async def test_pong(self):
+        await self.client.connect('127.0.0.1', self.server.port, insecure=True)
+        await self.server.wait_for(lambda lines: 'USER pircel 0 * :Percy Wendel' in lines)
+
+        self.server.send_all('PING :12345')
+        await self.server.wait_for(lambda lines: 'PONG :12345' in lines)
+
+    async def test_lines_split_across_reads(self):
+        received = []
+        self.server_handler.add_callback('privmsg', lambda sender, prefix, args: received.append(args), weak=False)
+        await self.client.connect('127.0.0.1', self.server.port, insecure=True)
+        await self.server.wait_for(lambda lines: 'CAP END' in lines)
+
+        client = self.server.clients[0]
+        client.writer.write(b':n!u@h PRIVMSG #c :one\r\n:n!u@h PRIV')
+        await client.writer.drain()
+        await asyncio.sleep(0.05)
+        client.writer.write(b'MSG #c :two\r\n')
+        await client.writer.drain()
+
+        for _ in range(100):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        self.assertListEqual(received, [['#c', 'one'], ['#c', 'two']])
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from pircel import commands, protocol
+
+
+class TestTables(unittest.TestCase):
+    def test_consistent(self):
+        pairs = commands.rfc2812 + commands.ircd_extensions + commands.ircv3
+        self.assertEqual(len(commands.registry), len(pairs))
+        self.assertEqual(len(commands.registry.symbolic_to_numeric), len(pairs))
+        for name, numeric in pairs:
+            self.assertEqual(name, name.upper())
+            self.assertTrue(len(numeric) == 3 and numeric.isdecimal(), numeric)
+            self.assertEqual(commands.registry.symbolic(numeric), name)
+            self.assertEqual(commands.registry.numeric(name), numeric)
+
+    def test_adminloc(self):
+        self.assertEqual(protocol.get_symbolic_command('257'), 'RPL_ADMINLOC1')
+        self.assertEqual(protocol.get_symbolic_command('258'), 'RPL_ADMINLOC2')
+        self.assertEqual(commands.registry.RPL_WELCOME, '001')
+        self.assertEqual(protocol.get_symbolic_command('492'), 'ERR_NOSERVICEHOST')
+
+        # The old name still works, for the numeric it used to end up as
+        self.assertEqual(commands.registry.numeric('rpl_adminloc'), '258')
+        self.assertEqual(commands.registry.RPL_ADMINLOC, '258')
+        server_handler = protocol.IRCServerHandler(mock.MagicMock())
+        calls = []
+
+        def callback(sender, prefix, args):
+            calls.append(args[-1])
+
+        server_handler.add_callback('rpl_adminloc', callback, weak=False)
+        server_handler.handle_line(':server 258 pircel :Somewhere')
+        server_handler.remove_callback('rpl_adminloc', callback)
+        server_handler.handle_line(':server 258 pircel :Elsewhere')
+        self.assertListEqual(calls, ['Somewhere'])
+
+    def test_chardet_not_imported(self):
+        code = 'import sys, pircel.protocol; sys.exit("chardet" in sys.modules)'
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = commands.CommandRegistry(commands.rfc2812)
+
+    def test_register(self):
+        self.registry.register('rpl_extension', 999)
+        self.assertEqual(self.registry.symbolic('999'), 'RPL_EXTENSION')
+        self.assertEqual(self.registry.numeric('rpl_extension'), '999')
+        self.assertIn('999', self.registry)
+        self.assertIn('RPL_EXTENSION', self.registry)
+
+        self.registry.unregister('RPL_EXTENSION')
+        self.assertNotIn('999', self.registry)
+        with self.assertRaises(AttributeError):
+            self.registry.RPL_EXTENSION
+
+    def test_duplicates(self):
+        self.registry.register('RPL_WELCOME', '001')
+        with self.assertRaises(commands.DuplicateCommandError):
+            self.registry.register('RPL_HELLO', '001')
+        with self.assertRaises(commands.DuplicateCommandError):
+            self.registry.register('RPL_WELCOME', '999')
+        with self.assertRaises(ValueError):
+            self.registry.register('RPL_BAD', '1')
+
+        self.registry.register('RPL_HELLO', '001', replace=True)
+        self.assertEqual(self.registry.symbolic('001'), 'RPL_HELLO')
+        self.assertNotIn('RPL_WELCOME', self.registry)
+
+    def test_dispatch(self):
+        commands.register('RPL_TESTEXTENSION', 998)
+        self.addCleanup(commands.registry.unregister, 'RPL_TESTEXTENSION')
+
+        server_handler = protocol.IRCServerHandler(mock.MagicMock())
+        callback = mock.MagicMock()
+        server_handler.add_callback('rpl_testextension', callback)
+        server_handler.handle_line(b':server 998 nick :hello')
+        callback.assert_called_once_with(server_handler, prefix='server', args=['nick', 'hello'])
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
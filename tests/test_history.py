@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from pircel import history, protocol
+
+
+class TestHistoryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = history.HistoryCache(capacity=5, clock=lambda: 1.0)
+
+    def test_ring(self):
+        for i in range(8):
+            self.cache.append('privmsg', '#Chan', 'n!u@h', 'line {}'.format(i), timestamp=float(i))
+
+        view = self.cache.recent('#chan')
+        self.assertEqual(len(view), 5)
+        self.assertListEqual([line.text for line in view], ['line {}'.format(i) for i in range(3, 8)])
+        self.assertEqual(view[-1], (7.0, 'privmsg', '#Chan', 'n!u@h', 'line 7'))
+        self.assertListEqual([line.text for line in reversed(view)][:2], ['line 7', 'line 6'])
+
+        self.assertListEqual([line.text for line in self.cache.recent('#CHAN', 2)], ['line 6', 'line 7'])
+        self.assertListEqual([line.text for line in view[1:3]], ['line 4', 'line 5'])
+        self.assertListEqual(list(self.cache.recent('#nowhere')), [])
+
+    def test_view_not_copied(self):
+        for i in range(5):
+            self.cache.append('privmsg', '#c', 'n!u@h', str(i))
+        view = self.cache.recent('#c', 3)
+        # Overwrites the oldest two in the ring, the first of which is in the view
+        self.cache.append('notice', '#c', 'n!u@h', '5')
+        self.cache.append('notice', '#c', 'n!u@h', '6')
+
+        self.assertListEqual([line.text for line in view], ['2', '3', '4'])
+        self.cache.append('notice', '#c', 'n!u@h', '7')
+        self.assertListEqual([line.text for line in view], ['3', '4'])
+        # What's been overwritten drops out of the view altogether
+        self.assertEqual(len(view), 2)
+        self.assertEqual(view[0].text, '3')
+        self.assertListEqual([line.text for line in view[1:]], ['4'])
+        with self.assertRaises(IndexError):
+            view[2]
+
+    def test_eviction(self):
+        cache = history.HistoryCache(capacity=10, max_bytes=50000)
+        for i in range(100):
+            cache.append('privmsg', '#chan{}'.format(i), 'n!u@h', 'x' * 100)
+            cache.recent('#chan0')
+
+        self.assertLessEqual(cache.size, 50000)
+        self.assertIn('#chan0', cache)
+        self.assertIn('#chan99', cache)
+        self.assertNotIn('#chan1', cache)
+        self.assertEqual(cache.evicted, 100 - len(cache))
+
+        cache.forget('#chan0')
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+
+    def test_attach(self):
+        identity = mock.MagicMock()
+        identity.nick = 'me'
+        server_handler = protocol.IRCServerHandler(identity)
+        self.cache.attach(server_handler)
+        self.addCleanup(self.cache.detach)
+
+        server_handler.handle_lines([':n!u@h PRIVMSG #c :hi', ':n!u@h PRIVMSG me :psst', ':n!u@h NOTICE #c :note'])
+        self.assertListEqual([(line.kind, line.text) for line in self.cache.recent('#c')],
+                             [('privmsg', 'hi'), ('notice', 'note')])
+        self.assertListEqual([line.text for line in self.cache.recent('n')], ['psst'])
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
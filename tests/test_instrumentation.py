@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from pircel import instrumentation, protocol
+
+
+class FakeClock:
+    """ Moves on a microsecond every time it's read. """
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1000
+        return self.now
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = instrumentation.Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        self.assertEqual(histogram.count, 100000)
+        self.assertEqual(histogram.max, 100000)
+        self.assertAlmostEqual(histogram.percentile(0.5), 50000, delta=50000 / 16)
+        self.assertAlmostEqual(histogram.percentile(0.99), 99000, delta=99000 / 16)
+        self.assertEqual(histogram.percentile(1), 100000)
+        # Small values are exact
+        self.assertEqual(histogram.count_below(10), 10)
+
+    def test_empty(self):
+        self.assertEqual(instrumentation.Histogram().percentile(0.99), 0)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.instrumentation = instrumentation.Instrumentation(slow_threshold=0.01, clock=self.clock)
+        self.server_handler = protocol.IRCServerHandler(mock.MagicMock())
+        self.server_handler.write_function = mock.MagicMock()
+        self.server_handler.log_unhandled = mock.MagicMock()
+        self.server_handler.instrumentation = self.instrumentation
+
+    def test_counts_and_phases(self):
+        callback = mock.MagicMock()
+        self.server_handler.add_callback('wallops', callback)
+        self.server_handler.handle_lines([b':n!u@h WALLOPS :one', ':n!u@h WALLOPS :two', b'PING :x'])
+
+        self.assertEqual(callback.call_count, 2)
+        callback.assert_called_with(self.server_handler, prefix='n!u@h', args=['two'])
+        snapshot = self.instrumentation.snapshot()
+        self.assertDictEqual(snapshot['commands'], {'WALLOPS': 2, 'PING': 1})
+        self.assertEqual(snapshot['phases']['parse']['count'], 3)
+        self.assertEqual(snapshot['phases']['decode']['count'], 2)
+        self.assertEqual(snapshot['phases']['handler']['count'], 1)
+        self.assertEqual(snapshot['phases']['receivers']['count'], 2)
+
+    def test_slow_receiver(self):
+        def slow_receiver(sender, **kwargs):
+            self.clock.now += 20 * 10 ** 6
+        self.server_handler.add_callback('wallops', slow_receiver)
+
+        with self.assertLogs('pircel.instrumentation', 'WARNING') as logs:
+            self.server_handler.handle_line(':n!u@h WALLOPS :hi')
+        self.assertIn('slow_receiver', logs.records[0].getMessage())
+        self.assertEqual(list(self.instrumentation.slow.values()), [1])
+
+    def test_gauges_and_prometheus(self):
+        outbound = mock.MagicMock(depth=7)
+        self.instrumentation.watch_outbound(outbound)
+        self.server_handler.handle_line(':n!u@h PRIVMSG #c :hi')
+
+        self.assertEqual(self.instrumentation.snapshot()['gauges'], {'outbound_queue_depth': 7})
+        exposition = self.instrumentation.prometheus().splitlines()
+        self.assertIn('pircel_lines_total{command="PRIVMSG"} 1', exposition)
+        self.assertIn('pircel_phase_seconds_count{phase="parse"} 1', exposition)
+        self.assertIn('pircel_phase_seconds_bucket{phase="parse",le="+Inf"} 1', exposition)
+        self.assertIn('pircel_outbound_queue_depth 7', exposition)
+
+    def test_detach(self):
+        self.server_handler.instrumentation = None
+        self.server_handler.handle_line(':n!u@h PRIVMSG #c :hi')
+        self.assertDictEqual(self.instrumentation.snapshot()['commands'], {})
+        self.assertNotIn('handle_line', vars(self.server_handler))
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from pircel import isupport, queries, state
+
+from tests.test_lifecycle import FakeLoop, make_server_handler
+
+isupport_lines = [
+    ':server 005 pircel CASEMAPPING=ascii PREFIX=(qaohv)~&@%+ CHANMODES=beI,k,l,imnpst CHANTYPES=#& '
+    'NETWORK=Test\\x20Net :are supported by this server',
+    ':server 005 pircel TARGMAX=NAMES:1,JOIN:2,WHOIS:3,PRIVMSG:4,NOTICE: LINELEN=1024 MODES '
+    ':are supported by this server',
+]
+
+
+class TestServerCapabilities(unittest.TestCase):
+    def test_defaults(self):
+        capabilities = isupport.default_capabilities
+        self.assertEqual(capabilities.casemapping, 'rfc1459')
+        self.assertEqual(capabilities.fold('[Foo]'), '{foo}')
+        self.assertEqual((capabilities.prefix_modes, capabilities.prefix_symbols), ('ov', '@+'))
+        self.assertEqual(capabilities.linelen, 512)
+        self.assertEqual(capabilities.max_targets('WHOIS'), 1)
+        self.assertIsNone(capabilities.max_targets('JOIN', default=None))
+        self.assertTrue(capabilities.is_channel('#chan'))
+        self.assertFalse(capabilities.is_channel('nick'))
+
+    def test_tokens(self):
+        tokens = {}
+        isupport.update_tokens(tokens, ['PREFIX=(qaohv)~&@%+', 'CHANMODES=beI,k,l,imnpst', 'TARGMAX=WHOIS:3,NOTICE:',
+                                        'MAXTARGETS=5', 'NETWORK=Test\\x20Net', 'EXCEPTS', 'CASEMAPPING=ascii'])
+        isupport.update_tokens(tokens, ['-EXCEPTS'])
+        capabilities = isupport.ServerCapabilities.from_tokens(tokens)
+
+        self.assertEqual(capabilities.network, 'Test Net')
+        self.assertNotIn('EXCEPTS', capabilities.tokens)
+        self.assertEqual(capabilities.fold('[Foo]'), '[foo]')
+        self.assertEqual(capabilities.symbol_to_mode['%'], 'h')
+        self.assertEqual(capabilities.mode_to_symbol['q'], '~')
+        self.assertSetEqual(capabilities.list_modes, set('beI'))
+        self.assertSetEqual(capabilities.parameter_modes, set('beIkqaohv'))
+        self.assertSetEqual(capabilities.set_parameter_modes, {'l'})
+        self.assertEqual(capabilities.max_targets('whois'), 3)
+        self.assertIsNone(capabilities.max_targets('NOTICE'))
+        self.assertEqual(capabilities.max_targets('PRIVMSG'), 5)
+        with self.assertRaises(AttributeError):
+            capabilities.linelen = 1
+
+
+class TestServerHandler(unittest.TestCase):
+    def setUp(self):
+        self.server_handler = make_server_handler()
+        self.tracker = state.StateTracker(self.server_handler)
+
+    def test_lazy(self):
+        self.assertIs(self.server_handler.capabilities, isupport.default_capabilities)
+        self.server_handler.handle_lines(isupport_lines)
+        capabilities = self.server_handler.capabilities
+        self.assertIs(self.server_handler.capabilities, capabilities)
+        self.assertEqual(capabilities.network, 'Test Net')
+        self.assertIsNone(capabilities.modes)
+        self.assertEqual(self.server_handler.max_line_bytes, 1024)
+
+        self.server_handler.disconnected()
+        self.assertIs(self.server_handler.capabilities, isupport.default_capabilities)
+
+    def test_targets(self):
+        self.server_handler.handle_lines(isupport_lines)
+        self.server_handler.join_channels(['#a', '#b', '#c'])
+        self.server_handler.send_message(['#a', 'b', 'c', 'd', 'e'], 'hi')
+        self.server_handler.send_notice(['#a', 'b', 'c', 'd', 'e'], 'hi')
+        self.assertListEqual(self.server_handler.output, [
+            'JOIN #a,#b', 'JOIN #c', 'PRIVMSG #a,b,c,d :hi', 'PRIVMSG e :hi', 'NOTICE #a,b,c,d,e :hi'
+        ])
+
+    def test_single_targets(self):
+        output = []
+        self.server_handler.write_bytes = output.append
+        # bytes is a single target, not a sequence of them
+        self.server_handler.send_message(b'#chan', 'hi')
+        self.server_handler.send_message([], 'hi')
+        self.server_handler.send_notice(set(), 'hi')
+        self.assertListEqual(output, [b'PRIVMSG #chan :hi\r\n'])
+
+    def test_state(self):
+        self.server_handler.handle_lines(isupport_lines + [
+            ':pircel!~pircel@localhost JOIN #Chan',
+            ':server 353 pircel = #Chan :pircel ~Owner %Half [x]',
+        ])
+        self.assertEqual(self.tracker.modes_in('owner', '#chan'), 'q')
+        self.assertEqual(self.tracker.modes_in('half', '#CHAN'), 'h')
+        # ascii casemapping, so [ and { aren't the same
+        self.assertIsNone(self.tracker.get_user('{x}'))
+        self.assertIsNotNone(self.tracker.get_user('[X]'))
+
+    def test_queries(self):
+        loop = FakeLoop()
+        query_manager = queries.QueryManager(self.server_handler, loop.call_later, clock=loop.clock)
+        self.addCleanup(query_manager.close)
+        self.server_handler.handle_lines(isupport_lines)
+        for nick in ('a', 'b', 'c', 'd'):
+            query_manager.whois(nick)
+        query_manager.names('#a')
+        query_manager.names('#b')
+        loop.advance(0)
+        self.assertListEqual(self.server_handler.output, ['WHOIS a,b,c', 'WHOIS d', 'NAMES #a', 'NAMES #b'])
+
+    def test_created_later(self):
+        # e.g. loaded by a plugin after we've connected, the server won't send 005 again
+        self.server_handler.handle_lines(isupport_lines)
+        tracker = state.StateTracker(self.server_handler)
+        self.server_handler.handle_lines([
+            ':pircel!~pircel@localhost JOIN #Chan',
+            ':server 353 pircel = #Chan :pircel ~Owner %Half [x]',
+        ])
+        self.assertEqual(tracker.modes_in('owner', '#chan'), 'q')
+        self.assertEqual(tracker.modes_in('half', '#chan'), 'h')
+        self.assertIsNone(tracker.get_user('{x}'))
+
+        loop = FakeLoop()
+        query_manager = queries.QueryManager(self.server_handler, loop.call_later, clock=loop.clock)
+        self.addCleanup(query_manager.close)
+        for nick in ('a', 'b', 'c', 'd'):
+            query_manager.whois(nick)
+        loop.advance(0)
+        self.assertListEqual(self.server_handler.output, ['WHOIS a,b,c', 'WHOIS d'])
+        self.assertEqual(query_manager.prefix_symbols, '~&@%+')
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
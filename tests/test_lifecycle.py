@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from pircel import lifecycle, protocol, state
+
+
+class FakeLoop:
+    """ Stands in for an event loop's `call_later` and clock, `advance` runs whatever's due. """
+    def __init__(self):
+        self.now = 0.0
+        self.scheduled = []
+
+    def call_later(self, delay, callback):
+        self.scheduled.append((self.now + delay, callback))
+
+    def clock(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+        due = [entry for entry in self.scheduled if entry[0] <= self.now]
+        self.scheduled = [entry for entry in self.scheduled if entry[0] > self.now]
+        for _, callback in sorted(due, key=lambda entry: entry[0]):
+            callback()
+
+
+def make_server_handler():
+    identity = mock.MagicMock()
+    identity.nick = 'pircel'
+    server_handler = protocol.IRCServerHandler(identity)
+    server_handler.output = []
+    server_handler.write_function = server_handler.output.append
+    return server_handler
+
+
+class TestBackoff(unittest.TestCase):
+    def test_delay(self):
+        backoff = lifecycle.Backoff(base=1, maximum=60, jitter=0)
+        self.assertListEqual([backoff.delay(attempt) for attempt in range(8)], [1, 2, 4, 8, 16, 32, 60, 60])
+        self.assertEqual(backoff.delay(10 ** 6), 60)
+
+    def test_jitter(self):
+        backoff = lifecycle.Backoff(base=1, maximum=60, random=lambda: 0.5)
+        self.assertEqual(backoff.delay(3), 4)
+        backoff = lifecycle.Backoff(base=1, maximum=60, jitter=0.5, random=lambda: 0.5)
+        self.assertEqual(backoff.delay(3), 6)
+
+
+class TestLagMonitor(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeLoop()
+        self.server_handler = make_server_handler()
+        self.dead = mock.MagicMock()
+        self.monitor = lifecycle.LagMonitor(self.server_handler, self.loop.call_later, interval=10, timeout=30,
+                                            dead_callback=self.dead, clock=self.loop.clock)
+
+    def test_lag(self):
+        self.monitor.start()
+        self.loop.advance(10)
+        self.assertListEqual(self.server_handler.output, ['PING lag0'])
+
+        self.loop.now += 0.25
+        self.server_handler.handle_line(':srv PONG srv :lag0')
+        self.assertEqual(self.monitor.lag, 0.25)
+
+        self.loop.advance(10)
+        self.assertListEqual(self.server_handler.output, ['PING lag0', 'PING lag1'])
+        self.dead.assert_not_called()
+
+    def test_dead(self):
+        self.monitor.start()
+        self.loop.advance(10)
+        for _ in range(3):
+            self.loop.advance(10)
+        self.dead.assert_not_called()
+        self.loop.advance(10)
+        self.dead.assert_called_once_with()
+        self.assertListEqual(self.server_handler.output, ['PING lag0'])
+
+    def test_stop(self):
+        self.monitor.start()
+        self.monitor.stop()
+        self.loop.advance(100)
+        self.assertListEqual(self.server_handler.output, [])
+
+
+class TestConnectionLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeLoop()
+        self.server_handler = make_server_handler()
+        self.tracker = state.StateTracker(self.server_handler)
+        self.connect = mock.MagicMock()
+        self.drop = mock.MagicMock()
+        self.lifecycle = lifecycle.ConnectionLifecycle(
+            self.server_handler, self.connect, self.loop.call_later, drop=self.drop,
+            channels={'#a': None, '#secret': 'key'}, backoff=lifecycle.Backoff(base=1, jitter=0), ping_interval=10,
+            ping_timeout=30, clock=self.loop.clock)
+
+    def register(self):
+        self.lifecycle.connected()
+        self.server_handler.handle_line(':srv 001 pircel :Welcome')
+
+    def test_join_and_rejoin(self):
+        self.lifecycle.start()
+        self.connect.assert_called_once_with()
+        self.register()
+        self.assertEqual(self.lifecycle.state, 'connected')
+        self.assertListEqual(self.server_handler.output, ['JOIN #secret,#a key'])
+
+        self.server_handler.handle_lines([':pircel!u@h JOIN #a', ':pircel!u@h JOIN #secret', ':pircel!u@h JOIN #new',
+                                          ':pircel!u@h PART #a', ':op!u@h KICK #new pircel :bye'])
+        self.assertIn('#secret', self.tracker.channels)
+
+        self.lifecycle.disconnected(ConnectionResetError())
+        self.assertEqual(self.lifecycle.state, 'disconnected')
+        self.assertDictEqual(self.tracker.channels, {})
+        self.loop.advance(0.5)
+        self.assertEqual(self.connect.call_count, 1)
+        self.loop.advance(0.5)
+        self.assertEqual(self.connect.call_count, 2)
+
+        del self.server_handler.output[:]
+        self.register()
+        self.assertListEqual(self.server_handler.output, ['JOIN #secret key'])
+        self.assertEqual(self.lifecycle.attempts, 0)
+        self.assertEqual(self.lifecycle.reconnects, 1)
+
+    def test_backoff(self):
+        self.lifecycle.start()
+        for expected in (1, 2, 4):
+            self.lifecycle.disconnected(ConnectionRefusedError())
+            self.assertEqual(self.loop.scheduled[-1][0] - self.loop.now, expected)
+            self.loop.advance(expected)
+        self.assertEqual(self.connect.call_count, 4)
+
+    def test_dead_link(self):
+        self.lifecycle.start()
+        self.register()
+        for _ in range(5):
+            self.loop.advance(10)
+        self.drop.assert_called_once_with()
+
+    def test_close(self):
+        self.lifecycle.start()
+        self.lifecycle.close()
+        self.lifecycle.disconnected()
+        self.loop.advance(1000)
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(self.lifecycle.state, 'closed')
+
+
+class TestJoinChannels(unittest.TestCase):
+    def test_packed(self):
+        server_handler = make_server_handler()
+        channels = ['#channel-number-{:04d}'.format(i) for i in range(200)]
+        server_handler.join_channels(channels)
+
+        lines = server_handler.output
+        self.assertLess(len(lines), 200 / 20)
+        self.assertTrue(all(len(line.encode('utf8')) + 2 <= server_handler.max_line_bytes for line in lines))
+        self.assertListEqual([channel for line in lines for channel in line[5:].split(',')], channels)
+
+    def test_keys(self):
+        server_handler = make_server_handler()
+        server_handler.join_channels({'#a': None, '#b': 'bkey', '#c': None, '#d': 'dkey'})
+        self.assertListEqual(server_handler.output, ['JOIN #b,#d,#a,#c bkey,dkey'])
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
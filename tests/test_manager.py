@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+from unittest import mock
+
+from pircel import manager, protocol
+
+from tests import fake_server
+
+
+def make_server_handler(nick):
+    identity = mock.MagicMock()
+    identity.nick = nick
+    identity.username = 'pircel'
+    identity.realname = 'Percy Wendel'
+    return protocol.IRCServerHandler(identity)
+
+
+class TestTimerWheel(unittest.IsolatedAsyncioTestCase):
+    async def test_schedule_and_cancel(self):
+        wheel = manager.TimerWheel(asyncio.get_running_loop(), tick=0.01, slots=4)
+        fired = []
+        wheel.schedule(0.01, fired.append, 'soon')
+        wheel.schedule(0.1, fired.append, 'later')  # goes around the wheel a couple of times
+        wheel.cancel(wheel.schedule(0.02, fired.append, 'cancelled'))
+        self.assertEqual(len(wheel), 2)
+
+        wheel.start()
+        await asyncio.sleep(0.3)
+        wheel.stop()
+
+        self.assertListEqual(fired, ['soon', 'later'])
+        self.assertEqual(len(wheel), 0)
+
+
+class TestConnectionManager(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):  # noqa
+        self.server = await fake_server.FakeIRCServer().start()
+        self.manager = manager.ConnectionManager(connect_stagger=0.001, reconnect_base=0.01, tick=0.01)
+
+    async def asyncTearDown(self):  # noqa
+        self.manager.close()
+        await self.server.stop()
+
+    async def test_connect_many(self):
+        for i in range(20):
+            self.manager.add(make_server_handler('bot{}'.format(i)), '127.0.0.1', self.server.port, secure=False,
+                             channels=['#chan'])
+        self.manager.start()
+
+        await self.server.wait_for(lambda lines: lines.count('JOIN #chan') == 20)
+        stats = self.manager.stats()
+        self.assertEqual(stats['connected'], 20)
+        # CAP LS, NICK, USER, CAP REQ, CAP END and JOIN each
+        self.assertEqual(stats['lines_out'], 120)
+        self.assertGreaterEqual(stats['lines_in'], 80)
+
+    async def test_reconnect(self):
+        connection = self.manager.add(make_server_handler('bot'), '127.0.0.1', self.server.port, secure=False,
+                                      channels=['#chan'])
+        self.manager.start()
+        await self.server.wait_for(lambda lines: lines.count('JOIN #chan') == 1)
+
+        self.server.clients[0].writer.close()
+        await self.server.wait_for(lambda lines: lines.count('JOIN #chan') == 2)
+
+        self.assertEqual(connection.reconnects, 1)
+        self.assertEqual(connection.state, 'connected')
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from pircel import outbound, protocol
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.scheduled = []
+
+    def __call__(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        self.scheduled.append((self.now + delay, callback))
+
+    def run_until(self, until):
+        """ Runs scheduled callbacks in time order up to `until`. """
+        while self.scheduled:
+            self.scheduled.sort(key=lambda item: item[0])
+            when, callback = self.scheduled[0]
+            if when > until:
+                break
+            self.scheduled.pop(0)
+            self.now = max(self.now, when)
+            callback()
+        self.now = until
+
+
+class TestOutboundQueue(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.writes = []
+        self.queue = outbound.OutboundQueue(self.clock.call_later, self.writes.append, burst=3, rate=1.0,
+                                            clock=self.clock)
+
+    def test_coalesce(self):
+        for i in range(3):
+            self.queue.write('PRIVMSG #c :{}'.format(i))
+        self.clock.run_until(0)
+
+        self.assertListEqual(self.writes, [b'PRIVMSG #c :0\r\nPRIVMSG #c :1\r\nPRIVMSG #c :2\r\n'])
+
+    def test_rate_limit(self):
+        for i in range(5):
+            self.queue.write('PRIVMSG #c :{}'.format(i))
+        self.clock.run_until(0)
+        self.assertEqual(self.queue.stats()['sent'], 3)
+        self.assertEqual(self.queue.depth, 2)
+
+        self.clock.run_until(1)
+        self.assertEqual(self.writes[-1], b'PRIVMSG #c :3\r\n')
+        self.clock.run_until(2)
+        self.assertEqual(self.writes[-1], b'PRIVMSG #c :4\r\n')
+
+        stats = self.queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['max_depth'], 5)
+        self.assertEqual(stats['max_latency'], 2)
+
+        with self.assertRaises(ValueError):
+            outbound.OutboundQueue(self.clock.call_later, rate=0)
+        with self.assertRaises(ValueError):
+            outbound.OutboundQueue(self.clock.call_later, burst=0.5)
+
+    def test_pong_first(self):
+        for i in range(5):
+            self.queue.write('PRIVMSG #c :{}'.format(i))
+        self.clock.run_until(0)
+        self.queue.write('PONG :token')
+        self.clock.run_until(0)
+
+        # The PONG goes straight away even with no tokens left
+        self.assertEqual(self.writes[-1], b'PONG :token\r\n')
+
+    def test_round_robin_targets(self):
+        for i in range(2):
+            self.queue.write('PRIVMSG #a :{}'.format(i))
+        self.queue.write('PRIVMSG #b :0')
+        self.clock.run_until(0)
+
+        self.assertListEqual(self.writes, [b'PRIVMSG #a :0\r\nPRIVMSG #b :0\r\nPRIVMSG #a :1\r\n'])
+
+    def test_priority(self):
+        self.queue.set_priority('#important', outbound.HIGH)
+        for i in range(3):
+            self.queue.write('PRIVMSG #c :{}'.format(i))
+        self.queue.write('PRIVMSG #important :hi')
+        self.clock.run_until(0)
+
+        self.assertTrue(self.writes[0].startswith(b'PRIVMSG #important :hi\r\n'))
+
+    def test_server_handler(self):
+        server_handler = protocol.IRCServerHandler(mock.MagicMock())
+        server_handler.write_function = self.queue.write
+        server_handler.join('#a')
+        server_handler.join('#b')
+        self.clock.run_until(0)
+
+        self.assertListEqual(self.writes, [b'JOIN #a\r\nJOIN #b\r\n'])
+
+    def test_encoded_lines(self):
+        self.queue.set_priority('#important', outbound.HIGH)
+        for i in range(3):
+            self.queue.write('PRIVMSG #c :{}'.format(i).encode())
+        self.queue.write(b'PRIVMSG #important :hi\r\n')
+        self.queue.write(b'PONG :token')
+        self.clock.run_until(0)
+
+        self.assertTrue(self.writes[0].startswith(b'PONG :token\r\nPRIVMSG #important :hi\r\nPRIVMSG #c :0\r\n'))
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import queue
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pircel import parallel, protocol
+
+
+class TestParseBatch(unittest.TestCase):
+    def test_parse_batch(self):
+        messages = parallel.parse_batch([b':n!u@h PRIVMSG #c :hi\r', b'', 'PING :x'.encode('utf8')])
+        self.assertListEqual(messages, [protocol.Message(None, 'n!u@h', 'PRIVMSG', ['#c', 'hi']), None,
+                                        protocol.Message(None, '', 'PING', ['x'])])
+
+
+class TestOrderedExecutor(unittest.TestCase):
+    def test_order_per_key(self):
+        executor = parallel.OrderedExecutor(concurrent.futures.ThreadPoolExecutor(4))
+        results = {'a': [], 'b': []}
+
+        def append(key, value):
+            time.sleep(0.001 * (5 - value % 5))  # make later calls quicker so they'd overtake if they could
+            results[key].append(value)
+
+        for i in range(20):
+            executor.submit('a', append, 'a', i)
+            executor.submit('b', append, 'b', i)
+        deadline = time.time() + 10
+        while not executor.idle() and time.time() < deadline:
+            time.sleep(0.01)
+        executor.executor.shutdown()
+
+        self.assertListEqual(results['a'], list(range(20)))
+        self.assertListEqual(results['b'], list(range(20)))
+
+
+class TestParallelDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.server_handler = protocol.IRCServerHandler(mock.MagicMock())
+        self.server_handler.write_function = mock.MagicMock()
+        self.posted = queue.Queue()
+        self.dispatcher = parallel.ParallelDispatcher(self.server_handler, self.posted.put,
+                                                      concurrent.futures.ProcessPoolExecutor(2), min_batch=2)
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+
+    def run_loop(self, until):
+        """ Plays the part of the event loop, running posted callbacks until `until()` is true. """
+        deadline = time.time() + 10
+        while not until() and time.time() < deadline:
+            try:
+                self.posted.get(timeout=0.1)()
+            except queue.Empty:
+                pass
+
+    def test_order_preserved(self):
+        received = []
+        self.dispatcher.add_callback('privmsg', lambda sender, prefix, args: received.append(args[1]))
+        for batch in range(10):
+            self.dispatcher.handle_lines([':n!u@h PRIVMSG #c :{}'.format(batch * 10 + i).encode('utf8')
+                                          for i in range(10)])
+        self.run_loop(lambda: len(received) == 100)
+
+        self.assertListEqual(received, [str(i) for i in range(100)])
+
+    def test_decoded_like_serial(self):
+        # Not utf8, cp1252 (the fallback) and latin-1 (what chardet might guess) disagree about \x80
+        lines = [b':n!u@h PRIVMSG #c :caf\xe9 \x80', b':n!u@h PRIVMSG #c :caf\xc3\xa9']
+
+        def received_by(dispatch):
+            server_handler = protocol.IRCServerHandler(mock.MagicMock(), protocol.LineDecoder(fallback='cp1252'))
+            received = []
+            server_handler.add_callback('privmsg', lambda sender, prefix, args: received.append(args), weak=False)
+            dispatch(server_handler)
+            self.run_loop(lambda: len(received) == len(lines))
+            return received
+
+        def parallel_dispatch(server_handler):
+            self.dispatcher.server_handler = server_handler
+            self.dispatcher.handle_lines(lines)
+
+        serial = received_by(lambda server_handler: server_handler.handle_lines(lines))
+        self.assertListEqual(serial, [['#c', 'caf\xe9 \u20ac'], ['#c', 'caf\xe9']])
+        self.assertListEqual(received_by(parallel_dispatch), serial)
+
+    def test_offloaded_callback(self):
+        done = threading.Event()
+        threads = []
+
+        @parallel.offloadable
+        def callback(sender, prefix, args):
+            threads.append(threading.current_thread())
+            done.set()
+
+        self.dispatcher.add_callback('privmsg', callback)
+        self.dispatcher.handle_lines([b':n!u@h PRIVMSG #c :hi'])
+        self.assertTrue(done.wait(5))
+        self.assertIsNot(threads[0], threading.current_thread())
+
+        self.dispatcher.remove_callback('privmsg', callback)
+        self.assertDictEqual(self.dispatcher._offloaded, {})
+
+    def test_offloaded_batch_callback(self):
+        done = threading.Event()
+        received = []
+
+        @parallel.offloadable
+        def callback(sender, prefix, args, messages):
+            received.append((args, [message.prefix for message in messages]))
+            done.set()
+
+        self.dispatcher.add_callback('batch_netsplit', callback)
+        self.server_handler.handle_lines([
+            ':irc.host BATCH +ref netsplit irc.hub other.host',
+            '@batch=ref :aji!a@a QUIT :irc.hub other.host',
+            ':irc.host BATCH -ref',
+        ])
+        self.assertTrue(done.wait(5))
+        self.assertListEqual(received, [(['irc.hub', 'other.host'], ['aji!a@a'])])
+
+        message = protocol.Message(None, 'n!u@h', 'PRIVMSG', ['#c', 'hi'])
+        self.assertEqual(parallel.default_key('irc.host', [], messages=[message]), '#c')
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
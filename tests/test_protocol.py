@@ -25,7 +25,7 @@ class TestInitialConnection(unittest.TestCase):
     def test_connect(self):
         self.server_handler.connect()
 
-        expected = ['NICK {}'.format(self.nick), 'USER {} 0 * :{}'.format(self.user, self.realname)]
+        expected = ['CAP LS 302', 'NICK {}'.format(self.nick), 'USER {} 0 * :{}'.format(self.user, self.realname)]
 
         self.assertListEqual(self.output, expected)
 
@@ -36,6 +36,298 @@ class TestInitialConnection(unittest.TestCase):
         self.assertEqual(self.output[-1], 'PONG :{}'.format(ping_value))
 
 
+class TestDispatch(unittest.TestCase):
+    def setUp(self):
+        self.server_handler = protocol.IRCServerHandler(mock.MagicMock())
+        self.server_handler.write_function = mock.MagicMock()
+        self.server_handler.log_unhandled = mock.MagicMock()
+        self.callback = mock.MagicMock()
+
+    def test_callback(self):
+        self.server_handler.add_callback('privmsg', self.callback)
+        self.server_handler.handle_line(':n!u@h PRIVMSG #c :hi')
+        self.server_handler.handle_line(':n!u@h PRIVMSG #c :there')
+
+        self.assertEqual(self.callback.call_count, 2)
+        self.callback.assert_called_with(self.server_handler, prefix='n!u@h', args=['#c', 'there'])
+        self.server_handler.log_unhandled.assert_not_called()
+
+    def test_numeric_callback(self):
+        self.server_handler.add_callback('rpl_welcome', self.callback)
+        self.server_handler.handle_line(':server 001 nick :Welcome')
+        self.callback.assert_called_once_with(self.server_handler, prefix='server', args=['nick', 'Welcome'])
+
+    def test_remove_callback(self):
+        self.server_handler.add_callback('privmsg', self.callback)
+        self.server_handler.handle_line(':n!u@h PRIVMSG #c :hi')
+        self.server_handler.remove_callback('privmsg', self.callback)
+        self.server_handler.handle_line(':n!u@h PRIVMSG #c :hi')
+
+        self.callback.assert_called_once_with(self.server_handler, prefix='n!u@h', args=['#c', 'hi'])
+
+    def test_no_receivers(self):
+        self.server_handler.handle_line(':server 375 nick :- MOTD -')
+        self.server_handler.log_unhandled.assert_called_once_with(':server 375 nick :- MOTD -')
+
+    def test_unknown_numeric(self):
+        self.server_handler.handle_line(':server 999 nick :What?')
+        self.server_handler.log_unhandled.assert_called_once_with(':server 999 nick :What?')
+
+
+class TestLineDecoder(unittest.TestCase):
+    latin1_line = ':n!u@h PRIVMSG #c :caf\xe9 cr\xe8me br\xfbl\xe9e, d\xe9j\xe0 vu\r\n'.encode('latin-1')
+
+    def test_utf8(self):
+        decoder = protocol.LineDecoder()
+        self.assertEqual(decoder.decode('PRIVMSG #c :\u2603'.encode('utf8')), 'PRIVMSG #c :\u2603')
+        self.assertEqual(sum(decoder.counters.values()), 0)
+
+    def test_fallback(self):
+        decoder = protocol.LineDecoder(fallback='latin-1')
+        self.assertEqual(decoder.decode(self.latin1_line), self.latin1_line.decode('latin-1'))
+        self.assertEqual(decoder.counters['fallback'], 1)
+        self.assertEqual(decoder.counters['chardet'], 0)
+
+    def test_surrogateescape(self):
+        decoder = protocol.LineDecoder(fallback='surrogateescape')
+        line = decoder.decode(self.latin1_line)
+        self.assertEqual(line.encode('utf8', errors='surrogateescape'), self.latin1_line)
+
+    @mock.patch('chardet.detect', return_value={'encoding': 'latin-1'})
+    def test_chardet_remembered(self, detect):
+        decoder = protocol.LineDecoder()
+        decoder.decode(self.latin1_line)
+        decoder.decode(self.latin1_line)
+
+        detect.assert_called_once_with(self.latin1_line)
+        self.assertEqual(decoder.counters['chardet'], 1)
+        self.assertEqual(decoder.counters['cached'], 1)
+
+    @mock.patch('chardet.detect', return_value={'encoding': 'latin-1'})
+    def test_cache_eviction(self, detect):
+        decoder = protocol.LineDecoder(cache_size=2)
+        for nick in ('a', 'b', 'c', 'a'):
+            decoder.decode(':{}!u@h PRIVMSG {} :\xe9'.format(nick, nick).encode('latin-1'))
+        self.assertEqual(detect.call_count, 4)
+
+    def test_isupport(self):
+        server_handler = protocol.IRCServerHandler(mock.MagicMock())
+        server_handler.handle_line(':server 005 nick CHARSET=latin-1 :are supported by this server')
+        self.assertEqual(server_handler.decoder.decode(self.latin1_line), self.latin1_line.decode('latin-1'))
+        self.assertEqual(server_handler.decoder.counters['charset'], 1)
+
+        server_handler.handle_line(':server 005 nick UTF8ONLY :are supported by this server')
+        self.assertEqual(server_handler.decoder.decode(b'\xe9'), '\ufffd')
+
+
+class TestParseMessage(unittest.TestCase):
+    def test_prefix_command_params(self):
+        message = protocol.parse_message(':nick!~user@host PRIVMSG #channel :hello  there \r\n')
+        self.assertIsNone(message.tags)
+        self.assertEqual(message.prefix, 'nick!~user@host')
+        self.assertEqual(message.command, 'PRIVMSG')
+        self.assertListEqual(message.params, ['#channel', 'hello  there '])
+
+    def test_no_prefix_no_params(self):
+        message = protocol.parse_message('QUIT')
+        self.assertEqual(message, protocol.Message(None, '', 'QUIT', []))
+
+    def test_empty_trailing(self):
+        message = protocol.parse_message(':server 332 nick #channel :')
+        self.assertListEqual(message.params, ['nick', '#channel', ''])
+
+    def test_tags(self):
+        line = r'@time=2016-02-01T12:00:00.000Z;msgid=a\sb\:c;+draft/flag :n!u@h PRIVMSG #c :hi'
+        message = protocol.parse_message(line)
+        self.assertDictEqual(message.tags, {'time': '2016-02-01T12:00:00.000Z', 'msgid': 'a b;c', '+draft/flag': ''})
+        self.assertEqual(message.command, 'PRIVMSG')
+        self.assertListEqual(message.params, ['#c', 'hi'])
+
+    def test_matches_split_irc_line(self):
+        for line in (':irc.example.net 353 nick = #c :@a +b c', 'PING :irc.example.net', ':n!u@h MODE #c +o n',
+                     ':n!u@h JOIN #c'):
+            self.assertEqual(protocol.parse_line(line), protocol.split_irc_line(line))
+
+    def test_no_command(self):
+        with self.assertRaises(protocol.MalformedLineError):
+            protocol.parse_message(':just.a.prefix\r\n')
+
+    def test_bytes(self):
+        line = r'@msgid=a\sb :nick!~user@host PRIVMSG #channel :hello  there '.encode('utf8')
+        message = protocol.parse_message_bytes(line + b'\r\n')
+        self.assertEqual(message, protocol.Message({'msgid': 'a b'}, b'nick!~user@host', b'PRIVMSG',
+                                                   [b'#channel', b'hello  there ']))
+        self.assertEqual(protocol.LineDecoder().decode_message(message, line),
+                         protocol.parse_message(line.decode('utf8')))
+
+
+class TestSendMessage(unittest.TestCase):
+    def setUp(self):
+        identity = mock.MagicMock()
+        identity.nick = 'me'
+        identity.username = 'user'
+        self.server_handler = protocol.IRCServerHandler(identity)
+        self.output = []
+        self.server_handler.write_function = self.output.append
+        self.callback = mock.MagicMock()
+        self.server_handler.add_callback('privmsg', self.callback)
+
+    def test_multiple_lines(self):
+        with mock.patch('pircel.protocol.parse_message') as parse_message:
+            self.server_handler.send_message('#c', 'one\ntwo\nthree')
+        parse_message.assert_not_called()
+
+        self.assertListEqual(self.output, ['PRIVMSG #c :one', 'PRIVMSG #c :two', 'PRIVMSG #c :three'])
+        self.assertListEqual(self.callback.call_args_list, [
+            mock.call(self.server_handler, prefix='me!~user@localhost', args=['#c', text])
+            for text in ('one', 'two', 'three')
+        ])
+
+    def test_long_line(self):
+        message = 'x' + '\u2603' * 300
+        self.server_handler.send_message('#c', message)
+        max_bytes = self.server_handler._max_text_bytes('PRIVMSG', '#c')
+        texts = [line[len('PRIVMSG #c :'):] for line in self.output]
+
+        self.assertGreater(len(texts), 1)
+        self.assertEqual(''.join(texts), message)
+        for text in texts:
+            self.assertLessEqual(len(text.encode('utf8')), max_bytes)
+        self.assertEqual(self.callback.call_count, len(texts))
+
+    def test_split_encoded(self):
+        self.assertListEqual(protocol.split_encoded('', 10), [''])
+        self.assertListEqual(protocol.split_encoded('ab\xe9cd', 3), ['ab', '\xe9c', 'd'])
+        self.assertListEqual(protocol.split_encoded('ab\xe9cd', 3, 'latin-1'), ['ab\xe9', 'cd'])
+        with self.assertRaises(ValueError):
+            protocol.split_encoded('\u2603', 2)
+
+
+class TestCapabilities(unittest.TestCase):
+    def setUp(self):
+        identity = mock.MagicMock()
+        identity.nick = 'nick'
+        self.server_handler = protocol.IRCServerHandler(identity)
+        self.output = []
+        self.server_handler.write_function = self.output.append
+        self.server_handler.connect()
+        del self.output[:]
+
+    def test_negotiation(self):
+        self.server_handler.handle_lines([
+            ':server CAP * LS * :multi-prefix sasl=PLAIN,EXTERNAL',
+            ':server CAP * LS :batch server-time',
+        ])
+        self.assertListEqual(self.output, ['CAP REQ :batch multi-prefix server-time'])
+        self.assertEqual(self.server_handler.available_caps['sasl'], 'PLAIN,EXTERNAL')
+
+        self.server_handler.handle_line(':server CAP nick ACK :batch multi-prefix server-time')
+        self.assertListEqual(self.output[1:], ['CAP END'])
+        self.assertSetEqual(self.server_handler.caps, {'batch', 'multi-prefix', 'server-time'})
+
+        self.server_handler.handle_line(':server CAP nick DEL :batch')
+        self.server_handler.handle_line(':server CAP nick NEW :away-notify')
+        self.server_handler.handle_line(':server CAP nick ACK :away-notify')
+        self.assertSetEqual(self.server_handler.caps, {'multi-prefix', 'server-time', 'away-notify'})
+        self.assertListEqual(self.output[2:], ['CAP REQ :away-notify'])
+
+    def test_nothing_wanted(self):
+        self.server_handler.handle_line(':server CAP * LS :sasl')
+        self.server_handler.handle_line(':server CAP * NAK :sasl')
+        self.assertListEqual(self.output, ['CAP END'])
+
+    def test_nak(self):
+        self.server_handler.handle_line(':server CAP * LS :batch')
+        self.server_handler.handle_line(':server CAP * NAK :batch')
+        self.assertListEqual(self.output, ['CAP REQ :batch', 'CAP END'])
+        self.assertSetEqual(self.server_handler.caps, set())
+
+    def test_batch(self):
+        events = []
+        quits = []
+        self.server_handler.add_callback('batch_netsplit', lambda sender, **kwargs: events.append(kwargs), weak=False)
+        self.server_handler.add_callback('quit', lambda sender, prefix, args: quits.append(prefix), weak=False)
+
+        self.server_handler.handle_lines([
+            ':irc.host BATCH +yXNAbvnRHTRBv netsplit irc.hub other.host',
+            '@batch=yXNAbvnRHTRBv :aji!a@a QUIT :irc.hub other.host',
+            b'@batch=yXNAbvnRHTRBv :nenolod!a@a QUIT :irc.hub other.host',
+        ])
+        self.assertListEqual(events, [])
+        self.assertListEqual(quits, [])
+
+        self.server_handler.handle_line(':irc.host BATCH -yXNAbvnRHTRBv')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['prefix'], 'irc.host')
+        self.assertListEqual(events[0]['args'], ['irc.hub', 'other.host'])
+        self.assertListEqual([message.prefix for message in events[0]['messages']], ['aji!a@a', 'nenolod!a@a'])
+        self.assertListEqual(quits, ['aji!a@a', 'nenolod!a@a'])
+
+    def test_server_time(self):
+        times = []
+        self.server_handler.add_callback('privmsg', lambda sender, prefix, args: times.append(sender.tags['time']),
+                                         weak=False)
+        self.server_handler.handle_line('@time=2016-02-01T12:00:00.000Z :n!u@h PRIVMSG #c :hi')
+        self.assertListEqual(times, ['2016-02-01T12:00:00.000Z'])
+
+
+class TestParseIdentity(unittest.TestCase):
+    def test_user(self):
+        self.assertEqual(protocol.parse_identity('nick!~user@host'), protocol.Identity('nick', 'user', 'host'))
+
+    def test_server(self):
+        self.assertEqual(protocol.parse_identity('irc.example.net'), protocol.Identity('irc.example.net', None, None))
+        self.assertEqual(protocol.parse_identity('nick@host'), protocol.Identity('nick', None, 'host'))
+
+    def test_cached_and_interned(self):
+        prefix = 'nick!user@shared.host'
+        first = protocol.parse_identity(prefix)
+        before = protocol.identity_cache_stats()
+        self.assertIs(protocol.parse_identity(''.join(prefix)), first)
+        self.assertEqual(protocol.identity_cache_stats()['hits'], before['hits'] + 1)
+        self.assertIs(protocol.parse_identity('other!user@shared.host').host, first.host)
+
+
+class TestBytesMode(unittest.TestCase):
+    def setUp(self):
+        identity = mock.MagicMock()
+        identity.nick = 'nick'
+        self.server_handler = protocol.IRCServerHandler(identity)
+        self.server_handler.write_function = mock.MagicMock()
+        self.server_handler.write_bytes = mock.MagicMock()
+
+    def test_templates(self):
+        self.server_handler.handle_line(b'PING :token\r\n')
+        self.server_handler.join('#caf\xe9')
+        self.server_handler.send_message('#c', 'caf\xe9\nmore')
+        self.assertListEqual([call[0][0] for call in self.server_handler.write_bytes.call_args_list], [
+            b'PONG :token\r\n',
+            b'JOIN #caf\xc3\xa9\r\n',
+            b'PRIVMSG #c :caf\xc3\xa9\r\n',
+            b'PRIVMSG #c :more\r\n',
+        ])
+        self.server_handler.write_function.assert_not_called()
+
+    def test_decoded_only_when_wanted(self):
+        self.server_handler.decoder = mock.MagicMock(wraps=protocol.LineDecoder(fallback='latin-1'))
+        self.server_handler.log_unhandled = mock.MagicMock()
+        self.server_handler.handle_lines([b':server 999 nick :What?', b':n!u@h WALLOPS :caf\xe9'])
+        self.server_handler.decoder.decode_message.assert_not_called()
+        self.assertEqual(self.server_handler.log_unhandled.call_count, 2)
+
+        callback = mock.MagicMock()
+        self.server_handler.add_callback('wallops', callback)
+        self.server_handler.handle_line(b':n!u@h WALLOPS :caf\xe9')
+        callback.assert_called_once_with(self.server_handler, prefix='n!u@h', args=['caf\xe9'])
+
+    def test_log_unhandled(self):
+        with self.assertLogs('pircel.protocol', 'WARNING') as logs:
+            self.server_handler.handle_line(':server 999 nick :What?')
+            self.server_handler.handle_line(b':server 999 nick :caf\xe9\r\n')
+        self.assertListEqual([record.getMessage() for record in logs.records],
+                             ['Unhandled: :server 999 nick :What?', 'Unhandled: :server 999 nick :caf\ufffd'])
+
+
 def main():
     unittest.main()
 
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from pircel import queries
+
+from tests.test_lifecycle import FakeLoop, make_server_handler
+
+
+class TestQueryManager(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeLoop()
+        self.server_handler = make_server_handler()
+        self.queries = queries.QueryManager(self.server_handler, self.loop.call_later, ttl=60, timeout=30,
+                                            clock=self.loop.clock)
+        self.addCleanup(self.queries.close)
+
+    def lines(self, *lines):
+        self.server_handler.handle_lines(lines)
+
+    def sent(self):
+        self.loop.advance(0)
+        sent = list(self.server_handler.output)
+        self.server_handler.output.clear()
+        return sent
+
+    def test_who(self):
+        first = self.queries.who('#Chan')
+        second = self.queries.who('#chan')
+        other = self.queries.who('*.example.net')
+        self.assertIs(first, second)
+        self.assertListEqual(self.sent(), ['WHO #Chan', 'WHO *.example.net'])
+
+        self.lines(
+            ':server 352 pircel #Chan ~al host.net irc.server Alice H@ :0 Alice Liddell',
+            ':server 352 pircel #Chan bob host.net irc.server Bob G :2 Bob',
+            ':server 315 pircel #Chan :End of /WHO list.',
+            ':server 352 pircel * carol x.example.net irc.server Carol H :0 Carol',
+            ':server 315 pircel *.example.net :End of /WHO list.',
+        )
+        self.assertListEqual([reply.nick for reply in first.result(0)], ['Alice', 'Bob'])
+        self.assertEqual(first.result(0)[0], ('#Chan', '~al', 'host.net', 'irc.server', 'Alice', 'H@', 0,
+                                              'Alice Liddell'))
+        self.assertListEqual([reply.nick for reply in other.result(0)], ['Carol'])
+
+        # Cached, until someone in it leaves
+        self.assertIs(self.queries.who('#CHAN').result(0), first.result(0))
+        self.assertListEqual(self.sent(), [])
+        self.lines(':Bob!bob@host.net QUIT :bye')
+        self.queries.who('#chan')
+        self.queries.who('*.example.net')
+        self.assertListEqual(self.sent(), ['WHO #chan'])
+        self.assertEqual((self.queries.hits, self.queries.deduplicated), (2, 1))
+
+    def test_who_not_ours(self):
+        chan = self.queries.who('#chan')
+        wildcard = self.queries.who('*.example.net')
+        self.sent()
+        # Replies to a WHO someone else sent turn up while ours are still open
+        self.lines(
+            ':server 352 pircel * dave elsewhere.org irc.server Dave H :0 Dave',
+            ':server 352 pircel #chan ~al host.net irc.server Alice H@ :0 Alice',
+            ':server 352 pircel * carol x.example.net irc.server Carol H :0 Carol',
+            ':server 315 pircel dave :End of /WHO list.',
+            ':server 315 pircel #chan :End of /WHO list.',
+            ':server 315 pircel *.example.net :End of /WHO list.',
+        )
+        self.assertListEqual([reply.nick for reply in chan.result(0)], ['Alice'])
+        self.assertListEqual([reply.nick for reply in wildcard.result(0)], ['Carol'])
+
+    def test_whois_batched(self):
+        self.queries.max_targets['whois'] = 2
+        alice, bob, nobody = self.queries.whois('Alice'), self.queries.whois('Bob'), self.queries.whois('Nobody')
+        self.assertListEqual(self.sent(), ['WHOIS Alice,Bob', 'WHOIS Nobody'])
+
+        self.lines(
+            ':server 311 pircel Alice al host.net * :Alice Liddell',
+            ':server 319 pircel Alice :@#chan #other',
+            ':server 330 pircel Alice alice :is logged in as',
+            ':server 317 pircel Alice 42 1700000000 :seconds idle, signon time',
+            ':server 311 pircel Bob bob host.net * :Bob',
+            ':server 301 pircel Bob :gone fishing',
+            ':server 318 pircel Alice,Bob :End of /WHOIS list.',
+            ':server 401 pircel Nobody :No such nick/channel',
+            ':server 318 pircel Nobody :End of /WHOIS list.',
+        )
+        whois = alice.result(0)
+        self.assertEqual((whois.nick, whois.username, whois.realname, whois.account, whois.idle),
+                         ('Alice', 'al', 'Alice Liddell', 'alice', 42))
+        self.assertListEqual(whois.channels, ['@#chan', '#other'])
+        self.assertEqual(bob.result(0).away, 'gone fishing')
+        self.assertIsNone(nobody.result(0))
+
+        # Changing nick makes the old WHOIS stale
+        self.lines(':Alice!al@host.net NICK Alicia')
+        self.queries.whois('alice')
+        self.queries.whois('bob')
+        self.assertListEqual(self.sent(), ['WHOIS alice'])
+
+    def test_names(self):
+        names = self.queries.names('#chan')
+        self.assertListEqual(self.sent(), ['NAMES #chan'])
+        self.lines(
+            ':server 353 pircel = #chan :@Alice +Bob',
+            ':server 353 pircel = #chan :Carol',
+            ':server 366 pircel #chan :End of /NAMES list.',
+        )
+        self.assertListEqual(names.result(0), ['@Alice', '+Bob', 'Carol'])
+
+        self.lines(':Dave!d@h JOIN #chan')
+        self.queries.names('#chan')
+        self.assertListEqual(self.sent(), ['NAMES #chan'])
+
+    def test_timeout_and_disconnect(self):
+        who = self.queries.who('#chan')
+        self.sent()
+        self.loop.advance(31)
+        with self.assertRaises(queries.QueryTimeoutError):
+            who.result(0)
+
+        whois = self.queries.whois('alice')
+        self.sent()
+        self.server_handler.disconnected()
+        with self.assertRaises(queries.QueryError):
+            whois.result(0)
+        self.assertIsNot(self.queries.whois('alice'), whois)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
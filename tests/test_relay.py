@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+from unittest import mock
+
+from pircel import protocol, relay, state
+
+
+class TestRelay(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        identity = mock.MagicMock()
+        identity.nick = 'pircel'
+        identity.username = 'pircel'
+        self.server_handler = protocol.IRCServerHandler(identity)
+        self.server_handler.write_function = mock.MagicMock()
+        self.server_handler.write_bytes = mock.MagicMock()
+        self.tracker = state.StateTracker(self.server_handler)
+        self.server_handler.handle_lines([
+            ':pircel!~pircel@localhost JOIN #Chan',
+            ':server 332 pircel #Chan :The topic',
+            ':server 353 pircel = #Chan :pircel @+Op +Voice Plain',
+        ])
+
+        self.relay = relay.Relay(self.server_handler, self.tracker, password='secret')
+        self.port = await self.relay.listen()
+        self.addCleanup(self.relay.close)
+
+    async def attach(self, nick='client'):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.addCleanup(writer.close)
+        writer.write('PASS secret\r\nNICK {}\r\nUSER u 0 * :Real\r\n'.format(nick).encode())
+        lines = []
+        while not lines or b' 366 ' not in lines[-1]:
+            lines.append(await asyncio.wait_for(reader.readline(), 5))
+        return reader, writer, lines
+
+    async def test_snapshot(self):
+        _, _, lines = await self.attach()
+        self.assertIn(b':client NICK :pircel\r\n', lines)
+        self.assertIn(b':pircel!pircel@localhost JOIN #Chan\r\n', lines)
+        self.assertIn(b':pircel.relay 332 pircel #Chan :The topic\r\n', lines)
+        names = [line for line in lines if b' 353 ' in line]
+        self.assertEqual(len(names), 1)
+        self.assertSetEqual(set(names[0].split(b':')[2].split()), {b'pircel', b'@Op', b'+Voice', b'Plain'})
+        self.server_handler.write_bytes.assert_not_called()
+
+    async def test_forwarding(self):
+        reader, writer, _ = await self.attach()
+        other_reader, _, _ = await self.attach('other')
+
+        upstream = [b':n!u@h PRIVMSG #Chan :hi \xe9\r', b'PING :server\r', b':n!u@h PART #Chan\r']
+        self.relay.feed(upstream)
+        for stream in (reader, other_reader):
+            self.assertEqual(await asyncio.wait_for(stream.readline(), 5), upstream[0] + b'\n')
+            self.assertEqual(await asyncio.wait_for(stream.readline(), 5), upstream[2] + b'\n')
+
+        writer.write(b'PING :x\r\nPRIVMSG #Chan :hello\r\n')
+        self.assertEqual(await asyncio.wait_for(reader.readline(), 5), b':pircel.relay PONG :x\r\n')
+        self.assertEqual(await asyncio.wait_for(other_reader.readline(), 5),
+                         b':pircel!pircel@localhost PRIVMSG #Chan :hello\r\n')
+        self.server_handler.write_bytes.assert_called_once_with(b'PRIVMSG #Chan :hello\r\n')
+
+    async def test_caps(self):
+        self.server_handler.caps = {'server-time', 'message-tags', 'extended-join', 'multi-prefix', 'away-notify',
+                                    'sasl'}
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.addCleanup(writer.close)
+        writer.write(b'CAP LS 302\r\nPASS secret\r\nNICK capable\r\nUSER u 0 * :Real\r\n')
+        self.assertEqual(await asyncio.wait_for(reader.readline(), 5),
+                         b':pircel.relay CAP * LS :away-notify extended-join message-tags multi-prefix '
+                         b'server-time\r\n')
+        writer.write(b'CAP REQ :sasl\r\nCAP REQ :multi-prefix server-time\r\nCAP END\r\n')
+        self.assertEqual(await asyncio.wait_for(reader.readline(), 5), b':pircel.relay CAP capable NAK :sasl\r\n')
+        self.assertEqual(await asyncio.wait_for(reader.readline(), 5),
+                         b':pircel.relay CAP capable ACK :multi-prefix server-time\r\n')
+        # Not registered until CAP END
+        while b' 366 ' not in await asyncio.wait_for(reader.readline(), 5):
+            pass
+        plain_reader, _, _ = await self.attach('plain')
+
+        self.relay.feed([
+            b'@time=2024-01-01T00:00:00.000Z;msgid=x :n!u@h PRIVMSG #Chan :hi\r',
+            b':n!u@h JOIN #Chan account :Real Name\r',
+            b':n!u@h AWAY :gone\r',
+            b':server 353 pircel = #Chan :@+Op +Voice\r',
+        ])
+        expected = {
+            reader: [b'@time=2024-01-01T00:00:00.000Z :n!u@h PRIVMSG #Chan :hi\r\n', b':n!u@h JOIN #Chan\r\n',
+                     b':server 353 pircel = #Chan :@+Op +Voice\r\n'],
+            plain_reader: [b':n!u@h PRIVMSG #Chan :hi\r\n', b':n!u@h JOIN #Chan\r\n',
+                           b':server 353 pircel = #Chan :@Op +Voice\r\n'],
+        }
+        for stream, lines in expected.items():
+            for line in lines:
+                self.assertEqual(await asyncio.wait_for(stream.readline(), 5), line)
+
+    async def test_bad_password(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.addCleanup(writer.close)
+        writer.write(b'PASS wrong\r\nNICK client\r\nUSER u 0 * :Real\r\n')
+        self.assertEqual(await asyncio.wait_for(reader.read(), 5), b'ERROR :Bad password\r\n')
+        self.assertFalse(self.relay.clients)
+
+    def test_slow_consumer(self):
+        self.relay.max_send_queue = 100
+        client = relay.DownstreamClient(self.relay)
+        transport = mock.MagicMock()
+        transport.get_write_buffer_size.return_value = 0
+        client.connection_made(transport)
+        self.relay.clients.add(client)
+
+        self.relay.feed([b':n!u@h PRIVMSG #Chan :hi\r'])
+        transport.write.assert_called_once_with(b':n!u@h PRIVMSG #Chan :hi\r\n')
+
+        transport.get_write_buffer_size.return_value = 101
+        self.relay.feed([b':n!u@h PRIVMSG #Chan :hi\r'])
+        transport.abort.assert_called_once_with()
+        self.assertNotIn(client, self.relay.clients)
+        self.assertEqual(self.relay.evicted, 1)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
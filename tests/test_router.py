@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from pircel import protocol, router
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        identity = mock.MagicMock()
+        identity.nick = 'pircel'
+        self.server_handler = protocol.IRCServerHandler(identity)
+        self.server_handler.write_function = mock.MagicMock()
+        self.router = router.Router(self.server_handler)
+        self.addCleanup(self.router.clear)
+        self.calls = []
+
+    def callback(self, name):
+        def record(sender, prefix, args, match):
+            self.calls.append((name, args[-1], match.group() if match is not None else None))
+        return record
+
+    def lines(self, *lines):
+        self.calls.clear()
+        self.server_handler.handle_lines(lines)
+        return self.calls
+
+    def test_prefixes(self):
+        self.router.add_route(self.callback('weather'), prefix='!weather')
+        self.router.add_route(self.callback('w'), prefix='!w')
+        self.router.add_route(self.callback('everything'))
+        self.router.add_route(self.callback('bots'), channel='#Bots', prefix='!')
+
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #chan :!weather london'), [
+            ('weather', '!weather london', None),
+            ('w', '!weather london', None),
+            ('everything', '!weather london', None),
+        ])
+        self.assertListEqual([name for name, _, _ in self.lines(':n!u@h PRIVMSG #BOTS :!w')],
+                             ['w', 'everything', 'bots'])
+        self.assertListEqual([name for name, _, _ in self.lines(':n!u@h PRIVMSG #chan :hello')], ['everything'])
+        self.assertListEqual(self.lines(':n!u@h NOTICE #chan :!weather'), [])
+
+    def test_patterns(self):
+        self.router.add_route(self.callback('url'), pattern=r'https?://\S+')
+        self.router.add_route(self.callback('number'), pattern=r'\d+')
+        self.router.add_route(self.callback('shout'), pattern='^[A-Z ]+$')
+
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :see http://x.org/1 now'), [
+            ('url', 'see http://x.org/1 now', 'http://x.org/1'),
+            ('number', 'see http://x.org/1 now', '1'),
+        ])
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :HELLO'), [('shout', 'HELLO', 'HELLO')])
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :nothing here'), [])
+
+        # Filed in the prefix trie under '!seen '
+        self.router.add_route(self.callback('seen'), pattern=r'^!seen (\S+)$')
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :!seen bob'), [('seen', '!seen bob', '!seen bob')])
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :!seen bob 2'), [('number', '!seen bob 2', '2')])
+
+        # Can't be put in one alternation, they're tried separately instead
+        self.router.add_route(self.callback('flags'), pattern='(?i)hello')
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :Hello'), [('flags', 'Hello', 'Hello')])
+
+    def test_backreferences(self):
+        # Combined, the second pattern's \1 would refer to the first pattern's group
+        self.router.add_route(self.callback('word'), pattern=r'(\w+)!')
+        self.router.add_route(self.callback('double'), pattern=r'(\w)\1')
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :see'), [('double', 'see', 'ee')])
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :hey!'), [('word', 'hey!', 'hey!')])
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :cool!'), [('word', 'cool!', 'cool!'),
+                                                                      ('double', 'cool!', 'oo')])
+
+    def test_remove(self):
+        route = self.router.add_route(self.callback('a'), prefix='!a')
+
+        @self.router.route(command='notice', channel='#c')
+        def on_notice(sender, prefix, args, match):
+            self.calls.append(('notice', args[-1], None))
+
+        self.assertEqual(len(self.lines(':n!u@h PRIVMSG #c :!a', ':n!u@h NOTICE #c :x')), 2)
+        self.router.remove_route(route)
+        self.assertListEqual(self.lines(':n!u@h PRIVMSG #c :!a', ':n!u@h NOTICE #c :x'), [('notice', 'x', None)])
+        self.assertListEqual(list(protocol.signal_factory('privmsg').receivers_for(self.server_handler)), [])
+
+        with self.assertRaises(ValueError):
+            self.router.add_route(self.callback('both'), prefix='!', pattern='!')
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
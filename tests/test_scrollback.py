@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pircel import protocol, scrollback
+
+
+class TestScrollbackStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = self.open()
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def open(self, **kwargs):
+        kwargs.setdefault('index_interval', 4)
+        return scrollback.ScrollbackStore(self.directory.name, 'testnet', **kwargs)
+
+    def fill(self, store, count=100):
+        for i in range(count):
+            store.append('privmsg', '#chan{}'.format(i % 3), 'nick!u@h', 'line {}'.format(i), timestamp=i)
+
+    def test_before(self):
+        self.fill(self.store)
+        lines = self.store.before('#CHAN1', 5)
+        self.assertEqual([line.text for line in lines], ['line {}'.format(i) for i in (85, 88, 91, 94, 97)])
+        self.assertEqual(lines[0], scrollback.Line(85, 'privmsg', '#chan1', 'nick!u@h', 'line 85'))
+
+        lines = self.store.before('#chan0', 3, until=50)
+        self.assertEqual([line.timestamp for line in lines], [42, 45, 48])
+
+        self.assertEqual(self.store.before('#chan0', 3, until=0), [])
+        self.assertEqual(self.store.before('#nowhere', 3), [])
+
+    def test_segments(self):
+        self.store.close()
+        self.store = self.open(segment_size=256)
+        self.fill(self.store)
+        self.assertGreater(len(self.store._existing_segments()), 10)
+        self.assertEqual([line.timestamp for line in self.store.before('#chan2', 40)], list(range(2, 100, 3))[-33:])
+
+    def test_reopen(self):
+        self.store.close()
+        self.store = self.open(segment_size=512)
+        self.fill(self.store)
+        self.store.close()
+
+        # Leave half a record at the end of the last segment like a crash would
+        segment = os.path.join(self.directory.name, 'testnet.{:06d}.seg'.format(self.store._segment))
+        with open(segment, 'ab') as f:
+            f.write(b'\x00' * 10)
+
+        self.store = self.open(segment_size=512)
+        self.assertEqual([line.timestamp for line in self.store.before('#chan1', 2)], [94, 97])
+        self.store.append('join', '#chan1', 'new!u@h', timestamp=100)
+        self.assertEqual([line.timestamp for line in self.store.before('#chan1', 3, until=100)], [91, 94, 97])
+        self.assertEqual(self.store.before('#chan1', 1)[0].kind, 'join')
+
+    def test_attach(self):
+        identity = mock.MagicMock()
+        identity.nick = 'pircel'
+        server_handler = protocol.IRCServerHandler(identity)
+        self.store.attach(server_handler)
+        server_handler.handle_lines([
+            ':a!u@h JOIN #chan',
+            ':a!u@h PRIVMSG #chan :hello',
+            ':a!u@h PRIVMSG pircel :psst',
+            ':a!u@h PART #chan :bye',
+        ])
+        self.assertEqual([(line.kind, line.text) for line in self.store.before('#chan', 10)],
+                         [('join', ''), ('privmsg', 'hello'), ('part', 'bye')])
+        self.assertEqual(self.store.before('a', 10)[0].text, 'psst')
+
+        self.store.detach()
+        server_handler.handle_lines([':a!u@h PRIVMSG #chan :unrecorded'])
+        self.assertEqual(len(self.store.before('#chan', 10)), 3)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
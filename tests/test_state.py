@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from pircel import protocol, state
+
+
+class TestStateTracker(unittest.TestCase):
+    nick = 'pircel'
+
+    def setUp(self):
+        identity = mock.MagicMock()
+        identity.nick = self.nick
+        self.server_handler = protocol.IRCServerHandler(identity)
+        self.server_handler.write_function = mock.MagicMock()
+        self.tracker = state.StateTracker(self.server_handler)
+
+        self.lines([
+            ':pircel!~pircel@localhost JOIN #Chan',
+            ':server 353 pircel = #Chan :pircel @+Op +Voice Plain',
+            ':pircel!~pircel@localhost JOIN #other',
+            ':server 353 pircel = #other :pircel Plain',
+        ])
+
+    def lines(self, lines):
+        self.server_handler.handle_lines(lines)
+
+    def test_names(self):
+        channel = self.tracker.get_channel('#chan')
+        self.assertEqual(channel.name, '#Chan')
+        self.assertSetEqual(set(channel.members), {'pircel', 'op', 'voice', 'plain'})
+        self.assertEqual(self.tracker.modes_in('op', '#chan'), 'ov')
+        self.assertEqual(self.tracker.modes_in('VOICE', '#CHAN'), 'v')
+        self.assertSetEqual(set(self.tracker.get_user('plain').channels), {'#chan', '#other'})
+
+    def test_casemapping(self):
+        self.lines([':a[b]!u@h JOIN #chan'])
+        self.assertIs(self.tracker.get_user('A{B}'), self.tracker.get_user('a[b]'))
+
+    def test_join_part(self):
+        self.lines([':new!~user@host JOIN #chan'])
+        user = self.tracker.get_user('new')
+        self.assertEqual((user.username, user.host), ('user', 'host'))
+        self.assertTrue(self.tracker.is_on('new', '#chan'))
+
+        self.lines([':new!~user@host PART #chan :bye'])
+        self.assertFalse(self.tracker.is_on('new', '#chan'))
+        self.assertIsNone(self.tracker.get_user('new'))
+
+    def test_extended_join(self):
+        self.lines([':new!~user@host JOIN #chan account :Real Name'])
+        user = self.tracker.get_user('new')
+        self.assertEqual((user.account, user.realname), ('account', 'Real Name'))
+
+    def test_quit(self):
+        self.lines([':Plain!u@h QUIT :gone'])
+        self.assertIsNone(self.tracker.get_user('plain'))
+        self.assertFalse(self.tracker.is_on('plain', '#chan'))
+        self.assertFalse(self.tracker.is_on('plain', '#other'))
+
+    def test_nick(self):
+        self.lines([':Plain!u@h NICK Fancy'])
+        self.assertIsNone(self.tracker.get_user('plain'))
+        self.assertEqual(self.tracker.get_user('fancy').nick, 'Fancy')
+        self.assertTrue(self.tracker.is_on('fancy', '#chan'))
+        self.assertTrue(self.tracker.is_on('fancy', '#other'))
+
+    def test_kick(self):
+        self.lines([':Op!u@h KICK #chan Plain :out'])
+        self.assertFalse(self.tracker.is_on('plain', '#chan'))
+        self.assertTrue(self.tracker.is_on('plain', '#other'))
+
+    def test_we_part(self):
+        self.lines([':pircel!~pircel@localhost PART #chan'])
+        self.assertIsNone(self.tracker.get_channel('#chan'))
+        self.assertIsNone(self.tracker.get_user('op'))
+        self.assertIsNotNone(self.tracker.get_user('plain'))
+
+    def test_mode(self):
+        self.lines([':Op!u@h MODE #chan +o-v+lk Plain Voice 10 key'])
+        self.assertEqual(self.tracker.modes_in('plain', '#chan'), 'o')
+        self.assertEqual(self.tracker.modes_in('voice', '#chan'), '')
+        self.assertSetEqual(self.tracker.get_channel('#chan').modes, {'l', 'k'})
+
+        self.lines([':Op!u@h MODE #chan -l+m'])
+        self.assertSetEqual(self.tracker.get_channel('#chan').modes, {'k', 'm'})
+
+    def test_who(self):
+        self.lines([':server 352 pircel #chan ~u host.example server Plain G@ :0 Plain Person'])
+        user = self.tracker.get_user('plain')
+        self.assertEqual((user.username, user.host, user.realname), ('u', 'host.example', 'Plain Person'))
+        self.assertTrue(user.away)
+        self.assertEqual(self.tracker.modes_in('plain', '#chan'), 'o')
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
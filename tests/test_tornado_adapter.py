@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from pircel import lifecycle, protocol, tornado_adapter
+
+from tests import fake_server
+
+
+def chunk(data):
+    future = mock.MagicMock()
+    future.result.return_value = data
+    return future
+
+
+class TestBatchedLineStream(unittest.TestCase):
+    def setUp(self):
+        self.line_stream = tornado_adapter.LineStream(batched=True)
+        self.line_stream.connection = mock.MagicMock()
+        self.batches = []
+        self.line_stream.lines_callback = self.batches.append
+
+    def test_split_lines(self):
+        with mock.patch.object(tornado_adapter.ioloop, 'IOLoop'):
+            self.line_stream._handle_chunk(chunk(b'PING :a\r\n:s 001 n :hi\r\nPRIV'))
+            self.line_stream._handle_chunk(chunk(b'MSG #c :there\r\n'))
+            self.line_stream._handle_chunk(chunk(b'PING'))
+
+        self.assertListEqual(self.batches, [[b'PING :a\r', b':s 001 n :hi\r'], [b'PRIVMSG #c :there\r']])
+        self.assertEqual(self.line_stream._buffer, b'PING')
+
+    def test_line_callback_fallback(self):
+        lines = []
+        self.line_stream.lines_callback = None
+        self.line_stream.line_callback = lines.append
+        with mock.patch.object(tornado_adapter.ioloop, 'IOLoop'):
+            self.line_stream._handle_chunk(chunk(b'PING :a\nPING :b\n'))
+        self.assertListEqual(lines, [b'PING :a', b'PING :b'])
+
+
+class TestIRCClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):  # noqa
+        self.server = await fake_server.FakeIRCServer().start()
+
+        identity = mock.MagicMock()
+        identity.nick = 'pircel'
+        identity.username = 'pircel'
+        identity.realname = 'Percy Wendel'
+        self.server_handler = protocol.IRCServerHandler(identity)
+        self.client = tornado_adapter.IRCClient(tornado_adapter.LineStream(), self.server_handler,
+                                                backoff=lifecycle.Backoff(base=0.01))
+
+    async def asyncTearDown(self):  # noqa
+        self.client.close()
+        await self.server.stop()
+
+    async def test_reconnect_and_rejoin(self):
+        self.client.connect('127.0.0.1', self.server.port, insecure=True, channels=['#a', '#b'])
+        await self.server.wait_for(lambda lines: 'JOIN #a,#b' in lines)
+
+        self.server.clients[0].writer.close()
+        await self.server.wait_for(lambda lines: lines.count('JOIN #a,#b') == 2)
+        self.assertEqual(self.client.lifecycle.reconnects, 1)
+        self.assertEqual(self.server.received.count('CAP LS 302'), 2)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import peewee
+
+from pircel import writebehind
+
+
+database = peewee.SqliteDatabase(None)
+
+
+class Line(peewee.Model):
+    channel = peewee.CharField()
+    nick = peewee.CharField()
+    text = peewee.TextField()
+
+    class Meta:
+        database = database
+
+
+class TestWriteBehind(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        database.init(os.path.join(self.directory.name, 'test.db'))
+        database.create_tables([Line])
+        self.write_behind = writebehind.WriteBehind(database, max_batch=10, max_delay=60)
+
+    def tearDown(self):
+        self.write_behind.close()
+        database.close()
+        self.directory.cleanup()
+
+    def test_batched(self):
+        for i in range(25):
+            self.write_behind.insert(Line, channel='#c', nick='n', text=str(i))
+        self.assertTrue(self.write_behind.flush(timeout=5))
+
+        self.assertListEqual([line.text for line in Line.select().order_by(Line.id)], [str(i) for i in range(25)])
+        self.assertEqual(self.write_behind.written, 25)
+        self.assertLess(self.write_behind.batches, 25)
+
+    def test_reads_see_pending(self):
+        self.write_behind.insert(Line, channel='#c', nick='n', text='written')
+        self.write_behind.flush(timeout=5)
+        self.write_behind.insert(Line, channel='#c', nick='n', text='pending')
+        self.write_behind.insert(Line, channel='#d', nick='n', text='elsewhere')
+        self.write_behind.update(Line, {'nick': 'm'}, nick='n')
+
+        self.assertEqual(Line.select().count(), 1)  # max_delay is long enough that the rest are still queued
+        lines = self.write_behind.select(Line, channel='#c')
+        self.assertListEqual([(line.text, line.nick) for line in lines], [('written', 'm'), ('pending', 'm')])
+        self.assertListEqual([line.text for line in self.write_behind.select(Line, nick='m')],
+                             ['written', 'pending', 'elsewhere'])
+
+    def test_backpressure(self):
+        write_behind = writebehind.WriteBehind(database, max_batch=1000, max_delay=60, max_backlog=5, timeout=0.01)
+        for i in range(5):
+            write_behind.insert(Line, channel='#c', nick='n', text=str(i))
+        with self.assertRaises(writebehind.BacklogFullError):
+            write_behind.insert(Line, channel='#c', nick='n', text='too many')
+        self.assertEqual(write_behind.blocked, 1)
+
+        write_behind.close()
+        self.assertEqual(Line.select().count(), 5)
+
+    def test_closed_while_blocked(self):
+        write_behind = writebehind.WriteBehind(database, max_batch=1000, max_delay=60, max_backlog=5)
+        for i in range(5):
+            write_behind.insert(Line, channel='#c', nick='n', text=str(i))
+
+        errors = []
+
+        def insert():
+            try:
+                write_behind.insert(Line, channel='#c', nick='n', text='late')
+            except writebehind.Error as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=insert)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while not write_behind.blocked and time.monotonic() < deadline:
+            time.sleep(0.001)
+        write_behind.close()
+        thread.join(5)
+
+        self.assertEqual(len(errors), 1)
+        self.assertNotIsInstance(errors[0], writebehind.BacklogFullError)
+        self.assertEqual(Line.select().count(), 5)
+
+    def test_failed_write_counted(self):
+        with mock.patch.object(Line, 'insert_many', side_effect=peewee.OperationalError('disk full')):
+            for i in range(3):
+                self.write_behind.insert(Line, channel='#c', nick='n', text=str(i))
+            with self.assertLogs('pircel.writebehind', 'ERROR'):
+                self.assertTrue(self.write_behind.flush(timeout=5))
+        self.assertEqual(self.write_behind.dropped, 3)
+        self.assertEqual(self.write_behind.written, 0)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()